@@ -0,0 +1,54 @@
+import asyncio
+import threading
+from collections import defaultdict
+
+
+class NotificationBroker:
+    """
+    Pub/sub en memoria del proceso. Los streams de notificaciones se suscriben por usuario
+    y los casos de uso publican eventos desde cualquier hilo
+    """
+
+    def __init__(self, max_queue_size=100):
+        self.max_queue_size = max_queue_size
+        self._subscribers = defaultdict(set)
+        self._lock = threading.Lock()
+
+    def subscribe(self, user_id):
+        """
+        Suscribe al usuario y retorna la cola donde se reciben sus eventos.
+        Se debe llamar desde el event loop que va a leer la cola
+        """
+        queue = asyncio.Queue(maxsize=self.max_queue_size)
+        with self._lock:
+            self._subscribers[user_id].add((asyncio.get_running_loop(), queue))
+        return queue
+
+    def unsubscribe(self, user_id, queue):
+        """
+        Quita la suscripcion de la cola del usuario
+        """
+        with self._lock:
+            subscribers = self._subscribers[user_id]
+            subscribers.difference_update({item for item in subscribers if item[1] is queue})
+            if not subscribers:
+                del self._subscribers[user_id]
+
+    def publish(self, user_id, event):
+        """
+        Envia un evento a todas las colas suscritas del usuario
+        """
+        with self._lock:
+            subscribers = list(self._subscribers.get(user_id, ()))
+        for loop, queue in subscribers:
+            loop.call_soon_threadsafe(self._put, queue, event)
+
+    @staticmethod
+    def _put(queue, event):
+        # Si el cliente no lee a tiempo se descarta el evento mas antiguo
+        if queue.full():
+            queue.get_nowait()
+        queue.put_nowait(event)
+
+
+broker = NotificationBroker()
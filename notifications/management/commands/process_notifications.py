@@ -0,0 +1,63 @@
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from django.core.management.base import BaseCommand
+from django.db import connection
+
+from notifications.models import OutboxStatus
+from notifications.usecase import NotificationUseCase
+
+
+class Command(BaseCommand):
+    """
+    Comando que entrega en segundo plano las notificaciones agregadas al outbox
+    """
+    help = 'Entrega por lotes las notificaciones pendientes del outbox'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=100,
+                            help='Cantidad de entradas a procesar por lote')
+        parser.add_argument('--threads', type=int, default=4,
+                            help='Cantidad de hilos que entregan las entradas')
+        parser.add_argument('--sleep', type=float, default=1.0,
+                            help='Segundos a esperar cuando no hay entradas pendientes')
+        parser.add_argument('--max-attempts', type=int, default=5,
+                            help='Cantidad de intentos antes de marcar una entrada como fallida')
+        parser.add_argument('--once', action='store_true',
+                            help='Vaciar el outbox y terminar')
+
+    def handle(self, *args, **options):
+        self.max_attempts = options['max_attempts']
+        try:
+            with ThreadPoolExecutor(max_workers=options['threads']) as executor:
+                while True:
+                    entry_ids = NotificationUseCase.get_pending_outbox_ids(options['batch_size'])
+                    if entry_ids:
+                        self.process_batch(executor, entry_ids)
+                    elif options['once']:
+                        break
+                    else:
+                        time.sleep(options['sleep'])
+        except KeyboardInterrupt:
+            self.stdout.write('Worker de notificaciones detenido')
+
+    def process_batch(self, executor, entry_ids):
+        start = time.monotonic()
+        results = list(executor.map(self.deliver, entry_ids))
+        elapsed = time.monotonic() - start
+        metrics = NotificationUseCase.get_outbox_metrics()
+        self.stdout.write(
+            f'Lote de {len(entry_ids)} entrada/s en {elapsed:.2f}s: '
+            f'{results.count(OutboxStatus.DELIVERED)} entregada/s, '
+            f'{results.count(OutboxStatus.PENDING)} a reintentar, '
+            f'{results.count(OutboxStatus.FAILED)} fallida/s | '
+            f'pendientes: {metrics["queue_depth"]}, '
+            f'demora: {metrics["avg_delivery_lag_seconds"]:.2f}s, '
+            f'throughput: {metrics["throughput_per_minute"]:.1f}/min')
+
+    def deliver(self, entry_id):
+        try:
+            return NotificationUseCase.deliver_outbox_entry(entry_id, self.max_attempts)
+        finally:
+            # Cada hilo usa su propia conexion a la base de datos
+            connection.close()
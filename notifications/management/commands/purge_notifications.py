@@ -0,0 +1,51 @@
+import time
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from notifications.usecase import NotificationUseCase
+
+
+class Command(BaseCommand):
+    """
+    Comando que aplica la politica de retencion de notificaciones
+    """
+    help = ('Elimina las notificaciones leidas antiguas, archiva las no leidas antiguas y elimina '
+            'las entradas antiguas entregadas o fallidas del outbox, por lotes')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--read-days', type=int, default=settings.NOTIFICATIONS_READ_RETENTION_DAYS,
+                            help='Eliminar las notificaciones leidas con mas de estos dias')
+        parser.add_argument('--unread-days', type=int, default=settings.NOTIFICATIONS_UNREAD_RETENTION_DAYS,
+                            help='Archivar las notificaciones no leidas con mas de estos dias')
+        parser.add_argument('--outbox-days', type=int, default=settings.NOTIFICATIONS_OUTBOX_RETENTION_DAYS,
+                            help='Eliminar las entradas entregadas o fallidas del outbox con mas de estos dias')
+        parser.add_argument('--batch-size', type=int, default=1000,
+                            help='Cantidad de notificaciones a procesar por lote')
+        parser.add_argument('--sleep', type=float, default=0,
+                            help='Segundos a esperar entre lotes')
+
+    def handle(self, *args, **options):
+        now = timezone.now()
+        deleted = self.run_batches(NotificationUseCase.delete_read_notifications,
+                                   now - timedelta(days=options['read_days']), options)
+        self.stdout.write(f'{deleted} notificacion/es leida/s eliminada/s')
+        archived = self.run_batches(NotificationUseCase.archive_unread_notifications,
+                                    now - timedelta(days=options['unread_days']), options)
+        self.stdout.write(f'{archived} notificacion/es no leida/s archivada/s')
+        outbox = self.run_batches(NotificationUseCase.delete_outbox_entries,
+                                  now - timedelta(days=options['outbox_days']), options)
+        self.stdout.write(f'{outbox} entrada/s del outbox eliminada/s')
+        self.stdout.write(self.style.SUCCESS(f'{deleted + archived} notificacion/es procesada/s'))
+
+    def run_batches(self, process_batch, before, options):
+        total = 0
+        while True:
+            processed = process_batch(before, options['batch_size'])
+            total += processed
+            if processed < options['batch_size']:
+                return total
+            if options['sleep']:
+                time.sleep(options['sleep'])
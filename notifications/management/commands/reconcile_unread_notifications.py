@@ -0,0 +1,14 @@
+from django.core.management.base import BaseCommand
+
+from notifications.usecase import NotificationUseCase
+
+
+class Command(BaseCommand):
+    """
+    Comando que corrige el contador de notificaciones no leidas de los usuarios
+    """
+    help = 'Recalcula el contador de notificaciones no leidas de cada usuario'
+
+    def handle(self, *args, **options):
+        fixed = NotificationUseCase.reconcile_unread_notifications()
+        self.stdout.write(self.style.SUCCESS(f'Contador de notificaciones corregido en {fixed} usuario/s'))
@@ -0,0 +1,21 @@
+# Generated by Django 4.1 on 2026-10-18 19:15
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('notifications', '0002_notificationoutbox'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='notification',
+            index=models.Index(fields=['user', 'read', 'created_at'], name='notificatio_user_id_90f4cc_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='notification',
+            index=models.Index(fields=['user', '-created_at', '-id'], name='notificatio_user_id_90f3d6_idx'),
+        ),
+    ]
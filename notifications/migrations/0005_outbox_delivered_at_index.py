@@ -0,0 +1,17 @@
+# Generated by Django 4.1 on 2026-10-18 20:00
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('notifications', '0004_notification_retention'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='notificationoutbox',
+            index=models.Index(fields=['status', 'delivered_at'], name='notificatio_status_65875e_idx'),
+        ),
+    ]
@@ -1,4 +1,5 @@
 from django.db import models
+from django.utils import timezone
 
 class Notification(models.Model):
     """
@@ -11,5 +12,58 @@ class Notification(models.Model):
     action_url = models.URLField(blank=True, null=True)
     created_at = models.DateTimeField(auto_now_add=True)
 
+    class Meta:
+        indexes = [
+            models.Index(fields=['user', 'read', 'created_at']),
+            # Para paginar la bandeja de entrada por (created_at, id)
+            models.Index(fields=['user', '-created_at', '-id']),
+            # Para el comando de retencion purge_notifications
+            models.Index(fields=['read', 'created_at']),
+        ]
+
     def __str__(self):
         return self.message
+
+class NotificationArchive(models.Model):
+    """
+    Notificaciones no leidas antiguas que se sacaron de la bandeja de entrada por la politica de retencion
+    """
+    user = models.ForeignKey('users.CustomUser', on_delete=models.CASCADE)
+    title = models.CharField(max_length=100)
+    content = models.CharField(max_length=1000)
+    action_url = models.URLField(blank=True, null=True)
+    created_at = models.DateTimeField()
+    archived_at = models.DateTimeField(auto_now_add=True)
+
+    def __str__(self):
+        return self.title
+
+class OutboxStatus(models.TextChoices):
+    PENDING = 'PENDING', 'Pendiente'
+    DELIVERED = 'DELIVERED', 'Entregado'
+    FAILED = 'FAILED', 'Fallido'
+
+class NotificationOutbox(models.Model):
+    """
+    Notificaciones pendientes de entregar a una lista de usuarios. Los casos de uso solo
+    agregan una fila y el comando process_notifications crea las notificaciones en segundo plano.
+    """
+    idempotency_key = models.CharField(max_length=255, unique=True, null=True)
+    recipients = models.JSONField()
+    title = models.CharField(max_length=100)
+    content = models.CharField(max_length=1000)
+    status = models.CharField(choices=OutboxStatus.choices, max_length=15, default=OutboxStatus.PENDING)
+    attempts = models.IntegerField(default=0)
+    last_error = models.TextField(blank=True, default='')
+    available_at = models.DateTimeField(default=timezone.now)
+    created_at = models.DateTimeField(auto_now_add=True)
+    delivered_at = models.DateTimeField(null=True)
+
+    def __str__(self):
+        return self.title
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['status', 'available_at']),
+            models.Index(fields=['status', 'delivered_at']),
+        ]
@@ -0,0 +1,101 @@
+import asyncio
+import json
+from importlib import import_module
+from io import BytesIO
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.contrib import auth
+from django.core.handlers.asgi import ASGIRequest
+from django.db import connection
+
+from .broker import broker
+from .usecase import NotificationUseCase
+
+
+def run_query(function, *args):
+    """
+    Ejecuta una consulta fuera del ciclo de request de Django y cierra la conexion,
+    para que los streams abiertos no retengan conexiones a la base de datos
+    """
+    try:
+        return function(*args)
+    finally:
+        connection.close()
+
+
+def get_stream_state(user_id, last_id):
+    """
+    Retorna la cantidad de notificaciones no leidas del usuario, el id de su ultima notificacion
+    y los titulos de las notificaciones creadas despues de last_id
+    """
+    return (NotificationUseCase.get_unread_count(user_id),
+            *NotificationUseCase.get_new_notifications(user_id, last_id))
+
+
+def get_scope_user(scope):
+    """
+    Obtiene el usuario de la sesion a partir de la cookie del request
+    """
+    request = ASGIRequest(scope, BytesIO())
+    engine = import_module(settings.SESSION_ENGINE)
+    request.session = engine.SessionStore(request.COOKIES.get(settings.SESSION_COOKIE_NAME))
+    return auth.get_user(request)
+
+
+async def notification_stream(scope, receive, send):
+    """
+    Aplicacion ASGI que envia por Server-Sent Events la cantidad de notificaciones no leidas
+    del usuario logueado y el titulo de las nuevas notificaciones, leidos de la base de datos.
+    Los eventos publicados en este proceso despiertan el stream al instante. Las notificaciones
+    creadas en otro proceso (process_notifications) se detectan consultando la base de datos cada
+    NOTIFICATIONS_STREAM_POLL_SECONDS segundos
+    """
+    user = await sync_to_async(run_query, thread_sensitive=False)(get_scope_user, scope)
+    if not user.is_authenticated:
+        await send({'type': 'http.response.start', 'status': 401, 'headers': []})
+        await send({'type': 'http.response.body'})
+        return
+
+    queue = broker.subscribe(user.id)
+    disconnected = asyncio.ensure_future(wait_disconnect(receive))
+    try:
+        await send({
+            'type': 'http.response.start',
+            'status': 200,
+            'headers': [
+                (b'content-type', b'text/event-stream'),
+                (b'cache-control', b'no-cache'),
+                (b'x-accel-buffering', b'no'),
+            ],
+        })
+        last_unread = None
+        last_id = None
+        while True:
+            unread, last_id, titles = await sync_to_async(run_query, thread_sensitive=False)(
+                get_stream_state, user.id, last_id)
+            if titles or unread != last_unread:
+                for title in titles or [None]:
+                    data = json.dumps({'unread': unread, 'title': title})
+                    await send({'type': 'http.response.body', 'body': f'data: {data}\n\n'.encode(), 'more_body': True})
+                last_unread = unread
+            else:
+                # Comentario para mantener viva la conexion
+                await send({'type': 'http.response.body', 'body': b': ping\n\n', 'more_body': True})
+
+            next_event = asyncio.ensure_future(queue.get())
+            done, _ = await asyncio.wait({next_event, disconnected}, timeout=settings.NOTIFICATIONS_STREAM_POLL_SECONDS,
+                                         return_when=asyncio.FIRST_COMPLETED)
+            if disconnected in done:
+                next_event.cancel()
+                break
+            if next_event not in done:
+                next_event.cancel()
+    finally:
+        disconnected.cancel()
+        broker.unsubscribe(user.id, queue)
+
+
+async def wait_disconnect(receive):
+    while (await receive())['type'] != 'http.disconnect':
+        pass
@@ -4,4 +4,7 @@ from . import views
 urlpatterns = [
     path('', views.NotificationView.as_view(), name='index'),
     path('<int:notification_id>/mark', views.NotificationMarkView.as_view(), name='mark'),
+    path('mark-all', views.NotificationMarkAllView.as_view(), name='mark-all'),
+    path('stream', views.NotificationStreamView.as_view(), name='stream'),
+    path('outbox/metrics', views.NotificationOutboxMetricsView.as_view(), name='outbox-metrics'),
 ]
@@ -1,5 +1,15 @@
-from .models import Notification
+from base64 import urlsafe_b64decode, urlsafe_b64encode
+from datetime import datetime, timedelta
+from collections import Counter, defaultdict
+from .broker import broker
+from .models import Notification, NotificationArchive, NotificationOutbox, OutboxStatus
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Avg, Count, DurationField, ExpressionWrapper, F, IntegerField, Max, Min, OuterRef, Q, Subquery
+from django.db.models.functions import Coalesce, Greatest
 from django.urls import reverse
+from django.utils import timezone
+from users.models import CustomUser
 from projects.usecase import ProjectUseCase
 from sprints.usecase import SprintUseCase
 
@@ -23,16 +33,309 @@ class NotificationUseCase:
             user=user).order_by('-created_at')
         return notifications
 
+    @staticmethod
+    def get_notifications_page(user, cursor=None, page_size=20):
+        """
+        Obtiene una pagina de notificaciones del usuario, las mas recientes primero.
+        Se pagina por (created_at, id) a partir del cursor, por lo que el costo no depende
+        de la cantidad de notificaciones anteriores. Retorna las notificaciones y el cursor de
+        la siguiente pagina, o None si no hay mas
+        """
+        notifications = Notification.objects.filter(user=user)
+        position = NotificationUseCase.decode_cursor(cursor)
+        if position:
+            created_at, notification_id = position
+            notifications = notifications.filter(
+                Q(created_at__lt=created_at) | Q(created_at=created_at, id__lt=notification_id))
+        notifications = list(notifications.order_by('-created_at', '-id')[:page_size + 1])
+        next_cursor = None
+        if len(notifications) > page_size:
+            notifications = notifications[:page_size]
+            next_cursor = NotificationUseCase.encode_cursor(notifications[-1])
+        return notifications, next_cursor
+
+    @staticmethod
+    def encode_cursor(notification):
+        """
+        Codifica la posicion de una notificacion para usarla como cursor en la url
+        """
+        value = f'{notification.created_at.isoformat()}|{notification.id}'
+        return urlsafe_b64encode(value.encode()).decode()
+
+    @staticmethod
+    def decode_cursor(cursor):
+        """
+        Decodifica un cursor. Retorna None si el cursor no es valido
+        """
+        if not cursor:
+            return None
+        try:
+            created_at, notification_id = urlsafe_b64decode(cursor.encode()).decode().split('|')
+            return datetime.fromisoformat(created_at), int(notification_id)
+        except ValueError:
+            return None
+
+    @staticmethod
+    def get_unread_count(user_id):
+        """
+        Obtiene la cantidad de notificaciones no leidas del usuario
+        """
+        return CustomUser.objects.filter(id=user_id).values_list('unread_notifications_count', flat=True).first()
+
+    @staticmethod
+    def get_new_notifications(user_id, after_id=None, limit=5):
+        """
+        Retorna el id de la ultima notificacion del usuario y los titulos de hasta limit notificaciones
+        creadas despues de after_id, las mas antiguas primero. Si after_id es None solo se retorna el id
+        """
+        notifications = Notification.objects.filter(user_id=user_id)
+        if after_id is None:
+            return notifications.aggregate(last_id=Max('id'))['last_id'] or 0, []
+        rows = list(notifications.filter(id__gt=after_id).order_by('-id').values_list('id', 'title')[:limit])
+        if not rows:
+            return after_id, []
+        return rows[0][0], [title for _, title in reversed(rows)]
+
+    @staticmethod
+    def publish(user_ids, title=None):
+        """
+        Avisa a los streams de notificaciones abiertos en este proceso que cambiaron las
+        notificaciones de los usuarios, una vez confirmada la transaccion. Los streams leen los
+        titulos de la base de datos, asi tambien reciben los de las notificaciones creadas en
+        otro proceso (process_notifications), con una demora de hasta NOTIFICATIONS_STREAM_POLL_SECONDS
+        """
+        user_ids = list(user_ids)
+        transaction.on_commit(
+            lambda: [broker.publish(user_id, {'title': title}) for user_id in user_ids])
+
+    @staticmethod
+    def create_notification(user, title, content):
+        """
+        Crea una notificacion para el usuario y aumenta su contador de no leidas
+        """
+        with transaction.atomic():
+            notification = Notification.objects.create(user=user, content=content, title=title)
+            CustomUser.objects.filter(id=user.id).update(
+                unread_notifications_count=F('unread_notifications_count') + 1)
+            NotificationUseCase.publish([user.id], title)
+        return notification
+
+    @staticmethod
+    def create_notifications(user_ids, title, content):
+        """
+        Crea la misma notificacion para varios usuarios con un solo INSERT y
+        aumenta sus contadores de no leidas con un solo UPDATE
+        """
+        user_ids = set(user_ids)
+        if not user_ids:
+            return []
+        with transaction.atomic():
+            notifications = Notification.objects.bulk_create([
+                Notification(user_id=user_id, content=content, title=title) for user_id in user_ids
+            ])
+            CustomUser.objects.filter(id__in=user_ids).update(
+                unread_notifications_count=F('unread_notifications_count') + 1)
+            NotificationUseCase.publish(user_ids, title)
+        return notifications
+
+    @staticmethod
+    def notify(user_ids, title, content, idempotency_key=None):
+        """
+        Notifica a una lista de usuarios. Si NOTIFICATIONS_ASYNC esta activo solo se agrega
+        una entrada al outbox y las notificaciones las crea el comando process_notifications
+        """
+        user_ids = sorted(set(user_ids))
+        if not user_ids:
+            return None
+        if not settings.NOTIFICATIONS_ASYNC:
+            return NotificationUseCase.create_notifications(user_ids, title, content)
+        return NotificationUseCase.enqueue_notifications(user_ids, title, content, idempotency_key)
+
+    @staticmethod
+    def enqueue_notifications(user_ids, title, content, idempotency_key=None):
+        """
+        Agrega una notificacion al outbox para ser entregada en segundo plano.
+        Si se indica una clave de idempotencia y ya existe una entrada con esa clave, no se agrega otra
+        """
+        data = {
+            'recipients': sorted(set(user_ids)),
+            'title': title,
+            'content': content,
+        }
+        if idempotency_key is None:
+            return NotificationOutbox.objects.create(**data)
+        entry, _ = NotificationOutbox.objects.get_or_create(idempotency_key=idempotency_key, defaults=data)
+        return entry
+
+    @staticmethod
+    def get_pending_outbox_ids(batch_size):
+        """
+        Obtiene los ids de las entradas del outbox listas para ser entregadas, las mas antiguas primero
+        """
+        return list(NotificationOutbox.objects.filter(
+            status=OutboxStatus.PENDING, available_at__lte=timezone.now()
+        ).order_by('available_at', 'id').values_list('id', flat=True)[:batch_size])
+
+    @staticmethod
+    def deliver_outbox_entry(entry_id, max_attempts):
+        """
+        Entrega una entrada del outbox. La entrada se bloquea y se marca como entregada en la
+        misma transaccion en que se crean las notificaciones, por lo que nunca se entrega dos veces.
+        Si falla se reintenta mas tarde hasta max_attempts veces.
+        Retorna el nuevo estado de la entrada o None si otro proceso ya la estaba entregando
+        """
+        try:
+            with transaction.atomic():
+                entry = NotificationOutbox.objects.select_for_update(skip_locked=True).filter(
+                    id=entry_id, status=OutboxStatus.PENDING).first()
+                if entry is None:
+                    return None
+                NotificationUseCase.create_notifications(entry.recipients, entry.title, entry.content)
+                entry.status = OutboxStatus.DELIVERED
+                entry.attempts += 1
+                entry.delivered_at = timezone.now()
+                entry.save(update_fields=['status', 'attempts', 'delivered_at'])
+            return entry.status
+        except Exception as error:
+            entry = NotificationOutbox.objects.get(id=entry_id)
+            entry.attempts += 1
+            entry.last_error = str(error)
+            entry.status = OutboxStatus.FAILED if entry.attempts >= max_attempts else OutboxStatus.PENDING
+            # Se espera cada vez mas entre reintentos
+            entry.available_at = timezone.now() + timedelta(seconds=2 ** entry.attempts)
+            entry.save(update_fields=['attempts', 'last_error', 'status', 'available_at'])
+            return entry.status
+
+    @staticmethod
+    def get_outbox_metrics(minutes=5):
+        """
+        Obtiene las metricas del outbox: entradas pendientes y fallidas, antiguedad de la entrada
+        pendiente mas vieja, y entregas, throughput y demora promedio de entrega de los ultimos minutos
+        """
+        now = timezone.now()
+        pending = NotificationOutbox.objects.filter(status=OutboxStatus.PENDING).aggregate(
+            total=Count('id'), oldest=Min('created_at'))
+        delivered = NotificationOutbox.objects.filter(
+            status=OutboxStatus.DELIVERED, delivered_at__gte=now - timedelta(minutes=minutes)
+        ).aggregate(
+            total=Count('id'),
+            lag=Avg(ExpressionWrapper(F('delivered_at') - F('created_at'), output_field=DurationField())))
+        return {
+            'queue_depth': pending['total'],
+            'oldest_pending_seconds': (now - pending['oldest']).total_seconds() if pending['oldest'] else 0,
+            'failed': NotificationOutbox.objects.filter(status=OutboxStatus.FAILED).count(),
+            'delivered': delivered['total'],
+            'throughput_per_minute': delivered['total'] / minutes,
+            'avg_delivery_lag_seconds': delivered['lag'].total_seconds() if delivered['lag'] else 0,
+        }
+
     @staticmethod
     def mark_notification_as_read(notification_id):
         """
-        Marca una notificacion como leida
+        Marca una notificacion como leida y disminuye el contador de no leidas del usuario
         """
-        notification = Notification.objects.get(id=notification_id)
-        notification.read = True
-        notification.save()
+        with transaction.atomic():
+            notification = Notification.objects.select_for_update().get(id=notification_id)
+            if not notification.read:
+                notification.read = True
+                notification.save(update_fields=['read'])
+                CustomUser.objects.filter(id=notification.user_id, unread_notifications_count__gt=0).update(
+                    unread_notifications_count=F('unread_notifications_count') - 1)
+                NotificationUseCase.publish([notification.user_id])
         return notification
 
+    @staticmethod
+    def mark_all_notifications_as_read(user):
+        """
+        Marca todas las notificaciones del usuario como leidas con un solo UPDATE y
+        disminuye su contador de no leidas en la cantidad marcada
+        """
+        with transaction.atomic():
+            updated = Notification.objects.filter(user=user, read=False).update(read=True)
+            if updated:
+                CustomUser.objects.filter(id=user.id).update(
+                    unread_notifications_count=Greatest(F('unread_notifications_count') - updated, 0))
+                NotificationUseCase.publish([user.id])
+        return updated
+
+    @staticmethod
+    def delete_read_notifications(before, batch_size):
+        """
+        Elimina un lote de hasta batch_size notificaciones leidas creadas antes de la fecha indicada.
+        Retorna la cantidad de notificaciones eliminadas
+        """
+        ids = list(Notification.objects.filter(read=True, created_at__lt=before).order_by(
+            'created_at').values_list('id', flat=True)[:batch_size])
+        if not ids:
+            return 0
+        deleted, _ = Notification.objects.filter(id__in=ids).delete()
+        return deleted
+
+    @staticmethod
+    def delete_outbox_entries(before, batch_size):
+        """
+        Elimina un lote de hasta batch_size entradas del outbox entregadas antes de la fecha indicada
+        o que fallaron definitivamente en su ultimo intento antes de esa fecha.
+        Retorna la cantidad de entradas eliminadas
+        """
+        ids = list(NotificationOutbox.objects.filter(
+            status=OutboxStatus.DELIVERED, delivered_at__lt=before).order_by(
+            'delivered_at').values_list('id', flat=True)[:batch_size])
+        if len(ids) < batch_size:
+            ids += NotificationOutbox.objects.filter(
+                status=OutboxStatus.FAILED, available_at__lt=before).order_by(
+                'available_at').values_list('id', flat=True)[:batch_size - len(ids)]
+        if not ids:
+            return 0
+        deleted, _ = NotificationOutbox.objects.filter(id__in=ids).delete()
+        return deleted
+
+    @staticmethod
+    def archive_unread_notifications(before, batch_size):
+        """
+        Mueve al archivo un lote de hasta batch_size notificaciones no leidas creadas antes de
+        la fecha indicada y disminuye los contadores de no leidas de sus usuarios.
+        Retorna la cantidad de notificaciones archivadas
+        """
+        with transaction.atomic():
+            notifications = list(Notification.objects.select_for_update().filter(
+                read=False, created_at__lt=before).order_by('created_at')[:batch_size])
+            if not notifications:
+                return 0
+            NotificationArchive.objects.bulk_create([
+                NotificationArchive(user_id=notification.user_id, title=notification.title,
+                                    content=notification.content, action_url=notification.action_url,
+                                    created_at=notification.created_at)
+                for notification in notifications
+            ])
+            Notification.objects.filter(id__in=[notification.id for notification in notifications]).delete()
+
+            # Un UPDATE por cada cantidad distinta de notificaciones archivadas por usuario
+            archived_by_user = Counter(notification.user_id for notification in notifications)
+            users_by_amount = {}
+            for user_id, amount in archived_by_user.items():
+                users_by_amount.setdefault(amount, []).append(user_id)
+            for amount, user_ids in users_by_amount.items():
+                CustomUser.objects.filter(id__in=user_ids).update(
+                    unread_notifications_count=Greatest(F('unread_notifications_count') - amount, 0))
+            NotificationUseCase.publish(archived_by_user)
+        return len(notifications)
+
+    @staticmethod
+    def reconcile_unread_notifications():
+        """
+        Recalcula el contador de notificaciones no leidas de los usuarios cuyo valor
+        no coincide con las notificaciones guardadas. Retorna la cantidad de usuarios corregidos
+        """
+        unread = Notification.objects.filter(user_id=OuterRef('pk'), read=False).order_by().values(
+            'user_id').annotate(total=Count('id')).values('total')
+        real_count = Coalesce(Subquery(unread, output_field=IntegerField()), 0)
+        user_ids = list(CustomUser.objects.annotate(real_count=real_count).exclude(
+            unread_notifications_count=F('real_count')).values_list('id', flat=True))
+        # El conteo se vuelve a calcular en el UPDATE para no pisar notificaciones creadas mientras tanto
+        CustomUser.objects.filter(id__in=user_ids).update(unread_notifications_count=real_count)
+        return len(user_ids)
+
     @staticmethod
     def notify_add_member_to_project(user, project):
         """
@@ -43,7 +346,7 @@ class NotificationUseCase:
         project_str = f"<a href='{url}'>{project.name}</a>"
         content = f'Ahora eres nuevo miembro del proyecto {project_str}'
         title = f"Agregado al proyecto {project.name}"
-        Notification.objects.create(user=user, content=content, title=title)
+        NotificationUseCase.notify([user.id], title, content)
 
     @staticmethod
     def notify_assign_us(user, user_story):
@@ -56,7 +359,7 @@ class NotificationUseCase:
         us_str = f"<a href='{url}'>{user_story.code}</a>"
         content = f'Se te ha asignado la US {us_str}'
         title = f"US asignado {user_story.code}"
-        Notification.objects.create(user=user, content=content, title=title)
+        NotificationUseCase.notify([user.id], title, content)
 
     @staticmethod
     def notify_deassign_us(user, user_story):
@@ -69,7 +372,7 @@ class NotificationUseCase:
         us_str = f"<a href='{url}'>{user_story.code}</a>"
         content = f'Se te ha desasignado la US {us_str}'
         title = f"US desasignado {user_story.code}"
-        Notification.objects.create(user=user, content=content, title=title)
+        NotificationUseCase.notify([user.id], title, content)
 
     @staticmethod
     def notify_add_member_to_sprint(sprint_member):
@@ -84,7 +387,7 @@ class NotificationUseCase:
         sprint_str = f"<a href='{url}'>{sprint.name}</a>"
         content = f'Se te ha agregado al {sprint_str} con una carga de trabajo igual a {sprint_member.workload} horas'
         title = f"Agregado al sprint {sprint.name}"
-        Notification.objects.create(user=user, content=content, title=title)
+        NotificationUseCase.notify([user.id], title, content)
 
     @staticmethod
     def notify_comment_us(user_story):
@@ -98,7 +401,7 @@ class NotificationUseCase:
         us_str = f"<a href='{url}'>{user_story.code}</a>"
         content = f'Se ha creado un comentario en la US {us_str}'
         title = f"Comentario en US {user_story.code}"
-        Notification.objects.create(user=user, content=content, title=title)
+        NotificationUseCase.notify([user.id], title, content)
 
     @staticmethod
     def notify_change_us_column(user_story, scrum_master_email):
@@ -113,31 +416,89 @@ class NotificationUseCase:
         new_column = user_story.column_name
         content = f'Se ha cambiado la columna de la US {us_str} a {new_column} por el scrum master {scrum_master_email}'
         title = f"Cambio de columna en US {user_story.code}"
-        Notification.objects.create(user=user, content=content, title=title)
+        NotificationUseCase.notify([user.id], title, content)
 
     @staticmethod
     def notify_done_us(user_story):
         """
         Notifica a los scrum masters de un proyecto que una us está en la columna DONE
         """
-        project = user_story.sprint.project
-        project_members = ProjectUseCase.get_project_scrum_masters(project.id)
+        project_id = user_story.project_id
+        project_members = ProjectUseCase.get_project_scrum_masters(project_id)
 
         # Para no notificar al usuario asignado que puede ser scrum master del proyecto
-        if(user_story.sprint_member):
+        if(user_story.sprint_member_id):
             project_members = project_members.exclude(
-                user__id=user_story.sprint_member.user.id)
+                user__sprintmember__id=user_story.sprint_member_id)
 
         url = reverse('projects:project-backlog-detail',
-                      kwargs={'project_id': project.id, 'us_id': user_story.id})
+                      kwargs={'project_id': project_id, 'us_id': user_story.id})
         us_str = f"<a href='{url}'>{user_story.code}</a>"
 
         content = f'La US {us_str} ha sido movida a la columna DONE'
         title = f"US {user_story.code} en DONE"
 
-        for project_member in project_members:
-            Notification.objects.create(
-                user=project_member.user, content=content, title=title)
+        NotificationUseCase.notify(
+            project_members.values_list('user_id', flat=True), title, content)
+
+    @staticmethod
+    def notify_moved_user_stories(user_stories, logged_user):
+        """
+        Notifica el movimiento de varias us con una sola notificacion por destinatario: a cada
+        usuario asignado las us suyas que cambiaron de columna y a los scrum masters las us que
+        llegaron a la columna DONE. Los destinatarios con el mismo contenido se agrupan
+        """
+        if not user_stories:
+            return
+        if len(user_stories) == 1:
+            user_story = user_stories[0]
+            assigned_user = user_story.sprint_member.user if user_story.sprint_member else None
+            if assigned_user and logged_user.id != assigned_user.id:
+                NotificationUseCase.notify_change_us_column(user_story, logged_user.email)
+            if user_story.is_done:
+                NotificationUseCase.notify_done_us(user_story)
+            return
+
+        project_id = user_stories[0].project_id
+        us_links = {}
+        for user_story in user_stories:
+            url = reverse('projects:project-backlog-detail',
+                          kwargs={'project_id': project_id, 'us_id': user_story.id})
+            us_links[user_story.id] = f"<a href='{url}'>{user_story.code}</a>"
+
+        moved_by_user = defaultdict(list)
+        for user_story in user_stories:
+            assigned_user = user_story.sprint_member.user if user_story.sprint_member else None
+            if assigned_user and logged_user.id != assigned_user.id:
+                moved_by_user[assigned_user.id].append(user_story)
+
+        done_by_user = defaultdict(list)
+        done_user_stories = [user_story for user_story in user_stories if user_story.is_done]
+        if done_user_stories:
+            scrum_master_ids = list(ProjectUseCase.get_project_scrum_masters(project_id).values_list('user_id', flat=True))
+            for user_story in done_user_stories:
+                # Para no notificar al usuario asignado que puede ser scrum master del proyecto
+                assigned_id = user_story.sprint_member.user_id if user_story.sprint_member else None
+                for user_id in scrum_master_ids:
+                    if user_id != assigned_id:
+                        done_by_user[user_id].append(user_story)
+
+        recipients = defaultdict(list)
+        for user_id in moved_by_user.keys() | done_by_user.keys():
+            lines = []
+            moved = moved_by_user.get(user_id, [])
+            done = done_by_user.get(user_id, [])
+            if moved:
+                changes = ', '.join(f'{us_links[us.id]} a {us.column_name}' for us in moved)
+                lines.append(f'Se ha cambiado la columna de las US {changes} por el scrum master {logged_user.email}')
+            if done:
+                codes = ', '.join(us_links[us.id] for us in done)
+                lines.append(f'Las US {codes} han sido movidas a la columna DONE')
+            title = f"Cambio de columna en {len({us.id for us in moved + done})} US"
+            recipients[(title, '<br>'.join(lines))].append(user_id)
+
+        for (title, content), user_ids in recipients.items():
+            NotificationUseCase.notify(user_ids, title, content)
 
     @staticmethod
     def notify_finish_project(user, project):
@@ -151,9 +512,9 @@ class NotificationUseCase:
         content = f"El proyecto {project_str} fue finalizado por {user.email}"
         title = f"Finalizo el proyecto {project.name}"
 
-        for project_user in project_users:
-            Notification.objects.create(
-                user=project_user, content=content, title=title)
+        NotificationUseCase.notify(
+            project_users.values_list('id', flat=True), title, content,
+            idempotency_key=f'finish_project:{project.id}')
 
     @staticmethod
     def notify_finish_sprint(user, project_id, sprint):
@@ -167,9 +528,9 @@ class NotificationUseCase:
         content = f"El {sprint_str} fue finalizado por {user.email}"
         title = f"Finalizo el sprint {sprint.number}"
 
-        for sprint_member in sprint_members:
-            Notification.objects.create(
-                user=sprint_member.user, content=content, title=title)
+        NotificationUseCase.notify(
+            sprint_members.values_list('user_id', flat=True), title, content,
+            idempotency_key=f'finish_sprint:{sprint.id}')
 
     @staticmethod
     def notify_start_sprint(user, project_id, sprint):
@@ -183,9 +544,9 @@ class NotificationUseCase:
         content = f"El {sprint_str} fue iniciado por {user.email}"
         title = f"Inicio el sprint {sprint.number}"
 
-        for sprint_member in sprint_members:
-            Notification.objects.create(
-                user=sprint_member.user, content=content, title=title)
+        NotificationUseCase.notify(
+            sprint_members.values_list('user_id', flat=True), title, content,
+            idempotency_key=f'start_sprint:{sprint.id}')
     
     @staticmethod
     def notify_add_scrum_master_to_project(user, project):
@@ -197,5 +558,5 @@ class NotificationUseCase:
         project_str = f"<a href='{url}'>{project.name}</a>"
         content = f'Ahora eres Scrum Master del proyecto {project_str}'
         title = f"Agregado al proyecto {project.name} como Scrum Master"
-        Notification.objects.create(user=user, content=content, title=title)
+        NotificationUseCase.notify([user.id], title, content)
 
@@ -1,8 +1,9 @@
+from django.http import HttpResponse, JsonResponse
 from django.shortcuts import render, redirect
 from django.views import View
 from django.urls import reverse
 from .usecase import NotificationUseCase
-from sga.mixin import CustomLoginMixin
+from sga.mixin import AdminMixin, CustomLoginMixin
 
 # Create your views here.
 
@@ -14,10 +15,12 @@ class NotificationView(CustomLoginMixin, View):
     template_name = 'notifications.html'
 
     def get(self, request):
-        notifications = NotificationUseCase.get_notifications(
-            request.user)
+        notifications, next_cursor = NotificationUseCase.get_notifications_page(
+            request.user, request.GET.get('cursor'))
         context = {
-            'notifications': notifications
+            'notifications': notifications,
+            'next_cursor': next_cursor,
+            'is_first_page': not request.GET.get('cursor'),
         }
         return render(request, self.template_name, context)
 
@@ -31,3 +34,32 @@ class NotificationMarkView(CustomLoginMixin, View):
     def get(self, request, notification_id):
         NotificationUseCase.mark_notification_as_read(notification_id)
         return redirect(reverse("notifications:index"))
+
+
+class NotificationMarkAllView(CustomLoginMixin, View):
+    """
+    Vista para marcar todas las notificaciones del usuario como leidas
+    """
+
+    def post(self, request):
+        NotificationUseCase.mark_all_notifications_as_read(request.user)
+        return redirect(reverse("notifications:index"))
+
+
+class NotificationOutboxMetricsView(AdminMixin, View):
+    """
+    Vista para obtener las metricas del outbox de notificaciones
+    """
+
+    def get(self, request):
+        return JsonResponse(NotificationUseCase.get_outbox_metrics())
+
+
+class NotificationStreamView(View):
+    """
+    El stream de notificaciones lo atiende sga.asgi. Si la aplicacion corre con WSGI se
+    responde 204 para que el navegador no vuelva a intentar conectarse
+    """
+
+    def get(self, request):
+        return HttpResponse(status=204)
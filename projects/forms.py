@@ -330,6 +330,7 @@ class FormEditUserStory(forms.Form):
         self.fields['business_value'] = forms.IntegerField( min_value=1, max_value=100 ,label='Valor de Negocio',widget=widgets.NumberInput())  # Valor de Negocio del US
         self.fields['technical_priority'] = forms.IntegerField(min_value=1, max_value=100 ,label='Prioridad Tecnica',widget=widgets.NumberInput())  # Prioridad Tecnica del US
         self.fields['estimation_time'] = forms.IntegerField(min_value=1, max_value=100 , label='Tiempo estimado',widget=widgets.NumberInput())  # Tiempo estimado del US
+        self.fields['version'] = forms.IntegerField(required=False, widget=forms.HiddenInput())  # Version del US que se esta editando
 
     def clean(self):
         cleaned_data = super().clean()
@@ -5,15 +5,25 @@ from django.urls import reverse
 from projects.usecase import ProjectUseCase
 from projects.models import Project, ProjectMember
 
+def get_project_context(request, project_id):
+    """
+    Retorna el contexto de autorizacion del usuario logueado en el proyecto.
+    Se carga una sola vez por request y lo comparten los mixins y las vistas
+    """
+    if not hasattr(request, 'project_contexts'):
+        request.project_contexts = {}
+    project_id = int(project_id)
+    if project_id not in request.project_contexts:
+        request.project_contexts[project_id] = ProjectUseCase.get_member_context(request.user.id, project_id)
+    return request.project_contexts[project_id]
+
 class ProjectAccessMixin(AccessMixin):
     """
     Clase que verifica si el usuario es miembro del proyecto
     """
     def dispatch(self, request, *args, **kwargs):
-        user = request.user
         project_id = self.kwargs['project_id']
-        member = ProjectMember.objects.filter(project=project_id, user=user).exists()
-        if not member:
+        if not get_project_context(request, project_id).is_member:
             self.raise_exception = True
             return self.handle_no_permission()
         return super().dispatch(request, *args, **kwargs)
@@ -47,10 +57,11 @@ class ProjectPermissionMixin(AccessMixin):
         return super().dispatch(request, *args, **kwargs)
 
     def has_permission(self, user, project_id):
+        project_context = get_project_context(self.request, project_id)
         # Se verifica que el usuario tenga el permiso
-        has_perm = ProjectUseCase.member_has_permissions(user.id, project_id, self.permissions)
+        has_perm = project_context.has_permissions(self.permissions)
         # Se verifica que el usuario tenga el rol
-        has_role = ProjectUseCase.member_has_roles(user.id, project_id, self.roles)
+        has_role = project_context.has_roles(self.roles)
         return has_perm or has_role
 
     def handle_no_permission(self):
@@ -73,7 +84,7 @@ class ProjectStatusMixin(AccessMixin):
     def dispatch(self, request, *args, **kwargs):
         # Se obtiene el project_id de la url
         project_id = self.kwargs['project_id']
-        project = Project.objects.get(id=project_id)
+        project = get_project_context(request, project_id).project
         if project.status == 'CANCELLED' or project.status == 'FINISHED':
             return self.handle_no_status()
         return super().dispatch(request, *args, **kwargs)
@@ -0,0 +1,66 @@
+from django.db.models.signals import m2m_changed, post_delete, post_save, pre_delete
+from django.dispatch import receiver
+
+from projects.models import ProjectHoliday, ProjectMember, Role
+from projects.usecase import ProjectUseCase
+
+@receiver(m2m_changed, sender=Role.permissions.through)
+def role_permissions_changed(sender, instance, action, reverse, pk_set, **kwargs):
+    """
+    Invalida el cache de permisos de los miembros con un rol cuyos permisos cambiaron
+    """
+    if action not in ('post_add', 'post_remove', 'pre_clear'):
+        return
+    if not reverse:
+        role_ids = [instance.id]
+    elif action == 'pre_clear':
+        role_ids = list(instance.role_set.values_list('id', flat=True))
+    else:
+        role_ids = pk_set
+    ProjectUseCase.invalidate_member_permissions(ProjectUseCase.members_with_roles(role_ids))
+
+@receiver(m2m_changed, sender=ProjectMember.roles.through)
+def project_member_roles_changed(sender, instance, action, reverse, pk_set, **kwargs):
+    """
+    Invalida el cache de permisos de los miembros cuyos roles cambiaron
+    """
+    if action not in ('post_add', 'post_remove', 'pre_clear'):
+        return
+    if not reverse:
+        members = [(instance.user_id, instance.project_id)]
+    elif action == 'pre_clear':
+        members = ProjectUseCase.members_with_roles([instance.id])
+    else:
+        members = ProjectMember.objects.filter(id__in=pk_set).values_list('user_id', 'project_id')
+    ProjectUseCase.invalidate_member_permissions(members)
+
+@receiver(post_save, sender=ProjectMember)
+def project_member_created(sender, instance, created, **kwargs):
+    """
+    Invalida el cache de permisos cuando un usuario pasa a ser miembro de un proyecto
+    """
+    if created:
+        ProjectUseCase.invalidate_member_permissions([(instance.user_id, instance.project_id)])
+
+@receiver(post_delete, sender=ProjectMember)
+def project_member_deleted(sender, instance, **kwargs):
+    """
+    Invalida el cache de permisos cuando un usuario deja de ser miembro de un proyecto
+    """
+    ProjectUseCase.invalidate_member_permissions([(instance.user_id, instance.project_id)])
+
+@receiver(pre_delete, sender=Role)
+def role_deleted(sender, instance, **kwargs):
+    """
+    Invalida el cache de permisos de los miembros con un rol que se elimina,
+    el borrado en cascada de la relacion no dispara m2m_changed
+    """
+    ProjectUseCase.invalidate_member_permissions(ProjectUseCase.members_with_roles([instance.id]))
+
+@receiver(post_save, sender=ProjectHoliday)
+@receiver(post_delete, sender=ProjectHoliday)
+def project_holiday_changed(sender, instance, **kwargs):
+    """
+    Invalida el cache del calendario de dias habiles cuando se crea, edita o borra un feriado
+    """
+    ProjectUseCase.invalidate_working_calendar(instance.project_id)
@@ -49,6 +49,7 @@ urlpatterns = [
 
     # API
     path('<int:project_id>/user-stories/<int:us_id>/', views.UserStoryEditApiView.as_view()),
+    path('<int:project_id>/user-stories/move/', views.UserStoryBatchMoveApiView.as_view(), name='user-stories-move'),
 
     # User Stories
     path('<int:project_id>/backlog/<int:user_story_id>/history/', include(('user_stories.urls', 'history'))),
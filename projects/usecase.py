@@ -1,11 +1,56 @@
-from django.db.models import Q
+from django.conf import settings
+from django.core.cache import cache
+from django.db import connection, transaction
+from django.db.models import F, Q, FilteredRelation, OuterRef, Subquery
+from django.utils import timezone
 from datetime import date
 
 from projects.models import Project, ProjectMember, ProjectStatus, ProjectHoliday
 from projects.models import Role, UserStoryType
+from projects.working_calendar import WorkingCalendar
 from users.models import CustomUser
 from user_stories.models import UserStory, UserStoryAttachment, UserStoryStatus, UserStoryHistory
 from sprints.models import Sprint, SprintStatus
+from sprints.rollups import RollupUseCase
+
+class ProjectMemberContext:
+    """
+    Contexto de autorizacion de un usuario en un proyecto: el proyecto,
+    el miembro del proyecto (si lo es) y los nombres de sus roles y permisos.
+    Si el proyecto no se paso, se obtiene recien cuando se lo necesita
+    """
+    def __init__(self, project_id, member_id, roles, permissions, project=None):
+        self.project_id = project_id
+        self.member_id = member_id
+        self.roles = roles
+        self.permissions = permissions
+        self._project = project
+
+    @property
+    def project(self):
+        if self._project is None:
+            self._project = Project.objects.filter(id=self.project_id).first()
+        return self._project
+
+    @property
+    def is_member(self):
+        return self.member_id is not None
+
+    @property
+    def is_scrum_master(self):
+        return 'Scrum Master' in self.roles
+
+    def has_roles(self, roles):
+        """
+        Verifica si el miembro tiene alguno de los roles dados
+        """
+        return not self.roles.isdisjoint(roles or [])
+
+    def has_permissions(self, permissions):
+        """
+        Verifica si el miembro tiene alguno de los permisos dados
+        """
+        return not self.permissions.isdisjoint(permissions or [])
 
 class ProjectUseCase:
     @staticmethod
@@ -52,24 +97,46 @@ class ProjectUseCase:
             return 0
 
     @staticmethod
-    def cancel_project(project_id):
-        """
-        Cancelar un Proyecto
-        """
-        project = Project.objects.get(id=project_id)
-        project.status = ProjectStatus.CANCELLED
-        project.end_date = date.today()
-        user_stories = UserStory.objects.filter(project=project)
-        for us in user_stories:
-            us.status = UserStoryStatus.CANCELLED
-            us.save()
-        sprints = Sprint.objects.filter(project=project)
-        for sprint in sprints:
-            sprint.status = SprintStatus.CANCELLED
-            sprint.end_date = date.today()
-            sprint.save()
+    def cancel_project(project_id, user=None):
+        """
+        Cancela un proyecto, sus sprints y sus us en una sola transaccion con un UPDATE por tabla
+        y un bulk_create del historial de las us canceladas. El historial queda a nombre de user,
+        o del Scrum Master si no se indica
+        """
+        today = date.today()
+        now = timezone.now()
+        with transaction.atomic():
+            project = Project.objects.select_for_update().get(id=project_id)
+            user_stories = UserStory.objects.filter(project_id=project_id).exclude(status=UserStoryStatus.CANCELLED)
+            rows = list(user_stories.select_for_update().values(
+                'id', 'code', 'title', 'description', 'business_value', 'technical_priority', 'estimation_time',
+                'sprint_priority', 'us_type_id', 'column', 'sprint_id', 'sprint_member_id'))
+            user_stories.update(status=UserStoryStatus.CANCELLED, version=F('version') + 1, updated_at=now)
+            Sprint.objects.filter(project_id=project_id).update(status=SprintStatus.CANCELLED, end_date=today, updated_at=now)
+            project.status = ProjectStatus.CANCELLED
+            project.end_date = today
+            project.save()
 
-        project.save()
+            members = ProjectMember.objects.filter(project_id=project_id)
+            project_member = (members.filter(user=user) if user else members.filter(roles__name='Scrum Master')).first()
+            if rows and project_member:
+                UserStoryHistory.objects.bulk_create([
+                    UserStoryHistory(user_story_id=row['id'], project_member=project_member, description='Estado', dataJson={
+                        "code": row['code'],
+                        "title": row['title'],
+                        "description": row['description'],
+                        "business_value": row['business_value'],
+                        "technical_priority": row['technical_priority'],
+                        "estimation_time": row['estimation_time'],
+                        "sprint_priority": row['sprint_priority'],
+                        "us_type": row['us_type_id'],
+                        "column": row['column'],
+                        "project": project_id,
+                        "sprint": row['sprint_id'] or 0,
+                        "sprint_member": row['sprint_member_id'] or 0
+                    })
+                    for row in rows
+                ])
         return project
 
     @staticmethod
@@ -93,6 +160,17 @@ class ProjectUseCase:
             columns=['TO DO', 'DOING', 'DONE']
         )
 
+    @staticmethod
+    def get_visible_projects(user):
+        """
+        Obtiene los proyectos que puede ver el usuario, los administradores ven todos los proyectos
+        y el resto solo aquellos de los que son miembros. El orden es estable para paginar
+        """
+        projects = Project.objects.all()
+        if not user.is_admin():
+            projects = projects.filter(projectmember__user_id=user.id)
+        return projects.order_by('-end_date', '-start_date', 'id')
+
     @staticmethod
     def get_non_members(project_id):
         """
@@ -159,23 +237,79 @@ class ProjectUseCase:
         """
         return UserStoryType.objects.filter(project_id=project_id)
 
+    @staticmethod
+    def member_permissions_cache_key(user_id, project_id):
+        """
+        Clave del cache donde se guardan los roles y permisos de un usuario en un proyecto
+        """
+        return f"project_member_permissions:{project_id}:{user_id}"
+
+    @staticmethod
+    def invalidate_member_permissions(members):
+        """
+        Elimina del cache los roles y permisos de una lista de pares (user_id, project_id).
+        El borrado se hace al confirmar la transaccion, si se hiciera antes otra peticion podria
+        volver a guardar en el cache los roles viejos
+        """
+        keys = [ProjectUseCase.member_permissions_cache_key(user_id, project_id) for user_id, project_id in members]
+        if keys:
+            transaction.on_commit(lambda: cache.delete_many(keys))
+
+    @staticmethod
+    def members_with_roles(role_ids):
+        """
+        Retorna los pares (user_id, project_id) de los miembros que tienen alguno de los roles
+        """
+        return ProjectMember.objects.filter(roles__id__in=role_ids).values_list('user_id', 'project_id').distinct()
+
+    @staticmethod
+    def get_member_context(user_id, project_id) -> ProjectMemberContext:
+        """
+        Obtiene el contexto de autorizacion de un usuario en un proyecto.
+        Los roles y permisos se leen del cache, si no estan se obtienen en una sola
+        consulta junto con el proyecto y el miembro del proyecto
+        """
+        cache_key = ProjectUseCase.member_permissions_cache_key(user_id, project_id)
+        cached = cache.get(cache_key)
+        if cached is not None:
+            member_id, roles, permissions = cached
+            return ProjectMemberContext(project_id, member_id, roles, permissions)
+
+        project_fields = [field.attname for field in Project._meta.concrete_fields]
+        rows = Project.objects.filter(id=project_id).annotate(
+            member=FilteredRelation('projectmember', condition=Q(projectmember__user_id=user_id))
+        ).values_list(*project_fields, 'member__id', 'member__roles__name', 'member__roles__permissions__name')
+
+        project = None
+        member_id = None
+        roles = set()
+        permissions = set()
+        for *project_values, row_member_id, role, permission in rows:
+            if project is None:
+                project = Project.from_db(rows.db, project_fields, project_values)
+                member_id = row_member_id
+            if role:
+                roles.add(role)
+            if permission:
+                permissions.add(permission)
+        # Solo se guarda en el cache si el proyecto existe
+        if project is not None:
+            cache.set(cache_key, (member_id, roles, permissions), settings.PROJECT_PERMISSIONS_CACHE_TIMEOUT)
+        return ProjectMemberContext(project_id, member_id, roles, permissions, project=project)
+
     @staticmethod
     def member_has_permissions(user_id, project_id, permissions):
         """
         Verifica si un miembro del proyecto tiene una lista de permisos
         """
-        return ProjectMember.objects.filter(
-           user_id=user_id,project_id=project_id, roles__permissions__name__in=permissions
-        ).exists()
+        return ProjectUseCase.get_member_context(user_id, project_id).has_permissions(permissions)
 
     @staticmethod
     def member_has_roles(user_id, project_id, roles):
         """
         Verifica si un miembro del proyecto tiene una lista de roles
         """
-        return ProjectMember.objects.filter(
-            user_id=user_id,project_id=project_id, roles__name__in=roles
-        ).exists()
+        return ProjectUseCase.get_member_context(user_id, project_id).has_roles(roles)
 
     @staticmethod
     def can_start_project(user_id, project_id):
@@ -273,9 +407,10 @@ class ProjectUseCase:
         return UserStory.objects.get(id=id)
 
     @staticmethod
-    def edit_user_story(id, title=None, description=None, business_value=None,technical_priority=None,estimation_time=None,us_type=None, column=None):
+    def edit_user_story(id, title=None, description=None, business_value=None,technical_priority=None,estimation_time=None,us_type=None, column=None, version=None):
         """
-        editar una us
+        editar una us. Si se indica la version, la us solo se edita si no cambio desde esa
+        version, si no se lanza StaleUserStoryError
         """
         data = {}
         if description:
@@ -292,9 +427,35 @@ class ProjectUseCase:
         if column is not None:
             data['column'] = column
 
-        UserStory.objects.filter(pk=id).update(**data)
+        # update() no actualiza los campos auto_now
+        data['updated_at'] = timezone.now()
+        ProjectUseCase.update_user_story_version(id, version, **data)
         return UserStory.objects.get(pk=id)
 
+    @staticmethod
+    def update_user_story_version(id, version=None, **data):
+        """
+        Actualiza una us y aumenta su version con un UPDATE condicional, sin bloquear la fila.
+        Si se indica la version y la us ya cambio, lanza StaleUserStoryError
+        """
+        user_stories = UserStory.objects.filter(pk=id)
+        if version is not None:
+            user_stories = user_stories.filter(version=version)
+        rollup_fields = {'sprint', 'sprint_member', 'estimation_time'} & data.keys()
+        with transaction.atomic():
+            if rollup_fields:
+                # Se bloquea la us para que la capacidad usada se actualice con los valores reales
+                old = UserStory.objects.select_for_update().filter(pk=id).values_list(
+                    'sprint_id', 'sprint_member_id', 'estimation_time').first()
+            if not user_stories.update(**data, version=F('version') + 1):
+                if version is not None:
+                    raise StaleUserStoryError('La historia de usuario fue modificada por otro usuario')
+                return
+            if rollup_fields and old:
+                new = [getattr(data.get(field, value), 'pk', data.get(field, value))
+                       for field, value in zip(('sprint', 'sprint_member', 'estimation_time'), old)]
+                RollupUseCase.move_used_capacity(old, tuple(new))
+
     @staticmethod
     def get_project_status(project_id):
         """
@@ -346,6 +507,40 @@ class ProjectUseCase:
         holiday.delete()
         return holiday
 
+    @staticmethod
+    def working_calendar_cache_key(project_id):
+        """
+        Clave del cache donde se guardan los feriados ordenados de un proyecto
+        """
+        return f"project_working_calendar:{project_id}"
+
+    @staticmethod
+    def invalidate_working_calendar(project_id):
+        """
+        Elimina del cache el calendario de dias habiles de un proyecto. Se borra en el momento, para
+        que la misma transaccion lea los feriados nuevos, y otra vez al confirmarla, por si otra
+        peticion guardo en el cache los feriados viejos mientras tanto
+        """
+        cache_key = ProjectUseCase.working_calendar_cache_key(project_id)
+        cache.delete(cache_key)
+        transaction.on_commit(lambda: cache.delete(cache_key))
+
+    @staticmethod
+    def get_working_calendar(project_id):
+        """
+        Retorna el calendario de dias habiles de un proyecto. Los feriados se leen del cache,
+        que se invalida al crear o borrar un feriado
+        """
+        cache_key = ProjectUseCase.working_calendar_cache_key(project_id)
+        holidays = cache.get(cache_key)
+        if holidays is None:
+            calendar = WorkingCalendar(ProjectHoliday.objects.filter(project_id=project_id).values_list('date', flat=True))
+            # Dentro de una transaccion se pueden leer feriados que todavia no se confirmaron
+            if not connection.in_atomic_block:
+                cache.set(cache_key, calendar.holidays, timeout=None)
+            return calendar
+        return WorkingCalendar(holidays)
+
     @staticmethod
     def delete_attachment(attachment_id):
         """
@@ -371,6 +566,41 @@ class ProjectUseCase:
         """
         return Sprint.objects.filter(project_id=project_id)
 
+    @staticmethod
+    def velocity_cache_key(sprint_id):
+        """
+        Clave del cache donde se guardan las horas estimadas y trabajadas de un sprint cerrado
+        """
+        return f"sprint_velocity:{sprint_id}"
+
+    @staticmethod
+    def get_project_velocity(project_id):
+        """
+        Retorna las horas estimadas y trabajadas de cada sprint iniciado del proyecto, en orden,
+        como una lista de (sprint_id, horas estimadas, horas trabajadas).
+        Los sprints finalizados o cancelados ya no cambian, por lo que se guardan en el cache sin
+        vencimiento; el resto se calcula con una sola consulta
+        """
+        closed_status = (SprintStatus.FINISHED, SprintStatus.CANCELLED)
+        sprints = list(Sprint.objects.filter(project_id=project_id).exclude(
+            status=SprintStatus.CREATED).order_by('number').values_list('id', 'status'))
+        closed_keys = {ProjectUseCase.velocity_cache_key(sprint_id): sprint_id
+                       for sprint_id, status in sprints if status in closed_status}
+        velocity = {closed_keys[key]: hours for key, hours in cache.get_many(list(closed_keys)).items()}
+
+        missing = [sprint_id for sprint_id, _ in sprints if sprint_id not in velocity]
+        if missing:
+            rows = Sprint.objects.filter(id__in=missing).with_computed_stats().values_list(
+                'id', 'status', 'computed_used_capacity', 'computed_hours_worked')
+            to_cache = {}
+            for sprint_id, status, estimated, worked in rows:
+                velocity[sprint_id] = (estimated, worked)
+                if status in closed_status:
+                    to_cache[ProjectUseCase.velocity_cache_key(sprint_id)] = (estimated, worked)
+            if to_cache:
+                cache.set_many(to_cache, timeout=None)
+        return [(sprint_id, *velocity[sprint_id]) for sprint_id, _ in sprints]
+
     @staticmethod
     def has_association_with_user_story(us_type_id):
         """
@@ -399,18 +629,22 @@ class ProjectUseCase:
 
     @staticmethod
     def get_projects_and_sprint_active(user):
-        projects = Project.objects.all()
+        """
+        Obtiene los proyectos activos de los que el usuario es miembro, junto con
+        el id de su sprint en progreso, en una sola consulta
+        """
+        active_sprint = Sprint.objects.filter(
+            project_id=OuterRef('pk'), status=SprintStatus.IN_PROGRESS
+        ).order_by('id').values('id')[:1]
+        #debe ser miembro del proyecto y el proyecto debe estar activo
+        projects = Project.objects.filter(
+            projectmember__user_id=user.id,
+            status__in=[ProjectStatus.CREATED, ProjectStatus.IN_PROGRESS]
+        ).annotate(sprint_id=Subquery(active_sprint)).order_by('id')
         project_html = []
         for project in projects:
-            #debe ser miembro del proyecto y el proyecto debe estar activo
-            if project.project_members.filter(id=user.id).exists() and (project.status == "CREATED" or project.status == "IN_PROGRESS"):
-                sprint = Sprint.objects.filter(project_id=project.id, status=SprintStatus.IN_PROGRESS).first()
-                project.name = project.name[:19] + "..." if len(project.name) > 22 else project.name
-                if sprint:
-                    project.sprint_id = sprint.id
-                else:
-                    project.sprint_id = None
-                project_html.append(project)
+            project.name = project.name[:19] + "..." if len(project.name) > 22 else project.name
+            project_html.append(project)
         return project_html
 
 class RoleUseCase:
@@ -498,7 +732,11 @@ class RoleUseCase:
             data['name'] = name
         if description:
             data['description'] = description
-        return Role.objects.filter(id=id).update(**data)
+        updated = Role.objects.filter(id=id).update(**data)
+        # El cache de los miembros guarda el nombre de sus roles
+        if name and name != role.name:
+            ProjectUseCase.invalidate_member_permissions(ProjectUseCase.members_with_roles([id]))
+        return updated
 
     @staticmethod
     def delete_role(id):
@@ -559,3 +797,9 @@ class RoleUseCase:
     @staticmethod
     def role_is_in_use(role_id):
         return ProjectMember.objects.filter(roles__id=role_id).count() > 0
+
+class StaleUserStoryError(Exception):
+    """
+    La historia de usuario cambio desde la version sobre la que se hizo la edicion
+    """
+    pass
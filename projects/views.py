@@ -8,12 +8,15 @@ from django.db.models.query import QuerySet
 from django.urls import reverse
 from django.http import JsonResponse, FileResponse
 from django.forms.models import model_to_dict
+from django.core.paginator import Paginator
+from django.db import transaction
+from django.utils import timezone
 
 from projects.forms import (FormCreateProject, FormCreateProjectMember, FormEditProjectMember, FormCreateUserStoryType, FormEditUserStoryType,
     FormCreateRole, ImportUserStoryTypeForm1, ImportUserStoryTypeForm2, FormCreateUserStory,FormEditUserStoryType, FormCreateRole,
     ImportUserStoryTypeForm1, ImportUserStoryTypeForm2,ImportRoleForm1, FormCreateUserStoryPO, FormEditUserStory, FormDeleteProject, FormCreateComment, FormCreateTask, FormCreateAttachment, FormCreateHoliday)
 from projects.models import Project, UserStoryType, ProjectMember, ProjectStatus
-from projects.usecase import ProjectUseCase, RoleUseCase
+from projects.usecase import ProjectUseCase, RoleUseCase, StaleUserStoryError
 from sprints.mixin import SprintAccessMixin
 from user_stories.models import UserStoryAttachment, UserStoryTask
 from user_stories.usecase import UserStoriesUseCase
@@ -33,22 +36,17 @@ class ProjectListView(VerifiedMixin, View):
     es una vista que todos los usuarios verificados pueden ver,
     pero solo los administradores pueden ver proyectos al cual no pertenecen
     """
+    paginate_by = 20
+
     def get(self, request):
         user: CustomUser = request.user
-        projects: Project = Project.objects.all().order_by('-end_date','-start_date')
-        if user.is_admin():
-            context = {
-                'admin': True,
-                'projects': projects
-            }
-        else:
-            context = {
-                "admin": False,
-                "projects": []
-            }
-            for project in projects:
-                if project.project_members.all().filter(id=user.id):
-                    context['projects'].append(project)
+        projects = ProjectUseCase.get_visible_projects(user)
+        page_obj = Paginator(projects, self.paginate_by).get_page(request.GET.get('page'))
+        context = {
+            "admin": user.is_admin(),
+            "projects": page_obj.object_list,
+            "page_obj": page_obj,
+        }
         context["backpage"] = reverse("index")
         return render(request, 'projects/index.html', context)
 
@@ -58,11 +56,10 @@ class ProjectView(CustomLoginMixin, ProjectAccessMixin, View):
     es una vista que todos los miembros del proyecto pueden ver
     """
     def get(self, request, project_id):
-        user = request.user
-        project: Project = Project.objects.get(id=project_id)
-        members: QuerySet = project.project_members.all()
-        can_start_project = ProjectUseCase.can_start_project(user.id, project_id)
-        can_finish_project = ProjectUseCase.can_finish_project(user.id, project_id)
+        project_context = get_project_context(request, project_id)
+        project: Project = project_context.project
+        can_start_project = project_context.is_scrum_master or project_context.has_permissions(['Iniciar Proyecto'])
+        can_finish_project = project_context.is_scrum_master or project_context.has_permissions(['Finalizar Proyecto'])
         context= {
             "object" : project,
             "can_start_project" : can_start_project,
@@ -72,7 +69,7 @@ class ProjectView(CustomLoginMixin, ProjectAccessMixin, View):
         return render(request, 'projects/project_detail.html', context)
 
     def post(self, request, project_id):
-        project: Project = Project.objects.get(id=project_id)
+        project: Project = get_project_context(request, project_id).project
         if project.status == ProjectStatus.CREATED:
             ProjectUseCase.start_project(project_id)
             messages.success(request, 'Proyecto iniciado correctamente')
@@ -143,8 +140,8 @@ class ProjectDeleteView(CustomLoginMixin, ProjectPermissionMixin, ProjectStatusM
     roles = ['Scrum Master']
 
     def get(self, request, project_id):
-        project = Project.objects.get(id=project_id)
-        data = vars(project)
+        project = get_project_context(request, project_id).project
+        data = model_to_dict(project, fields=['name', 'description', 'prefix'])
         scrum_master = ProjectMember.objects.get(project=project, roles__name="Scrum Master")
         data['scrum_master']=scrum_master.user.email
         form = self.form_class(initial=data)
@@ -155,7 +152,7 @@ class ProjectDeleteView(CustomLoginMixin, ProjectPermissionMixin, ProjectStatusM
         return render(request, 'projects/delete.html', context)
 
     def post(self, request, project_id):
-        project = ProjectUseCase.cancel_project(project_id)
+        project = ProjectUseCase.cancel_project(project_id, request.user)
         messages.success(request, f"Proyecto <strong>{project.name}</strong> cancelado correctamente")
         return redirect(reverse("projects:index"))
 
@@ -442,10 +439,18 @@ class ProjectMemberEditView(CustomLoginMixin, ProjectPermissionMixin, ProjectSta
 
         return render(request, 'projects/project_member_edit.html', {'form': form, 'project_id':project_id, 'member_id':member_id})
 
-class ProductBacklogView(CustomLoginMixin, ProjectAccessMixin, View):
+class ProductBacklogView(CustomLoginMixin, ProjectAccessMixin, ConditionalGetMixin, View):
     """
     Clase encargada de mostrar el product Backlog de un proyecto
     """
+    def get_etag_data(self, request, project_id):
+        project_context = get_project_context(request, project_id)
+        us_types = UserStoryType.objects.filter(project_id=project_id).values_list('id', 'name')
+        return (
+            sorted(project_context.roles), sorted(project_context.permissions), list(us_types),
+            self.get_change_marker(UserStory.objects.filter(project_id=project_id)),
+        )
+
     def get(self, request, project_id):
         user: CustomUser = request.user
         user_stories = []
@@ -493,10 +498,10 @@ class ProductBacklogCreateView(CustomLoginMixin, ProjectPermissionMixin, Project
     roles = ['Scrum Master', 'Product Owner']
 
     def get(self, request, project_id):
-        user = self.request.user
-        has_perm = ProjectUseCase.member_has_permissions(user.id, project_id, self.permissions)
-        has_role_SM = ProjectUseCase.member_has_roles(user.id, project_id, ['Scrum Master'])
-        has_role_PO = ProjectUseCase.member_has_roles(user.id, project_id, ['Product Owner'])
+        project_context = get_project_context(request, project_id)
+        has_perm = project_context.has_permissions(self.permissions)
+        has_role_SM = project_context.is_scrum_master
+        has_role_PO = project_context.has_roles(['Product Owner'])
         form = FormCreateUserStory(project_id)
         if has_perm or has_role_SM:
             form = FormCreateUserStory(project_id)
@@ -509,10 +514,10 @@ class ProductBacklogCreateView(CustomLoginMixin, ProjectPermissionMixin, Project
         return render(request, 'backlog/create.html', context)
 
     def post(self, request, project_id):
-        user = self.request.user
-        has_perm = ProjectUseCase.member_has_permissions(user.id, project_id, self.permissions)
-        has_role_SM = ProjectUseCase.member_has_roles(user.id, project_id, ['Scrum Master'])
-        has_role_PO = ProjectUseCase.member_has_roles(user.id, project_id, ['Product Owner'])
+        project_context = get_project_context(request, project_id)
+        has_perm = project_context.has_permissions(self.permissions)
+        has_role_SM = project_context.is_scrum_master
+        has_role_PO = project_context.has_roles(['Product Owner'])
         attachments = request.FILES.getlist('attachments')
         form = FormCreateUserStory(project_id, request.POST, request.FILES)
         if has_perm or has_role_SM:
@@ -527,7 +532,7 @@ class ProductBacklogCreateView(CustomLoginMixin, ProjectPermissionMixin, Project
             if not ('estimation_time' in cleaned_data):
                 cleaned_data['estimation_time'] = 0
             cleaned_data['attachments'] = attachments
-            code = Project.objects.get(id=project_id).prefix + "-" + str(ProjectUseCase.count_user_stories_by_project(project_id) + 1)
+            code = project_context.project.prefix + "-" + str(ProjectUseCase.count_user_stories_by_project(project_id) + 1)
             ProjectUseCase.create_user_story(code, project_id=project_id, **cleaned_data)
             messages.success(request, f"Historia de usuario <strong>{cleaned_data['title']}</strong> creado correctamente")
             return HttpResponseRedirect(f"/projects/{project_id}/backlog")
@@ -551,8 +556,7 @@ class ProductBacklogCancelView(CustomLoginMixin, ProjectPermissionMixin, Project
             messages.warning(request, f"La historia de usuario <strong>{us.title}</strong> ya se encuentra cancelada")
         else:
             messages.success(request, f"La historia de usuario <strong>{us.title}</strong> se ha cancelado")
-            us.status = UserStoryStatus.CANCELLED
-            us.save()
+            ProjectUseCase.update_user_story_version(us.id, status=UserStoryStatus.CANCELLED, updated_at=timezone.now())
         return redirect(reverse('projects:project-backlog', kwargs={'project_id': project_id}))
 
 class UserStoryTypeImportView1(CustomLoginMixin, ProjectPermissionMixin, ProjectStatusMixin, FormView):
@@ -746,10 +750,15 @@ class ProductBacklogEditView(CustomLoginMixin, ProjectPermissionMixin, UserStory
             cleaned_data = form.cleaned_data
             old_user_story = ProjectUseCase.get_user_story_by_id(id=us_id)
 
-            ProjectUseCase.edit_user_story(us_id, **cleaned_data)
+            try:
+                ProjectUseCase.edit_user_story(us_id, **cleaned_data)
+            except StaleUserStoryError as e:
+                messages.warning(request, f"{e}, revise los cambios e intente de nuevo")
+                return redirect(reverse('projects:project-backlog-edit', kwargs={'project_id': project_id, 'us_id': us_id}))
 
             new_user_story = ProjectUseCase.get_user_story_by_id(id=us_id)
             UserStoriesUseCase.create_user_story_history(old_user_story, new_user_story, request.user, project_id)
+            UserStoriesUseCase.mark_board_changed(new_user_story.sprint_id, [us_id])
 
             messages.success(request, f"Historia de usuario <strong>{cleaned_data['title']}</strong> editada correctamente")
             return redirect(reverse('projects:project-backlog', kwargs={'project_id': project_id}))
@@ -761,28 +770,62 @@ class UserStoryEditApiView(CustomLoginMixin, ProjectAccessMixin, View):
     Clase encargada de editar la us
     """
     def put(self, request, project_id, us_id):
-        data = json.loads(request.body)
-        old_us = ProjectUseCase.get_user_story_by_id(id=us_id)
-        new_us =ProjectUseCase.edit_user_story(us_id, **data)
-        UserStoriesUseCase.create_user_story_history(old_us, new_us, request.user, project_id)
-
+        try:
+            data = json.loads(request.body)
+            column = int(data['column'])
+            version = data.get('version')
+        except (ValueError, TypeError, KeyError, AttributeError):
+            return JsonResponse({"error": "Formato de movimiento invalido"}, status=400)
+        try:
+            old_us, new_us = UserStoriesUseCase.move_user_story_column(
+                us_id, column, request.user, project_id, version)
+        except StaleUserStoryError as e:
+            # Se retorna la us actual para que el tablero pueda reintentar sobre la ultima version
+            current_us = ProjectUseCase.get_user_story_by_id(id=us_id)
+            return JsonResponse({"error": str(e), "data": current_us.to_kanban_item()}, status=409)
+        except ValueError as e:
+            return JsonResponse({"error": str(e)}, status=400)
+        # Las notificaciones se envian recien cuando el movimiento se confirmo
+        transaction.on_commit(lambda: self.notify_column_change(new_us, request.user))
+        return JsonResponse({"data": model_to_dict(new_us)}, status=200)
+
+    @staticmethod
+    def notify_column_change(user_story, logged_user):
         # Notificamos al usuario asignado a la us si es que hay uno y no fue el que cambió la columna
-        assigned_user = new_us.sprint_member.user if new_us.sprint_member else None
-        logged_user = request.user
+        assigned_user = user_story.sprint_member.user if user_story.sprint_member else None
         if (assigned_user and logged_user.id != assigned_user.id):
-            NotificationUseCase.notify_change_us_column(new_us, logged_user.email)
+            NotificationUseCase.notify_change_us_column(user_story, logged_user.email)
 
         # Notificamos a los scrum master del proyecto si la us se movió a la columna DONE
-        if new_us.is_done:
-            NotificationUseCase.notify_done_us(new_us)
+        if user_story.is_done:
+            NotificationUseCase.notify_done_us(user_story)
 
-        user_story = model_to_dict(new_us)
-        tasks = UserStoryTask.objects.filter(user_story_id=us_id)
-        for task in tasks :
-            task.disabled = True
-            print(f"Disabling tasks {task.user_story.code}-{task.description}")
-            task.save()
-        return JsonResponse({"data": user_story}, status=200)
+class UserStoryBatchMoveApiView(CustomLoginMixin, ProjectPermissionMixin, View):
+    """
+    Clase encargada de mover varias us de columna en una sola transaccion
+    """
+    roles = ['Scrum Master']
+    max_moves = 100
+
+    def post(self, request, project_id):
+        try:
+            data = json.loads(request.body)
+            moves = [(int(move['id']), int(move['column']), move.get('version')) for move in data['moves']]
+        except (ValueError, TypeError, KeyError):
+            return JsonResponse({"error": "Formato de movimientos invalido"}, status=400)
+        if not moves or len(moves) > self.max_moves or len({move[0] for move in moves}) != len(moves):
+            return JsonResponse({"error": "Formato de movimientos invalido"}, status=400)
+
+        try:
+            user_stories = UserStoriesUseCase.move_user_stories_columns(moves, request.user, project_id)
+        except StaleUserStoryError as e:
+            # Se retornan las us actuales para que el tablero se actualice antes de reintentar
+            current = UserStory.objects.filter(id__in=[move[0] for move in moves], project_id=project_id)
+            return JsonResponse({"error": str(e), "data": [us.to_kanban_item() for us in current]}, status=409)
+        except ValueError as e:
+            return JsonResponse({"error": str(e)}, status=400)
+        transaction.on_commit(lambda: NotificationUseCase.notify_moved_user_stories(user_stories, request.user))
+        return JsonResponse({"data": [model_to_dict(us) for us in user_stories]}, status=200)
 
 class ProductBacklogDetailView(CustomLoginMixin, ProjectAccessMixin, View):
     """
@@ -958,16 +1001,12 @@ class ProductBacklogCreateTaskView(CustomLoginMixin, ProjectStatusMixin, View):
             return redirect(reverse('projects:board:index', kwargs={'project_id': project_id}))
         user_story = UserStory.objects.get(id=us_id)
         form = self.form_class(us_id)
-        tasks_from_us = UserStoryTask.objects.filter(user_story_id=us_id)
-        hours_worked = 0
-        for task in tasks_from_us:
-            hours_worked = hours_worked + task.hours_worked
         context= {
             'user_story': user_story,
             "form" : form,
             "project_id":project_id,
             "us_id":us_id,
-            "hours_worked": hours_worked,
+            "hours_worked": user_story.hours_worked,
             "backpage": reverse('projects:board:index', kwargs={'project_id': project_id})
         }
         return render(request, 'backlog/task_create.html', context)
@@ -1032,25 +1071,27 @@ class ProductBacklogDeleteCommentView(CustomLoginMixin, ProjectAccessMixin, User
         messages.success(request, f"Comentario <strong>{comment.comment}</strong> eliminado correctamente")
         return redirect(reverse('projects:project-backlog-detail', kwargs={'project_id': project_id, 'us_id':us_id}))
 
-class VelocityChartView(CustomLoginMixin, ProjectAccessMixin, View):
+class VelocityChartView(CustomLoginMixin, ProjectAccessMixin, ConditionalGetMixin, View):
     """
     Clase encargada de mostrar el Velocity Chart de un proyecto
     """
+    def get_etag_data(self, request, project_id):
+        return (
+            self.get_change_marker(Sprint.objects.filter(project_id=project_id)),
+            self.get_change_marker(UserStory.objects.filter(project_id=project_id)),
+            self.get_change_marker(UserStoryTask.objects.filter(sprint__project_id=project_id)),
+        )
+
     def get(self, request, project_id):
         project_sprints = ProjectUseCase.get_project_sprints(project_id)
 
-        if not project_sprints:
+        if not project_sprints.exists():
             messages.warning(request, "El Proyecto no tiene Sprints")
             return redirect(reverse("projects:project-detail", kwargs={"project_id": project_id}))
 
-        estimated_hours_sprint = []
-        worked_hours_sprint = []
-        for sprint in project_sprints:
-            if sprint.status != SprintStatus.CREATED:
-                user_stories = UserStory.objects.filter(sprint_id=sprint.id)
-                tasks = UserStoryTask.objects.filter(sprint_id=sprint.id)
-                estimated_hours_sprint.append(sum([us.estimation_time for us in user_stories]))
-                worked_hours_sprint.append(sum([task.hours_worked for task in tasks]))
+        velocity = ProjectUseCase.get_project_velocity(project_id)
+        estimated_hours_sprint = [estimated for _, estimated, _ in velocity]
+        worked_hours_sprint = [worked for _, _, worked in velocity]
 
         if len(estimated_hours_sprint) == 0 or len(worked_hours_sprint) == 0:
             messages.warning(request, "Aun no hay informacion de los Sprints para mostrar en el grafico")
@@ -1077,8 +1118,8 @@ class ProjectFinishView(CustomLoginMixin, ProjectPermissionMixin, ProjectStatusM
     roles = ['Scrum Master']
 
     def get(self, request, project_id):
-        project = Project.objects.get(id=project_id)
-        data = vars(project)
+        project = get_project_context(request, project_id).project
+        data = model_to_dict(project, fields=['name', 'description', 'prefix'])
         scrum_master = ProjectMember.objects.get(project=project, roles__name="Scrum Master")
         data['scrum_master']=scrum_master.user.email
         form = self.form_class(initial=data)
@@ -1089,7 +1130,7 @@ class ProjectFinishView(CustomLoginMixin, ProjectPermissionMixin, ProjectStatusM
         return render(request, 'projects/finish.html', context)
 
     def post(self, request, project_id):
-        project = Project.objects.get(id=project_id)
+        project = get_project_context(request, project_id).project
         result = ProjectUseCase.finish_project(project_id)
 
         if result == 0:
@@ -0,0 +1,62 @@
+from bisect import bisect_left, bisect_right
+from datetime import timedelta
+
+
+class WorkingCalendar:
+    """
+    Calendario de dias habiles de un proyecto: de lunes a viernes sin los feriados del proyecto.
+    Los feriados se guardan ordenados, por lo que cada consulta es O(log n) en la cantidad de feriados
+    """
+    def __init__(self, holidays):
+        # Los feriados en fin de semana no cambian la cantidad de dias habiles
+        self.holidays = sorted({day for day in holidays if day.weekday() < 5})
+
+    @staticmethod
+    def weekdays_before(day):
+        """
+        Retorna la cantidad de dias de lunes a viernes desde el 01/01/0001 (lunes) hasta el dia anterior a day
+        """
+        weeks, rest = divmod(day.toordinal() - 1, 7)
+        return weeks * 5 + min(rest, 5)
+
+    def is_working_day(self, day):
+        """
+        Retorna True si el dia es habil
+        """
+        if day.weekday() > 4:
+            return False
+        index = bisect_left(self.holidays, day)
+        return index == len(self.holidays) or self.holidays[index] != day
+
+    def working_days_between(self, start, end):
+        """
+        Retorna la cantidad de dias habiles entre start y end, ambos incluidos
+        """
+        if end < start:
+            return 0
+        weekdays = self.weekdays_before(end + timedelta(days=1)) - self.weekdays_before(start)
+        holidays = bisect_right(self.holidays, end) - bisect_left(self.holidays, start)
+        return weekdays - holidays
+
+    def nth_working_day(self, start, n):
+        """
+        Retorna el n-esimo dia habil contando desde start, que cuenta si es habil
+        """
+        if n <= 0:
+            return start
+        # Cada semana tiene 5 dias habiles y cada feriado puede correr el resultado un dia habil
+        low = 0
+        high = (n + len(self.holidays)) * 7 // 5 + 7
+        while low < high:
+            middle = (low + high) // 2
+            if self.working_days_between(start, start + timedelta(days=middle)) >= n:
+                high = middle
+            else:
+                low = middle + 1
+        return start + timedelta(days=low)
+
+    def end_date(self, start, duration):
+        """
+        Retorna la fecha de finalizacion de un sprint de duration dias habiles que empieza en start
+        """
+        return self.nth_working_day(start, duration)
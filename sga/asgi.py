@@ -13,4 +13,16 @@ from django.core.asgi import get_asgi_application
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'sga.settings')
 
-application = get_asgi_application()
+django_application = get_asgi_application()
+
+from django.urls import reverse
+from notifications.stream import notification_stream
+
+NOTIFICATION_STREAM_PATH = reverse('notifications:stream')
+
+
+async def application(scope, receive, send):
+    # El stream de notificaciones es una conexion larga, se atiende fuera del ciclo de request de Django
+    if scope['type'] == 'http' and scope['path'] == NOTIFICATION_STREAM_PATH:
+        return await notification_stream(scope, receive, send)
+    return await django_application(scope, receive, send)
@@ -1,17 +1,62 @@
+import hashlib
 from django.shortcuts import redirect, reverse
+from django.utils.cache import add_never_cache_headers, patch_cache_control
 from django.utils.decorators import method_decorator
 from django.views.decorators.cache import never_cache
+from django.views.decorators.http import condition
 from django.contrib.auth.mixins import AccessMixin
 from django.contrib.auth.mixins import LoginRequiredMixin
 from django.contrib import messages
+from django.db.models import Count, Max
 
 class CustomLoginMixin(LoginRequiredMixin):
 	"""
-	Clase que permite verificar si el usuario esta logueado e implementa never_cache
+	Clase que permite verificar si el usuario esta logueado e implementa never_cache.
+	Las vistas con ConditionalGetMixin se pueden guardar en el navegador pero siempre se revalidan
 	"""
-	@method_decorator(never_cache)
 	def dispatch(self, request, *args, **kwargs):
-		return super().dispatch(request, *args, **kwargs)
+		response = super().dispatch(request, *args, **kwargs)
+		if isinstance(self, ConditionalGetMixin):
+			patch_cache_control(response, private=True, no_cache=True, must_revalidate=True)
+		else:
+			add_never_cache_headers(response)
+		return response
+
+class ConditionalGetMixin:
+	"""
+	Clase que responde 304 a un GET si los datos de la vista no cambiaron desde la ultima
+	visita, sin construir el contexto. Las vistas implementan get_etag_data retornando
+	marcadores de cambio baratos de sus datos (versiones, cantidad y ultimo updated_at).
+	Debe ir despues de los mixins de acceso para que los permisos se verifiquen antes
+	"""
+	def get_etag_data(self, request, *args, **kwargs):
+		raise NotImplementedError
+
+	@staticmethod
+	def get_change_marker(queryset):
+		"""
+		Retorna la cantidad de filas y el ultimo updated_at de un queryset
+		"""
+		marker = queryset.order_by().aggregate(count=Count('id'), updated_at=Max('updated_at'))
+		return marker['count'], marker['updated_at']
+
+	def get_etag(self, request, *args, **kwargs):
+		# Si hay mensajes pendientes la pagina se tiene que volver a dibujar para mostrarlos
+		if len(messages.get_messages(request)):
+			return None
+		user = request.user
+		# Las paginas incluyen el token CSRF, cuyo secreto se rota al iniciar sesion junto con la clave de sesion
+		data = (
+			request.get_full_path(), request.session.session_key, user.id, user.first_name, user.last_name,
+			user.avatar_url, user.role_system, user.unread_notifications_count,
+			self.get_etag_data(request, *args, **kwargs),
+		)
+		return hashlib.md5(repr(data).encode()).hexdigest()
+
+	def dispatch(self, request, *args, **kwargs):
+		if request.method != 'GET':
+			return super().dispatch(request, *args, **kwargs)
+		return condition(etag_func=self.get_etag)(super().dispatch)(request, *args, **kwargs)
 
 class AdminMixin(AccessMixin):
 	"""
@@ -137,6 +137,42 @@ DATABASES = {
 }
 
 
+# Cache
+# https://docs.djangoproject.com/en/4.1/topics/cache/
+# Por defecto se usa un cache en memoria del proceso. Si se levantan varios workers
+# se debe indicar un cache compartido (REDIS_URL, requiere el paquete redis)
+
+if os.environ.get("REDIS_URL"):
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+            'LOCATION': os.environ.get("REDIS_URL"),
+        }
+    }
+else:
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        }
+    }
+
+# Tiempo en segundos que se guardan en cache los roles y permisos de un miembro de proyecto
+PROJECT_PERMISSIONS_CACHE_TIMEOUT = int(os.environ.get("PROJECT_PERMISSIONS_CACHE_TIMEOUT", 60 * 60))
+
+# Si esta activo las notificaciones se agregan al outbox y las entrega el comando process_notifications
+NOTIFICATIONS_ASYNC = int(os.environ.get("NOTIFICATIONS_ASYNC", 1))
+
+# Dias que se guardan las notificaciones leidas y las no leidas antes de archivarlas (comando purge_notifications)
+NOTIFICATIONS_READ_RETENTION_DAYS = int(os.environ.get("NOTIFICATIONS_READ_RETENTION_DAYS", 90))
+NOTIFICATIONS_UNREAD_RETENTION_DAYS = int(os.environ.get("NOTIFICATIONS_UNREAD_RETENTION_DAYS", 365))
+
+# Dias que se guardan las entradas entregadas o fallidas del outbox (comando purge_notifications)
+NOTIFICATIONS_OUTBOX_RETENTION_DAYS = int(os.environ.get("NOTIFICATIONS_OUTBOX_RETENTION_DAYS", 7))
+
+# Cada cuantos segundos el stream de notificaciones consulta el contador de no leidas y los titulos nuevos
+NOTIFICATIONS_STREAM_POLL_SECONDS = int(os.environ.get("NOTIFICATIONS_STREAM_POLL_SECONDS", 15))
+
+
 # Password validation
 # https://docs.djangoproject.com/en/3.2/ref/settings/#auth-password-validators
 
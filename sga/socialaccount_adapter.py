@@ -1,5 +1,6 @@
 from allauth.socialaccount.adapter import DefaultSocialAccountAdapter
 from users.models import CustomUser
+from users.usecase import UserUseCase
 
 
 class CustomUsersAccountAdapter(DefaultSocialAccountAdapter):
@@ -15,3 +16,19 @@ class CustomUsersAccountAdapter(DefaultSocialAccountAdapter):
         if CustomUser.objects.all().count() == 0:
             user.role_system = 'admin'
         return user
+
+    def populate_user(self, request, sociallogin, data):
+        """
+        Completa el usuario nuevo con la foto de la cuenta social.
+        """
+        user = super().populate_user(request, sociallogin, data)
+        user.avatar_url = sociallogin.account.get_avatar_url() or ''
+        return user
+
+    def pre_social_login(self, request, sociallogin):
+        """
+        Actualiza la foto de un usuario existente con los datos recibidos al iniciar sesion.
+        """
+        super().pre_social_login(request, sociallogin)
+        if sociallogin.is_existing:
+            UserUseCase.update_avatar_url(sociallogin.user, sociallogin.account)
@@ -10,7 +10,36 @@ const currentMember = JSON.parse(
   document.getElementById("current_member").textContent
 );
 
-let activeUsType = us_types[0];
+let boardVersion = JSON.parse(
+  document.getElementById("board_version").textContent
+);
+
+// Sprint con el que se dibujo el tablero, las versiones solo se comparan dentro del mismo sprint
+const boardSprintId = JSON.parse(
+  document.getElementById("board_sprint").textContent
+);
+
+const BOARD_POLL_INTERVAL = 5000;
+
+const MAX_MOVE_RETRIES = 3;
+
+// Solo el scrum master puede mover varias US a la vez
+const canBatchMove = currentMember.roles.includes("Scrum Master");
+
+const selectedUsIds = new Set();
+
+// Cantidad de US por tipo y columna, los tipos que no estan activos se cargan al seleccionarlos
+const boardCounts = JSON.parse(
+  document.getElementById("board_counts").textContent
+);
+
+const activeUsTypeId = JSON.parse(
+  document.getElementById("active_us_type").textContent
+);
+
+const loadedUsTypes = new Set([activeUsTypeId]);
+
+let activeUsType = us_types.find((usType) => usType.id === activeUsTypeId) ?? us_types[0];
 
 let currentBoards = createBoard(activeUsType);
 
@@ -31,13 +60,14 @@ const kanban = new jKanban({
     );
 
     if (us.column === targetUsTypeColumn) return;
+    const fromColumn = us.column;
 
     const isScrumMaster = currentMember.roles.includes("Scrum Master");
     const enabledUsTasks = us.tasks.filter((task) => task.column === us.column && task.disabled == false);
     if (isScrumMaster) {
       us.column = targetUsTypeColumn;
       enabledUsTasks.forEach((task) => task.disabled = true);
-      updateUsColumn(usId, targetUsTypeColumn);
+      updateUsColumn(usId, targetUsTypeColumn, fromColumn);
       return;
     }else if (targetUsTypeColumn > us.column+1) {
       restoreUs(us, "No puedes avanzar esta US a una columna que no sea la siguiente");
@@ -63,7 +93,7 @@ const kanban = new jKanban({
     // Actualizamos la columna de la US e invalidamos las tareas de la columna anterior
     us.column = targetUsTypeColumn;
     enabledUsTasks.forEach((task) => task.disabled = true);
-    updateUsColumn(usId, targetUsTypeColumn);
+    updateUsColumn(usId, targetUsTypeColumn, fromColumn);
   }
 });
 
@@ -106,9 +136,12 @@ function getUsTemplate(id, us) {
   const userImgEl = us.user
     ? ` <img src="${us.user.picture}" alt="" width="24" height="24" class="rounded-circle" title="Usuario asignado">`
     : "";
+  const selectEl = canBatchMove
+    ? `<input type="checkbox" class="form-check-input me-1 kanban-item-select" title="Seleccionar para mover" data-us-id="${id}" ${selectedUsIds.has(id) ? "checked" : ""}>`
+    : "";
   const htmlTemplate = `
     <div class="kanban-item-title">
-      ${us.title}
+      ${selectEl}${us.title}
     </div>
     <div class="kanban-item-footer">
       <a href="/projects/${us.project}/backlog/${id}" onclick="goTo(this)" class="kanban-item-code" >${us.code}</a>
@@ -152,13 +185,48 @@ function createBoard(usType) {
       .map((column) => `board-${column}`),
   }));
 }
+/**
+ * Muestra en el selector de tipos la cantidad de US de cada tipo
+ */
+function loadUsTypeCounts() {
+  Array.from(document.getElementById("us_type").options).forEach((option) => {
+    const usType = us_types.find((usType) => usType.id === parseInt(option.value));
+    const total = Object.values(boardCounts[usType.id] ?? {}).reduce((a, b) => a + b, 0);
+    option.textContent = `${usType.name} (${total})`;
+  });
+}
+
+/**
+ * Carga las US de un tipo que todavia no se pidieron al servidor
+ * @param {number} usTypeId Id del tipo de US
+ */
+async function loadUsType(usTypeId) {
+  if (loadedUsTypes.has(usTypeId)) return;
+  const url = `/projects/${projectId}/board/items/?us_type=${usTypeId}`;
+  const response = await fetch(url, { headers: { Accept: "application/json" } });
+  if (!response.ok) throw new Error("No se pudieron cargar las US");
+  const data = await response.json();
+  // Se descartan las US de este tipo recibidas por el polling, la respuesta es mas reciente
+  for (let i = user_stories.length - 1; i >= 0; i--) {
+    if (user_stories[i].us_type === usTypeId) user_stories.splice(i, 1);
+  }
+  user_stories.push(...data.user_stories);
+  loadedUsTypes.add(usTypeId);
+}
+
 /**
  * Funcion que se ejecuta al seleccionar un tipo de US, actualiza el tablero
  */
-function filterUs() {
+async function filterUs() {
   // Obtener el tipo de US seleccionado
-  const usType = document.getElementById("us_type").value;
-  activeUsType = us_types.find((us) => us.id === parseInt(usType));
+  const usType = parseInt(document.getElementById("us_type").value);
+  try {
+    await loadUsType(usType);
+  } catch (error) {
+    console.error("Error:", error);
+    return;
+  }
+  activeUsType = us_types.find((us) => us.id === usType);
 
   // Actualizar el tablero
   const boards = createBoard(activeUsType);
@@ -172,9 +240,102 @@ function filterUs() {
   // Agregar las columnas del nuevo tablero
   kanban.addBoards(boards);
   currentBoards = boards;
+
+  // La seleccion solo puede moverse a columnas del tipo activo
+  selectedUsIds.clear();
+  loadBatchColumns();
+}
+
+/**
+ * Carga las columnas del tipo de US activo en el selector de movimiento multiple
+ */
+function loadBatchColumns() {
+  if (!canBatchMove) return;
+  document.getElementById("batch_move").classList.remove("d-none");
+  const select = document.getElementById("batch_column");
+  select.innerHTML = "";
+  activeUsType.columns.forEach((column, index) => {
+    select.add(new Option(column, index));
+  });
+  updateSelectedCount();
+}
+
+function updateSelectedCount() {
+  document.getElementById("batch_count").textContent = selectedUsIds.size;
+  document.getElementById("batch_button").disabled = selectedUsIds.size === 0;
+}
+
+document.getElementById("myKanban").addEventListener("change", (event) => {
+  if (!event.target.classList.contains("kanban-item-select")) return;
+  const usId = Number(event.target.dataset.usId);
+  if (event.target.checked) {
+    selectedUsIds.add(usId);
+  } else {
+    selectedUsIds.delete(usId);
+  }
+  updateSelectedCount();
+});
+
+/**
+ * Mueve todas las US seleccionadas a la columna elegida con una sola peticion.
+ * Si otro usuario modifico alguna de ellas no se mueve ninguna y se actualizan sus tarjetas
+ */
+async function moveSelectedUs() {
+  const column = Number(document.getElementById("batch_column").value);
+  const moves = user_stories
+    .filter((us) => selectedUsIds.has(us.id) && us.column !== column)
+    .map((us) => ({ id: us.id, column, version: us.version }));
+  if (moves.length === 0) return;
+
+  const csrftoken = document.cookie
+    .split(";")
+    .find((row) => row.trim().startsWith("csrftoken="))
+    .split("=")[1]
+    .trim();
+  try {
+    const response = await fetch(`/projects/${projectId}/user-stories/move/`, {
+      method: "POST",
+      headers: {
+        "Content-Type": "application/json",
+        "X-CSRFToken": csrftoken,
+      },
+      body: JSON.stringify({ moves }),
+    });
+    const data = await response.json();
+    if (response.status === 409) {
+      data.data.forEach(updateUsCard);
+      Swal.fire({
+        title: "Oops...",
+        icon: "warning",
+        text: "Otro usuario modifico alguna de las US, el tablero fue actualizado",
+        confirmButtonText: "Ok",
+      });
+      return;
+    }
+    if (!response.ok) throw new Error(data.error);
+    selectedUsIds.clear();
+    data.data.forEach((movedUs) => {
+      const us = user_stories.find((us) => us.id === movedUs.id);
+      // Al cambiar de columna el servidor deshabilita las tareas de la US
+      us.tasks.forEach((task) => (task.disabled = true));
+      updateUsCard({ ...us, column: movedUs.column, version: movedUs.version });
+    });
+    updateSelectedCount();
+  } catch (error) {
+    console.error("Error:", error);
+  }
 }
 
-async function updateUsColumn(usId, column) {
+/**
+ * Guarda el cambio de columna de una US. Se envia la version de la US que conoce el tablero,
+ * si otro usuario la modifico antes el servidor responde 409 con la US actual
+ * @param {number} usId Id de la US
+ * @param {number} column Columna destino
+ * @param {number} fromColumn Columna desde donde se movio la US
+ * @param {number} attempt Cantidad de reintentos realizados
+ */
+async function updateUsColumn(usId, column, fromColumn, attempt = 0) {
+  const us = user_stories.find((us) => us.id === parseInt(usId));
   const url = `/projects/${projectId}/user-stories/${usId}/`;
   const csrftoken = document.cookie
     .split(";")
@@ -188,13 +349,114 @@ async function updateUsColumn(usId, column) {
       "Content-Type": "application/json",
       "X-CSRFToken": csrftoken,
     },
-    body: JSON.stringify({ column }),
+    body: JSON.stringify({ column, version: us.version }),
   })
-    .then((response) => response.json())
-    .then((data) => {
-      console.log("Success:", data);
+    .then(async (response) => {
+      const data = await response.json();
+      if (response.status === 409) {
+        handleMoveConflict(us, column, fromColumn, data.data, attempt);
+        return;
+      }
+      if (!response.ok) throw new Error(data.error);
+      us.version = data.data.version;
     })
     .catch((error) => {
       console.error("Error:", error);
     });
 }
+
+/**
+ * Resuelve un movimiento rechazado porque otro usuario modifico la US
+ * @param {Object} us US que se movio
+ * @param {number} column Columna destino
+ * @param {number} fromColumn Columna desde donde se movio la US
+ * @param {Object} latestUs US actual retornada por el servidor
+ * @param {number} attempt Cantidad de reintentos realizados
+ */
+function handleMoveConflict(us, column, fromColumn, latestUs, attempt) {
+  // Si la US sigue en la columna desde donde se movio, el otro cambio no afecta
+  // al movimiento y se reintenta sobre la ultima version
+  if (latestUs.column === fromColumn && attempt < MAX_MOVE_RETRIES) {
+    us.version = latestUs.version;
+    updateUsColumn(us.id, column, fromColumn, attempt + 1);
+    return;
+  }
+  updateUsCard(latestUs);
+  Swal.fire({
+    title: "Oops...",
+    icon: "warning",
+    text: "Otro usuario modifico esta US, el tablero fue actualizado",
+    confirmButtonText: "Ok",
+  });
+}
+
+/**
+ * Consulta los user stories que cambiaron desde la ultima version conocida del tablero
+ * y actualiza solo esas tarjetas
+ */
+async function pollBoardChanges() {
+  if (document.hidden) return;
+  const url = `/projects/${projectId}/board/changes/?since=${boardVersion}`;
+  try {
+    const response = await fetch(url, { headers: { Accept: "application/json" } });
+    // Si el sprint termino o empezo otro se vuelve a cargar el tablero completo
+    if (response.status === 404) {
+      location.reload();
+      return;
+    }
+    if (!response.ok) return;
+    const data = await response.json();
+    if (data.sprint !== boardSprintId) {
+      location.reload();
+      return;
+    }
+    data.user_stories.forEach(updateUsCard);
+    data.removed.forEach(removeUsCard);
+    boardVersion = data.version;
+  } catch (error) {
+    console.error("Error:", error);
+  }
+}
+
+/**
+ * Reemplaza los datos de una US y vuelve a dibujar su tarjeta en la columna que corresponde
+ * @param {Object} changedUs US con los datos actualizados
+ */
+function updateUsCard(changedUs) {
+  const index = user_stories.findIndex((us) => us.id === changedUs.id);
+  if (index === -1) {
+    user_stories.push(changedUs);
+  } else {
+    user_stories[index] = changedUs;
+  }
+
+  const kanbanUsId = `us-${changedUs.id}`;
+  if (kanban.findElement(kanbanUsId)) {
+    kanban.removeElement(kanbanUsId);
+  }
+  if (changedUs.us_type !== activeUsType.id) return;
+  const { id, ...usData } = changedUs;
+  kanban.addElement(`board-${activeUsType.columns[changedUs.column]}`, {
+    id: kanbanUsId,
+    title: getUsTemplate(id, usData),
+  });
+}
+
+/**
+ * Saca del tablero una US que salio del sprint
+ * @param {number} usId id de la US
+ */
+function removeUsCard(usId) {
+  const index = user_stories.findIndex((us) => us.id === usId);
+  if (index !== -1) user_stories.splice(index, 1);
+  selectedUsIds.delete(usId);
+  const kanbanUsId = `us-${usId}`;
+  if (kanban.findElement(kanbanUsId)) {
+    kanban.removeElement(kanbanUsId);
+  }
+}
+
+loadBatchColumns();
+loadUsTypeCounts();
+
+setInterval(pollBoardChanges, BOARD_POLL_INTERVAL);
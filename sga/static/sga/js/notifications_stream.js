@@ -0,0 +1,41 @@
+/**
+ * Actualiza en vivo el contador de notificaciones no leidas del sidebar
+ * y muestra el titulo de las nuevas notificaciones usando el stream
+ * de notificaciones (Server-Sent Events).
+ */
+(function () {
+  const badge = document.getElementById("notification-badge");
+  if (!badge || !window.EventSource) return;
+
+  const streamUrl = document.currentScript.getAttribute("data-url");
+  const source = new EventSource(streamUrl);
+
+  source.onmessage = function (event) {
+    const data = JSON.parse(event.data);
+    badge.textContent = data.unread;
+    badge.classList.toggle("d-none", !data.unread);
+    if (data.title) {
+      showNotificationToast(data.title);
+    }
+  };
+
+  function showNotificationToast(title) {
+    let container = document.getElementById("notification-toasts");
+    if (!container) {
+      container = document.createElement("div");
+      container.id = "notification-toasts";
+      container.className = "toast-container position-fixed bottom-0 end-0 p-3";
+      document.body.appendChild(container);
+    }
+    const toast = document.createElement("div");
+    toast.className = "toast";
+    toast.setAttribute("role", "status");
+    const body = document.createElement("div");
+    body.className = "toast-body";
+    body.textContent = title;
+    toast.appendChild(body);
+    container.appendChild(toast);
+    toast.addEventListener("hidden.bs.toast", () => toast.remove());
+    new bootstrap.Toast(toast).show();
+  }
+})();
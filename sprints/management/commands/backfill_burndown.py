@@ -0,0 +1,26 @@
+from django.core.management.base import BaseCommand
+
+from sprints.models import Sprint
+from sprints.rollups import RollupUseCase
+
+
+class Command(BaseCommand):
+    """
+    Comando que reconstruye las fotos diarias del burndown de los sprints iniciados
+    """
+    help = 'Reconstruye las fotos diarias del burndown desde las tareas de cada sprint'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--sprint', type=int, action='append', dest='sprint_ids',
+                            help='Id del sprint a reconstruir, se puede repetir. Por defecto todos los iniciados')
+
+    def handle(self, *args, **options):
+        sprints = Sprint.objects.filter(start_date__isnull=False)
+        if options['sprint_ids']:
+            sprints = sprints.filter(id__in=options['sprint_ids'])
+        total = 0
+        for sprint in sprints.order_by('id'):
+            created = RollupUseCase.backfill_sprint_days(sprint)
+            total += created
+            self.stdout.write(f'{sprint}: {created} dia/s')
+        self.stdout.write(self.style.SUCCESS(f'{total} foto/s diaria/s creada/s'))
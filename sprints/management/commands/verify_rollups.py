@@ -0,0 +1,26 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from sprints.rollups import RollupUseCase
+
+
+class Command(BaseCommand):
+    """
+    Comando que verifica los campos acumulados de capacidad usada y horas trabajadas
+    """
+    help = 'Compara la capacidad usada y las horas trabajadas guardadas con las calculadas desde las us y tareas'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--fix', action='store_true',
+                            help='Recalcular los valores que no coinciden')
+
+    def handle(self, *args, **options):
+        mismatches = RollupUseCase.get_mismatches()
+        for model, row_id, field, stored, computed in mismatches:
+            self.stdout.write(f'{model.__name__} {row_id}: {field} guardado {stored}, calculado {computed}')
+        if not mismatches:
+            self.stdout.write(self.style.SUCCESS('Los valores acumulados son correctos'))
+            return
+        if not options['fix']:
+            raise CommandError(f'{len(mismatches)} diferencia/s encontrada/s, ejecute con --fix para corregirlas')
+        fixed = RollupUseCase.fix_mismatches(mismatches)
+        self.stdout.write(self.style.SUCCESS(f'Valores acumulados corregidos en {fixed} fila/s'))
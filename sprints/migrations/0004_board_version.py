@@ -0,0 +1,18 @@
+# Generated by Django 4.1 on 2026-10-18 19:19
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('sprints', '0003_sprint_estimated_end_date'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='sprint',
+            name='board_version',
+            field=models.PositiveBigIntegerField(default=0),
+        ),
+    ]
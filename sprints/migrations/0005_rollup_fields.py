@@ -0,0 +1,57 @@
+# Generated by Django 4.1 on 2026-10-18 19:31
+
+from django.db import migrations, models
+from django.db.models import F, Func, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+
+
+def sum_subquery(queryset, field):
+    total = queryset.order_by().annotate(total=Func(F(field), function='SUM')).values('total')
+    return Coalesce(Subquery(total[:1], output_field=models.IntegerField()), 0)
+
+
+def fill_rollups(apps, schema_editor):
+    Sprint = apps.get_model('sprints', 'Sprint')
+    SprintMember = apps.get_model('sprints', 'SprintMember')
+    UserStory = apps.get_model('user_stories', 'UserStory')
+    UserStoryTask = apps.get_model('user_stories', 'UserStoryTask')
+    Sprint.objects.update(
+        used_capacity=sum_subquery(UserStory.objects.filter(sprint_id=OuterRef('pk')), 'estimation_time'),
+        hours_worked=sum_subquery(UserStoryTask.objects.filter(sprint_id=OuterRef('pk')), 'hours_worked'),
+    )
+    SprintMember.objects.update(
+        used_capacity=sum_subquery(UserStory.objects.filter(sprint_member_id=OuterRef('pk')), 'estimation_time'),
+        hours_worked=sum_subquery(UserStoryTask.objects.filter(sprint_member_id=OuterRef('pk')), 'hours_worked'),
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('sprints', '0004_board_version'),
+        ('user_stories', '0020_userstory_hours_worked'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='sprint',
+            name='hours_worked',
+            field=models.IntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='sprint',
+            name='used_capacity',
+            field=models.IntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='sprintmember',
+            name='hours_worked',
+            field=models.IntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='sprintmember',
+            name='used_capacity',
+            field=models.IntegerField(default=0),
+        ),
+        migrations.RunPython(fill_rollups, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,32 @@
+# Generated by Django 4.1 on 2026-10-18 19:34
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('sprints', '0005_rollup_fields'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SprintDaySnapshot',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('date', models.DateField()),
+                ('remaining_estimate', models.IntegerField(default=0)),
+                ('hours_logged', models.IntegerField(default=0)),
+                ('stories_done', models.IntegerField(default=0)),
+                ('sprint', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='sprints.sprint')),
+            ],
+            options={
+                'ordering': ['date'],
+            },
+        ),
+        migrations.AddConstraint(
+            model_name='sprintdaysnapshot',
+            constraint=models.UniqueConstraint(fields=('sprint', 'date'), name='unique_sprint_day_snapshot'),
+        ),
+    ]
@@ -0,0 +1,52 @@
+from datetime import timedelta
+
+from django.db import migrations
+from django.db.models import Sum
+from django.db.models.functions import TruncDate
+from django.utils import timezone
+
+
+def backfill_sprint_days(apps, schema_editor):
+    """
+    Crea las fotos diarias del burndown de los sprints iniciados que no tienen fotos,
+    igual que el comando backfill_burndown
+    """
+    Sprint = apps.get_model('sprints', 'Sprint')
+    SprintDaySnapshot = apps.get_model('sprints', 'SprintDaySnapshot')
+    UserStory = apps.get_model('user_stories', 'UserStory')
+    UserStoryTask = apps.get_model('user_stories', 'UserStoryTask')
+    today = timezone.localdate()
+    sprints = Sprint.objects.filter(start_date__isnull=False).exclude(
+        id__in=SprintDaySnapshot.objects.values('sprint_id'))
+    for sprint in sprints.iterator():
+        last_day = today
+        if sprint.status != 'IN_PROGRESS' and sprint.end_date:
+            last_day = min(sprint.end_date, today)
+        hours_by_day = dict(UserStoryTask.objects.filter(sprint_id=sprint.id).annotate(
+            day=TruncDate('created_at')).order_by().values('day').annotate(total=Sum('hours_worked')).values_list('day', 'total'))
+        rows = UserStory.objects.filter(sprint_id=sprint.id).values_list('column', 'us_type__columns')
+        stories_done = sum(1 for column, columns in rows if column == len(columns) - 1)
+
+        snapshots = []
+        logged = sum(hours for day, hours in hours_by_day.items() if day < sprint.start_date)
+        day = sprint.start_date
+        while day <= last_day:
+            hours = hours_by_day.get(day, 0)
+            logged += hours
+            snapshots.append(SprintDaySnapshot(
+                sprint_id=sprint.id, date=day, hours_logged=hours, stories_done=stories_done,
+                remaining_estimate=max(sprint.used_capacity - logged, 0)))
+            day += timedelta(days=1)
+        SprintDaySnapshot.objects.bulk_create(snapshots)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('sprints', '0006_sprint_day_snapshot'),
+        ('user_stories', '0021_userstory_board_sprint'),
+    ]
+
+    operations = [
+        migrations.RunPython(backfill_sprint_days, migrations.RunPython.noop),
+    ]
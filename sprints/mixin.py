@@ -5,6 +5,7 @@ from django.urls import reverse
 from django.http import HttpResponseNotFound
 from sprints.models import Sprint, SprintMember
 from projects.usecase import ProjectUseCase
+from projects.mixin import get_project_context
 
 class SprintAccessMixin(AccessMixin):
     """
@@ -24,7 +25,7 @@ class SprintAccessMixin(AccessMixin):
             messages.warning(self.request, "Ha ocurrido un error en la url ඞ SUS")
             return redirect(reverse('index'))
         member = SprintMember.objects.filter(sprint=sprint_id, user=user).exists()
-        self.is_scrum_master = ProjectUseCase.member_has_roles(user.id, project_id, ['Scrum Master'])
+        self.is_scrum_master = get_project_context(request, project_id).is_scrum_master
         if member or self.is_scrum_master:
             return super().dispatch(request, *args, **kwargs)
         self.raise_exception = True
@@ -59,7 +60,7 @@ class SprintPermissionMixin(AccessMixin):
             messages.warning(self.request, "Ha ocurrido un error en la url ඞ SUS")
             return redirect(reverse('index'))
         member = SprintMember.objects.filter(sprint=sprint_id, user=user).exists()
-        self.is_scrum_master = ProjectUseCase.member_has_roles(user.id, project_id, ['Scrum Master'])
+        self.is_scrum_master = get_project_context(request, project_id).is_scrum_master
         # El usuario es el SM o tiene permisos y es miembro del sprint
         if self.is_scrum_master or (self.has_permission(user, project_id) and member):
             return super().dispatch(request, *args, **kwargs)
@@ -68,7 +69,7 @@ class SprintPermissionMixin(AccessMixin):
 
     def has_permission(self, user, project_id):
         # Se verifica que el usuario tenga el permiso
-        has_perm = ProjectUseCase.member_has_permissions(user.id, project_id, self.permissions)
+        has_perm = get_project_context(self.request, project_id).has_permissions(self.permissions)
         return has_perm
 
     def handle_no_permission(self):
@@ -1,7 +1,6 @@
-from functools import cached_property
 from django.db import models
 
-from user_stories.models import UserStory, UserStoryTask
+from user_stories.models import UserStory, UserStoryTask, sum_subquery
 
 
 class SprintStatus(models.TextChoices):
@@ -10,6 +9,23 @@ class SprintStatus(models.TextChoices):
     CANCELLED = 'CANCELLED', 'Cancelado'
     FINISHED = 'FINISHED', 'Finalizado'
 
+class SprintQuerySet(models.QuerySet):
+    @staticmethod
+    def computed_stats():
+        """
+        Retorna las expresiones que calculan los campos acumulados del sprint desde sus us y tareas
+        """
+        return {
+            'used_capacity': sum_subquery(UserStory.objects.filter(sprint_id=models.OuterRef('pk')), 'estimation_time'),
+            'hours_worked': sum_subquery(UserStoryTask.objects.filter(sprint_id=models.OuterRef('pk')), 'hours_worked'),
+        }
+
+    def with_computed_stats(self):
+        """
+        Anota con el prefijo computed_ los campos acumulados calculados desde las us y tareas
+        """
+        return self.annotate(**{f'computed_{name}': value for name, value in self.computed_stats().items()})
+
 class Sprint(models.Model):
     project = models.ForeignKey('projects.Project', on_delete=models.CASCADE)
     status = models.CharField(choices=SprintStatus.choices, max_length=15, verbose_name='Estado')
@@ -19,10 +35,17 @@ class Sprint(models.Model):
     start_date = models.DateField(null=True, verbose_name='Fecha de inicio')
     estimated_end_date = models.DateField(null=True)
     end_date = models.DateField(null=True, verbose_name='Fecha de finalización')
+    # Aumenta con cada cambio en el tablero, ver UserStoriesUseCase.mark_board_changed
+    board_version = models.PositiveBigIntegerField(default=0)
+    # Suma de las estimaciones de las us y de las horas de las tareas del sprint, ver RollupUseCase
+    used_capacity = models.IntegerField(default=0)
+    hours_worked = models.IntegerField(default=0)
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
     deleted_at = models.DateTimeField(null=True)
 
+    objects = SprintQuerySet.as_manager()
+
     @property
     def name(self):
         return f"Sprint {self.number}"
@@ -40,61 +63,43 @@ class Sprint(models.Model):
             return None
         return button
 
-    @cached_property
-    def used_capacity(self):
+    def __str__(self):
+        return f"Sprint {self.number} - {self.project.name}"
+
+class SprintMemberQuerySet(models.QuerySet):
+    @staticmethod
+    def computed_stats():
         """
-        Retorna la capacidad usada en el sprint
-        @cached_property: permite que el valor se calcule una vez y se guarde en memoria
-        mientras el objeto exista.
+        Retorna las expresiones que calculan los campos acumulados del miembro desde sus us y tareas
         """
-        return UserStory.objects.filter(sprint_id=self.id).aggregate(
-            models.Sum('estimation_time')
-            )['estimation_time__sum'] or 0
+        return {
+            'used_capacity': sum_subquery(UserStory.objects.filter(sprint_member_id=models.OuterRef('pk')), 'estimation_time'),
+            'hours_worked': sum_subquery(UserStoryTask.objects.filter(sprint_member_id=models.OuterRef('pk')), 'hours_worked'),
+        }
 
-    @cached_property
-    def hours_worked(self):
+    def with_computed_stats(self):
         """
-        Retorna las horas ya trabajadas en el sprint (de las tareas de las US).
+        Anota con el prefijo computed_ los campos acumulados calculados desde las us y tareas
         """
-        return UserStory.objects.filter(sprint_id=self.id).aggregate(
-            models.Sum('hours_worked')
-            )['hours_worked__sum'] or 0
-
-    def __str__(self):
-        return f"Sprint {self.number} - {self.project.name}"
+        return self.annotate(**{f'computed_{name}': value for name, value in self.computed_stats().items()})
 
 class SprintMember(models.Model):
     sprint = models.ForeignKey('sprints.Sprint', on_delete=models.CASCADE)
     user = models.ForeignKey('users.CustomUser', on_delete=models.CASCADE, verbose_name='Usuario')
     workload = models.IntegerField(verbose_name='Carga horaria')
+    # Suma de las estimaciones de las us asignadas y de las horas de sus tareas, ver RollupUseCase
+    used_capacity = models.IntegerField(default=0)
+    hours_worked = models.IntegerField(default=0)
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
     deleted_at = models.DateTimeField(null=True)
 
+    objects = SprintMemberQuerySet.as_manager()
+
     @property
     def capacity(self):
         return self.workload * self.sprint.duration
 
-    @cached_property
-    def used_capacity(self):
-        """
-        Retorna la capacidad asignada al miembro del sprint.
-        @cached_property: permite que el valor se calcule una vez y se guarde en memoria
-        mientras el objeto exista.
-        """
-        return UserStory.objects.filter(sprint_member_id=self.id).aggregate(
-            models.Sum('estimation_time')
-            )['estimation_time__sum'] or 0
-
-    @cached_property
-    def hours_worked(self):
-        """
-        Retorna las horas trabajadas de un miembro del sprint.
-        """
-        return UserStoryTask.objects.filter(sprint_member_id=self.id).aggregate(
-            models.Sum('hours_worked')
-            )['hours_worked__sum'] or 0
-
     def to_assignable_data(self):
         return {
             'id': self.id,
@@ -104,3 +109,22 @@ class SprintMember(models.Model):
         }
     def __str__(self):
         return f"{self.user.name}"
+
+class SprintDaySnapshot(models.Model):
+    """
+    Estado del burndown de un sprint al final de cada dia, ver RollupUseCase.record_sprint_day
+    """
+    sprint = models.ForeignKey('sprints.Sprint', on_delete=models.CASCADE)
+    date = models.DateField()
+    # Horas de estimacion que faltan trabajar en el sprint
+    remaining_estimate = models.IntegerField(default=0)
+    # Horas cargadas en tareas durante el dia
+    hours_logged = models.IntegerField(default=0)
+    # Cantidad de us del sprint en la columna DONE
+    stories_done = models.IntegerField(default=0)
+
+    class Meta:
+        ordering = ['date']
+        constraints = [
+            models.UniqueConstraint(fields=['sprint', 'date'], name='unique_sprint_day_snapshot'),
+        ]
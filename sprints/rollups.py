@@ -0,0 +1,162 @@
+from collections import Counter
+from datetime import timedelta
+from django.db import IntegrityError, transaction
+from django.db.models import F, Subquery, Sum
+from django.db.models.functions import Greatest, TruncDate
+from django.utils import timezone
+from sprints.models import Sprint, SprintDaySnapshot, SprintMember, SprintStatus
+from user_stories.models import UserStory, UserStoryTask
+
+
+class RollupUseCase:
+    """
+    Mantiene los campos acumulados de capacidad usada y horas trabajadas de los sprints,
+    miembros de sprint y us, y las fotos diarias del burndown. Los cambios se aplican con F()
+    y se deben llamar dentro de la misma transaccion que la escritura que los origina
+    """
+    models = [UserStory, SprintMember, Sprint]
+
+    @staticmethod
+    def add_used_capacity(sprint_id, sprint_member_id, hours):
+        """
+        Suma hours a la capacidad usada del sprint y del miembro indicados
+        """
+        RollupUseCase.move_used_capacity((None, None, 0), (sprint_id, sprint_member_id, hours))
+
+    @staticmethod
+    def move_used_capacity(old, new):
+        """
+        Actualiza la capacidad usada cuando cambia el sprint, el miembro o la estimacion de una us.
+        old y new son tuplas (sprint_id, sprint_member_id, estimation_time) de antes y despues del cambio
+        """
+        sprint_deltas = Counter()
+        member_deltas = Counter()
+        old_sprint_id, old_member_id, old_estimation = old
+        new_sprint_id, new_member_id, new_estimation = new
+        if old_sprint_id:
+            sprint_deltas[old_sprint_id] -= old_estimation or 0
+        if new_sprint_id:
+            sprint_deltas[new_sprint_id] += new_estimation or 0
+        if old_member_id:
+            member_deltas[old_member_id] -= old_estimation or 0
+        if new_member_id:
+            member_deltas[new_member_id] += new_estimation or 0
+
+        # Se actualiza en orden de id para que dos transacciones bloqueen las filas en el mismo orden
+        for member_id, delta in sorted(member_deltas.items()):
+            if delta:
+                SprintMember.objects.filter(id=member_id).update(used_capacity=F('used_capacity') + delta)
+        for sprint_id, delta in sorted(sprint_deltas.items()):
+            if delta:
+                Sprint.objects.filter(id=sprint_id).update(used_capacity=F('used_capacity') + delta)
+
+    @staticmethod
+    def add_hours_worked(user_story_id, sprint_id, sprint_member_id, hours):
+        """
+        Suma las horas de una tarea nueva a su us, a su miembro de sprint y a su sprint
+        """
+        if not hours:
+            return
+        # Se actualiza updated_at para que los marcadores de cambio de las vistas vean las horas nuevas
+        now = timezone.now()
+        UserStory.objects.filter(id=user_story_id).update(hours_worked=F('hours_worked') + hours, updated_at=now)
+        if sprint_member_id:
+            SprintMember.objects.filter(id=sprint_member_id).update(hours_worked=F('hours_worked') + hours, updated_at=now)
+        if sprint_id:
+            Sprint.objects.filter(id=sprint_id).update(hours_worked=F('hours_worked') + hours, updated_at=now)
+
+    @staticmethod
+    def get_mismatches():
+        """
+        Compara los campos acumulados con los valores calculados desde las us y tareas.
+        Retorna una lista de (modelo, id, campo, valor guardado, valor calculado)
+        """
+        mismatches = []
+        for model in RollupUseCase.models:
+            fields = list(model.objects.computed_stats())
+            rows = model.objects.with_computed_stats().values('id', *fields, *[f'computed_{field}' for field in fields])
+            for row in rows:
+                for field in fields:
+                    if row[field] != row[f'computed_{field}']:
+                        mismatches.append((model, row['id'], field, row[field], row[f'computed_{field}']))
+        return mismatches
+
+    @staticmethod
+    def fix_mismatches(mismatches):
+        """
+        Recalcula los campos acumulados de las filas con diferencias. Retorna la cantidad de filas corregidas
+        """
+        ids_by_model = {}
+        for model, row_id, *_ in mismatches:
+            ids_by_model.setdefault(model, set()).add(row_id)
+        # Los valores se vuelven a calcular en el UPDATE para no pisar cambios hechos mientras tanto
+        return sum(model.objects.filter(id__in=ids).update(**model.objects.computed_stats())
+                   for model, ids in ids_by_model.items())
+
+    @staticmethod
+    def count_done_user_stories(sprint_id):
+        """
+        Retorna la cantidad de us del sprint que estan en la columna DONE de su tipo
+        """
+        rows = UserStory.objects.filter(sprint_id=sprint_id).values_list('column', 'us_type__columns')
+        return sum(1 for column, columns in rows if column == len(columns) - 1)
+
+    @staticmethod
+    def record_sprint_day(sprint_id, hours=0, done=0):
+        """
+        Actualiza la foto del burndown del dia actual: suma las horas cargadas y la diferencia de
+        us terminadas, y guarda la estimacion restante desde los campos acumulados del sprint.
+        Se debe llamar dentro de la misma transaccion y despues de la escritura que la origina
+        """
+        if not sprint_id:
+            return
+        today = timezone.localdate()
+        remaining = Subquery(Sprint.objects.filter(id=sprint_id).annotate(
+            remaining=Greatest(F('used_capacity') - F('hours_worked'), 0)).values('remaining'))
+        snapshots = SprintDaySnapshot.objects.filter(sprint_id=sprint_id, date=today)
+        if snapshots.update(hours_logged=F('hours_logged') + hours, stories_done=F('stories_done') + done,
+                            remaining_estimate=remaining):
+            return
+        # Primera escritura del dia: se guardan los valores actuales, que ya incluyen este cambio
+        sprint = Sprint.objects.get(id=sprint_id)
+        try:
+            with transaction.atomic():
+                SprintDaySnapshot.objects.create(
+                    sprint_id=sprint_id, date=today, hours_logged=hours,
+                    stories_done=RollupUseCase.count_done_user_stories(sprint_id),
+                    remaining_estimate=max(sprint.used_capacity - sprint.hours_worked, 0))
+        except IntegrityError:
+            # Otra transaccion creo la foto del dia al mismo tiempo
+            snapshots.update(hours_logged=F('hours_logged') + hours, stories_done=F('stories_done') + done,
+                             remaining_estimate=remaining)
+
+    @staticmethod
+    def backfill_sprint_days(sprint):
+        """
+        Reconstruye las fotos diarias del burndown de un sprint iniciado desde sus tareas.
+        No hay historial de columnas, por lo que todas las fotos usan las us terminadas actuales.
+        Retorna la cantidad de fotos creadas
+        """
+        if not sprint.start_date:
+            return 0
+        last_day = timezone.localdate()
+        if sprint.status != SprintStatus.IN_PROGRESS and sprint.end_date:
+            last_day = min(sprint.end_date, last_day)
+        hours_by_day = dict(UserStoryTask.objects.filter(sprint_id=sprint.id).annotate(
+            day=TruncDate('created_at')).order_by().values('day').annotate(total=Sum('hours_worked')).values_list('day', 'total'))
+        stories_done = RollupUseCase.count_done_user_stories(sprint.id)
+
+        snapshots = []
+        logged = sum(hours for day, hours in hours_by_day.items() if day < sprint.start_date)
+        day = sprint.start_date
+        while day <= last_day:
+            hours = hours_by_day.get(day, 0)
+            logged += hours
+            snapshots.append(SprintDaySnapshot(
+                sprint_id=sprint.id, date=day, hours_logged=hours, stories_done=stories_done,
+                remaining_estimate=max(sprint.used_capacity - logged, 0)))
+            day += timedelta(days=1)
+        with transaction.atomic():
+            SprintDaySnapshot.objects.filter(sprint_id=sprint.id).delete()
+            SprintDaySnapshot.objects.bulk_create(snapshots)
+        return len(snapshots)
@@ -3,4 +3,6 @@ from . import views
 
 urlpatterns = [
     path('', views.SprintBoardView.as_view(), name='index'),
+    path('changes/', views.SprintBoardChangesView.as_view(), name='changes'),
+    path('items/', views.SprintBoardItemsView.as_view(), name='items'),
 ]
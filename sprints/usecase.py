@@ -1,12 +1,15 @@
 from datetime import datetime
+from django.db import transaction
+from django.db.models import Count, F, Prefetch
+from django.utils import timezone
 from projects.models import Project, ProjectMember
 from sprints.models import Sprint, SprintMember, SprintStatus
+from sprints.rollups import RollupUseCase
 from projects.usecase import ProjectUseCase, RoleUseCase
 from users.models import CustomUser
-from user_stories.models import UserStory, UserStoryStatus, UserStoryHistory
+from user_stories.models import UserStory, UserStoryStatus, UserStoryHistory, UserStoryTask
 from user_stories.usecase import UserStoriesUseCase
 import copy
-from datetime import timedelta
 
 class SprintUseCase:
     @staticmethod
@@ -85,16 +88,14 @@ class SprintUseCase:
         """
         Método para agregar un miembro a un sprint
         """
-        sprint: Sprint = Sprint.objects.get(id=sprint_id)
-        sprint_member = SprintMember.objects.create(
-            user=user,
-            sprint=sprint,
-            workload=workload,
-        )
-        # Aumentar la capacidad del sprint
-        member_capacity = workload * sprint.duration
-        sprint.capacity += member_capacity
-        sprint.save()
+        with transaction.atomic():
+            sprint_member = SprintMember.objects.create(
+                user=user,
+                sprint_id=sprint_id,
+                workload=workload,
+            )
+            # Aumentar la capacidad del sprint en la base de datos, sin leerla antes
+            Sprint.objects.filter(id=sprint_id).update(capacity=F('capacity') + workload * F('duration'))
         return sprint_member
 
     @staticmethod
@@ -102,17 +103,17 @@ class SprintUseCase:
         """
         Método para editar la carga horaria de un miembro de un sprint
         """
-        sprint_member = SprintMember.objects.get(id=sprint_member_id)
-        sprint = sprint_member.sprint
+        with transaction.atomic():
+            # Se bloquea el miembro para que la diferencia de carga horaria sea la real
+            sprint_member = SprintMember.objects.select_for_update().get(id=sprint_member_id)
 
-        # Actualizar la capacidad del sprint
-        sprint.capacity -= sprint.duration * sprint_member.workload
-        sprint.capacity += sprint.duration * workload
-        sprint.save()
+            # Actualizar la capacidad del sprint
+            Sprint.objects.filter(id=sprint_member.sprint_id).update(
+                capacity=F('capacity') + (workload - sprint_member.workload) * F('duration'))
 
-        # Actualizar la carga horaria del miembro
-        sprint_member.workload = workload
-        sprint_member.save()
+            # Actualizar la carga horaria del miembro
+            sprint_member.workload = workload
+            sprint_member.save()
 
         return sprint_member
 
@@ -128,6 +129,8 @@ class SprintUseCase:
 
         # Actualizamos el historial de cada US del miembro
         user_stories = UserStory.objects.filter(sprint_member=sprint_member)
+        # Las tarjetas muestran el nombre y la foto del usuario asignado
+        UserStoriesUseCase.mark_board_changed(sprint_member.sprint_id, [us.id for us in user_stories])
         for us in user_stories:
             data={
                 "code": us.code,
@@ -153,11 +156,34 @@ class SprintUseCase:
         """
         Asigna una historia de usuario a un sprint
         """
-        us = UserStory.objects.get(id=user_story_id)
-        us.sprint = Sprint.objects.get(id=sprint_id)
-        us.save()
+        with transaction.atomic():
+            us = UserStory.objects.select_for_update().get(id=user_story_id)
+            old = (us.sprint_id, us.sprint_member_id, us.estimation_time)
+            us.sprint = Sprint.objects.get(id=sprint_id)
+            us.version += 1
+            us.updated_at = timezone.now()
+            UserStory.objects.filter(id=user_story_id).update(
+                sprint=us.sprint, version=F('version') + 1, updated_at=us.updated_at)
+            RollupUseCase.move_used_capacity(old, (us.sprint_id, us.sprint_member_id, us.estimation_time))
+            UserStoriesUseCase.mark_board_moved(old[0], us.sprint_id, [us.id])
         return us
 
+    @staticmethod
+    def remove_us_sprint(user_story_id):
+        """
+        Remueve una historia de usuario de su sprint, vuelve al product backlog.
+        Retorna la historia de usuario antes y despues del cambio
+        """
+        with transaction.atomic():
+            old_us = UserStory.objects.select_for_update().get(id=user_story_id)
+            UserStory.objects.filter(id=user_story_id).update(
+                sprint=None, sprint_member=None, column=0, version=F('version') + 1, updated_at=timezone.now())
+            RollupUseCase.move_used_capacity((old_us.sprint_id, old_us.sprint_member_id, old_us.estimation_time),
+                                             (None, None, old_us.estimation_time))
+            UserStoriesUseCase.mark_board_changed(old_us.sprint_id, [user_story_id])
+            us = UserStory.objects.get(id=user_story_id)
+        return old_us, us
+
     @staticmethod
     def assign_us_sprint_member(sprint_member, user_story_id):
         """
@@ -172,7 +198,15 @@ class SprintUseCase:
             data = {
                 'sprint_member': sprint_member
             }
-        return UserStory.objects.filter(id=user_story_id).update(**data)
+        with transaction.atomic():
+            sprint_id, old_member_id, estimation_time = UserStory.objects.select_for_update().filter(
+                id=user_story_id).values_list('sprint_id', 'sprint_member_id', 'estimation_time').get()
+            updated = UserStory.objects.filter(id=user_story_id).update(
+                **data, version=F('version') + 1, updated_at=timezone.now())
+            RollupUseCase.move_used_capacity((sprint_id, old_member_id, estimation_time),
+                                             (sprint_id, sprint_member and sprint_member.id, estimation_time))
+        UserStoriesUseCase.mark_board_changed(sprint_id, [user_story_id])
+        return updated
 
     @staticmethod
     def user_stories_by_sprint(sprint_id):
@@ -228,52 +262,70 @@ class SprintUseCase:
     @staticmethod
     def calculate_sprint_end_date(start_date, duration, project_id):
         """
-        Calcula la fecha de finalización de un sprint
+        Calcula la fecha de finalización de un sprint: el dia habil numero duration contando desde start_date
         """
-        aux= start_date
-        holidays= ProjectUseCase.get_holidays_by_project(project_id=project_id)
-        holidays= holidays.values_list('date', flat=True)
-        cont=0
-        while (True):
-
-            if aux not in holidays and aux.weekday() < 5:
-                cont=cont+1
-
-            if cont is duration:
-                break
-
-            aux=aux+timedelta(days=1)
-
-        return aux
+        return ProjectUseCase.get_working_calendar(project_id).end_date(start_date, duration)
 
     @staticmethod
     def finish_sprint(sprint, user, project_id):
         """
-        Finaliza un sprint
-        """
-        sprint.status = SprintStatus.FINISHED
-        sprint.end_date = datetime.now()
-        sprint.save()
-        user_stories = UserStory.objects.filter(sprint=sprint)
-        for us in user_stories:
-            #realizamos una copia de la us para el historial
-            old_user_story = copy.copy(us)
-            if( len(us.us_type.columns) == us.column + 1):
-                us.status = UserStoryStatus.FINISHED
-            else:
-                us.sprint_member = None
-                us.sprint = None
-                us.column = 0
-                us.sprint_priority = us.sprint_priority + 30
-            us.save()
-            UserStoriesUseCase.create_user_story_history(old_user_story, us, user, project_id)
-            if us.status is not UserStoryStatus.FINISHED:
-                old_user_story.project = None
-                old_user_story.id = None
-                #esto no tiene sentido pero funciona, no tocar
-                if not old_user_story.sprint_member:
-                    old_user_story.sprint_member = None
-                old_user_story.save()
+        Finaliza un sprint en una sola transaccion con una cantidad fija de consultas: un UPDATE
+        para las us terminadas, otro para las que vuelven al backlog, un bulk_create de las copias
+        que quedan en el sprint y otro del historial
+        """
+        with transaction.atomic():
+            sprint.status = SprintStatus.FINISHED
+            sprint.end_date = datetime.now()
+            # No se guardan los campos acumulados, la instancia puede tener valores viejos
+            sprint.save(update_fields=['status', 'end_date', 'updated_at'])
+            user_stories = list(UserStory.objects.filter(sprint=sprint).select_related(
+                'us_type', 'project', 'sprint', 'sprint_member').select_for_update(of=('self',)).order_by('id'))
+            if not user_stories:
+                return sprint
+
+            now = timezone.now()
+            done_ids = []
+            pending_ids = []
+            copies = []
+            histories = []
+            for us in user_stories:
+                #realizamos una copia de la us para el historial
+                old_user_story = copy.copy(us)
+                new_user_story = copy.copy(us)
+                new_user_story.updated_at = now
+                new_user_story.version = us.version + 1
+                if us.is_done:
+                    done_ids.append(us.id)
+                    new_user_story.status = UserStoryStatus.FINISHED
+                else:
+                    pending_ids.append(us.id)
+                    new_user_story.sprint_member = None
+                    new_user_story.sprint = None
+                    new_user_story.column = 0
+                    new_user_story.sprint_priority = us.sprint_priority + 30
+                    # La copia queda en el sprint con su estimacion, que compensa la de la us que
+                    # salio del sprint, pero las tareas siguen asociadas a la us original
+                    us.id = None
+                    us.project = None
+                    us.hours_worked = 0
+                    copies.append(us)
+                history = UserStoriesUseCase.build_user_story_history(old_user_story, new_user_story)
+                if history:
+                    histories.append(history)
+
+            if done_ids:
+                UserStory.objects.filter(id__in=done_ids).update(
+                    status=UserStoryStatus.FINISHED, version=F('version') + 1, updated_at=now)
+            if pending_ids:
+                UserStory.objects.filter(id__in=pending_ids).update(
+                    sprint=None, sprint_member=None, column=0, sprint_priority=F('sprint_priority') + 30,
+                    version=F('version') + 1, updated_at=now)
+                UserStory.objects.bulk_create(copies)
+            if histories:
+                project_member = RoleUseCase.get_project_member_by_user(user, project_id)
+                for history in histories:
+                    history.project_member = project_member
+                UserStoryHistory.objects.bulk_create(histories)
         return sprint
 
     @staticmethod
@@ -283,6 +335,52 @@ class SprintUseCase:
         """
         return Sprint.objects.filter(project_id=project_id, status=SprintStatus.IN_PROGRESS).first()
 
+    @staticmethod
+    def get_board_user_stories(sprint_id, since=None, us_type_id=None, column=None, offset=0, limit=None):
+        """
+        Retorna los user stories del sprint como items del tablero kanban. Las tareas, miembros
+        y usuarios se cargan con una cantidad fija de consultas.
+        Si se indica since solo se retornan los que cambiaron despues de esa version del tablero.
+        Con us_type_id, column, offset y limit se obtiene solo un tipo o una pagina de una columna
+        """
+        tasks = Prefetch('userstorytask_set', queryset=UserStoryTask.objects.filter(sprint_id=sprint_id),
+                         to_attr='sprint_tasks')
+        user_stories = UserStory.objects.filter(sprint_id=sprint_id)
+        if since is not None:
+            user_stories = user_stories.filter(board_sprint_id=sprint_id, board_version__gt=since)
+        if us_type_id is not None:
+            user_stories = user_stories.filter(us_type_id=us_type_id)
+        if column is not None:
+            user_stories = user_stories.filter(column=column)
+        user_stories = user_stories.select_related('sprint_member__user').prefetch_related(tasks)
+        if limit is not None:
+            user_stories = user_stories[offset:offset + limit]
+        return [user_story.to_kanban_item() for user_story in user_stories]
+
+    @staticmethod
+    def get_board_changes(sprint_id, since):
+        """
+        Retorna los cambios del tablero del sprint despues de la version since: los user stories
+        que cambiaron, como items del tablero, y los ids de los que salieron del sprint
+        """
+        user_stories = SprintUseCase.get_board_user_stories(sprint_id, since=since)
+        removed = UserStory.objects.filter(board_sprint_id=sprint_id, board_version__gt=since).exclude(
+            sprint_id=sprint_id).values_list('id', flat=True)
+        return user_stories, list(removed)
+
+    @staticmethod
+    def get_board_counts(sprint_id):
+        """
+        Retorna la cantidad de user stories del sprint por tipo y columna con una sola consulta,
+        en la forma {us_type_id: {columna: cantidad}}
+        """
+        counts = {}
+        rows = UserStory.objects.filter(sprint_id=sprint_id).order_by().values('us_type_id', 'column').annotate(
+            total=Count('id'))
+        for row in rows:
+            counts.setdefault(row['us_type_id'], {})[row['column']] = row['total']
+        return counts
+
     @staticmethod
     def get_sprint_by_id(sprint_id):
         """
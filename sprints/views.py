@@ -1,21 +1,22 @@
 from django.views.generic import ListView, DetailView, FormView
 from django.views import View
+from django.db import transaction
 from django.contrib import messages
 from django.urls import reverse
 from django.shortcuts import redirect, render
+from django.http import JsonResponse
 from django.forms.models import model_to_dict
 from projects.mixin import *
-from projects.models import UserStoryType, ProjectStatus
+from projects.models import ProjectHoliday, UserStoryType, ProjectStatus
 from projects.usecase import ProjectUseCase
 from users.models import CustomUser
 from sprints.forms import SprintCreateForm, SprintMemberCreateForm, SprintMemberEditForm, SprintStartForm, AssignSprintMemberForm,FormCreateComment, SprintMemberSwitchForm
-from sprints.models import Sprint, SprintMember
+from sprints.models import Sprint, SprintDaySnapshot, SprintMember
 from sprints.usecase import *
 from sprints.mixin import *
 from user_stories.usecase import UserStoriesUseCase
 from user_stories.models import UserStory, UserStoryTask
-from sga.mixin import CustomLoginMixin
-import copy
+from sga.mixin import ConditionalGetMixin, CustomLoginMixin
 from datetime import date, timedelta
 from notifications.usecase import NotificationUseCase
 
@@ -104,7 +105,7 @@ class SprintView(CustomLoginMixin, SprintAccessMixin, DetailView):
         if self.is_scrum_master:
             context['modify_sprint_status'] = True
         else:
-            context['modify_sprint_status'] = ProjectUseCase.member_has_permissions(self.request.user.id, project_id, ["ABM Sprint"])
+            context['modify_sprint_status'] = get_project_context(self.request, project_id).has_permissions(["ABM Sprint"])
         return context
 
     def post(self, request, project_id, sprint_id):
@@ -141,7 +142,8 @@ class SprintFinishView(CustomLoginMixin, SprintPermissionMixin, SprintStatusMixi
     def post(self, request, project_id, sprint_id):
         sprint = Sprint.objects.get(id=sprint_id)
         SprintUseCase.finish_sprint(sprint, request.user, self.kwargs.get('project_id'))
-        NotificationUseCase.notify_finish_sprint(request.user, project_id, sprint)
+        # Las notificaciones se envian recien cuando el sprint finalizado se confirmo
+        transaction.on_commit(lambda: NotificationUseCase.notify_finish_sprint(request.user, project_id, sprint))
         messages.success(request, f"Sprint finalizado correctamente, prioridades y estados de las historias de usuario actualizadas")
         return redirect(reverse('projects:sprints:detail', kwargs={'project_id': project_id, 'sprint_id': sprint_id}))
 
@@ -292,7 +294,7 @@ class SprintMemberListView(CustomLoginMixin, SprintAccessMixin, View):
     Vista para listar los miembros de un sprint
     """
     def get(self, request, project_id, sprint_id):
-        objects = SprintUseCase.get_sprint_members(sprint_id)
+        objects = SprintUseCase.get_sprint_members(sprint_id).select_related('sprint', 'user')
         sprint = Sprint.objects.get(id=sprint_id)
         context = {
             'project_id': project_id,
@@ -303,10 +305,21 @@ class SprintMemberListView(CustomLoginMixin, SprintAccessMixin, View):
         }
         return render(request, 'sprint-members/index.html', context)
 
-class SprintBacklogView(CustomLoginMixin, SprintAccessMixin, View):
+class SprintBacklogView(CustomLoginMixin, SprintAccessMixin, ConditionalGetMixin, View):
     """
     Clase encargada de mostrar el sprint Backlog
     """
+    def get_etag_data(self, request, project_id, sprint_id):
+        project_context = get_project_context(request, project_id)
+        return (
+            sorted(project_context.roles), sorted(project_context.permissions),
+            self.get_change_marker(UserStory.objects.filter(sprint_id=sprint_id)),
+            # La pagina muestra el nombre del tipo y del usuario asignado de cada us
+            list(UserStoryType.objects.filter(project_id=project_id).order_by('id').values_list('id', 'name')),
+            self.get_change_marker(SprintMember.objects.filter(sprint_id=sprint_id)),
+            list(SprintMember.objects.filter(sprint_id=sprint_id).order_by('id').values_list('user_id', flat=True)),
+        )
+
     def get(self, request, project_id, sprint_id):
         members = SprintUseCase.get_sprint_members(sprint_id)
         user_stories = SprintUseCase.user_stories_by_sprint(sprint_id)
@@ -336,7 +349,7 @@ class SprintBacklogAssignMemberView(CustomLoginMixin, SprintPermissionMixin, Spr
             sprint_member = None
         form = self.form_class(sprint_id=sprint_id,initial={'sprint_member': sprint_member})
         assignable_members = SprintUseCase.get_assignable_sprint_members(sprint_id)
-        assignable_members = [ member.to_assignable_data() for member in assignable_members]
+        assignable_members = [ member.to_assignable_data() for member in assignable_members.select_related('sprint')]
         us_estimation = UserStory.objects.get(id=user_story_id).estimation_time
         context = {
             'form': form,
@@ -412,92 +425,160 @@ class SprintBacklogRemoveView(CustomLoginMixin, SprintPermissionMixin, SprintSta
     special_message = "No se puede remover una US de un sprint en progreso"
 
     def get(self, request, project_id, sprint_id, user_story_id):
-        us = UserStory.objects.get(id=user_story_id)
-        old_us = copy.copy(us)
-        us.sprint_id = None
-        us.sprint_member = None
-        us.column = 0
-        us.save()
+        old_us, us = SprintUseCase.remove_us_sprint(user_story_id)
         UserStoriesUseCase.create_user_story_history(old_us, us, request.user, project_id)
         messages.success(request, f"La US <strong>{us.code}</strong> fue removida del sprint")
         return redirect(reverse('projects:sprints:backlog', kwargs={'project_id': project_id, 'sprint_id': sprint_id}))
 
-class SprintBoardView(CustomLoginMixin, ProjectAccessMixin, View):
+class SprintBoardView(CustomLoginMixin, ProjectAccessMixin, ConditionalGetMixin, View):
+    def get_etag_data(self, request, project_id):
+        sprint = SprintUseCase.get_current_sprint(project_id)
+        us_types = UserStoryType.objects.filter(project_id=project_id).values_list('id', 'name', 'columns')
+        return (
+            sprint and (sprint.id, sprint.board_version), list(us_types),
+            sorted(get_project_context(request, project_id).roles), request.GET.get('us_type'),
+        )
+
     def get(self, request, project_id):
         sprint = SprintUseCase.get_current_sprint(project_id)
         if not sprint:
             messages.warning(request, "No hay sprint en progreso para este proyecto")
             return redirect(reverse("projects:project-detail", kwargs={"project_id": project_id}))
 
-        user_stories = UserStory.objects.filter(sprint_id=sprint.id)
-        us_types = UserStoryType.objects.filter(project_id=project_id)
-        current_member = ProjectMember.objects.get(project_id=project_id, user_id=request.user.id)
+        us_types = [model_to_dict(us_type) for us_type in UserStoryType.objects.filter(project_id=project_id)]
+        # Solo se cargan los user stories del tipo activo, el resto se pide al cambiar de tipo
+        active_us_type = next((us_type for us_type in us_types if str(us_type['id']) == request.GET.get('us_type')),
+                              us_types[0] if us_types else None)
+        user_stories = []
+        if active_us_type:
+            user_stories = SprintUseCase.get_board_user_stories(sprint.id, us_type_id=active_us_type['id'])
+        project_context = get_project_context(request, project_id)
         context = {
             'project_id': project_id,
             'sprint': sprint,
-            'user_stories': [us.to_kanban_item() for us in user_stories],
-            'us_types': [model_to_dict(us_type) for us_type in us_types],
+            'user_stories': user_stories,
+            'board_version': sprint.board_version,
+            'board_counts': SprintUseCase.get_board_counts(sprint.id),
+            'active_us_type': active_us_type and active_us_type['id'],
+            'us_types': us_types,
             'current_member': {
                 'id': request.user.id,
-                'roles': [role.name for role in current_member.roles.all()]
+                'roles': list(project_context.roles)
             },
             "backpage": reverse("projects:sprints:detail", kwargs={"project_id": project_id, "sprint_id": sprint.id})
         }
         return render(request, 'sprints/board.html', context)
 
-class BurndownChartView(CustomLoginMixin, SprintAccessMixin, View):
+class SprintBoardChangesView(CustomLoginMixin, ProjectAccessMixin, View):
+    """
+    Clase encargada de retornar los user stories del tablero que cambiaron desde una version
+    """
+    def get(self, request, project_id):
+        sprint = SprintUseCase.get_current_sprint(project_id)
+        if not sprint:
+            return JsonResponse({"error": "No hay sprint en progreso para este proyecto"}, status=404)
+        try:
+            since = int(request.GET.get('since', 0))
+        except ValueError:
+            since = 0
+
+        user_stories, removed = [], []
+        if sprint.board_version != since:
+            user_stories, removed = SprintUseCase.get_board_changes(sprint.id, since)
+        # Se retorna el sprint porque la version del tablero solo tiene sentido dentro de un mismo sprint
+        return JsonResponse({
+            "sprint": sprint.id, "version": sprint.board_version, "user_stories": user_stories, "removed": removed})
+
+class SprintBoardItemsView(CustomLoginMixin, ProjectAccessMixin, View):
+    """
+    Clase encargada de retornar los user stories de un tipo del tablero o una pagina de una
+    de sus columnas
+    """
+    max_page_size = 100
+
+    def get(self, request, project_id):
+        sprint = SprintUseCase.get_current_sprint(project_id)
+        if not sprint:
+            return JsonResponse({"error": "No hay sprint en progreso para este proyecto"}, status=404)
+        try:
+            us_type_id = int(request.GET['us_type'])
+            column = int(request.GET['column']) if 'column' in request.GET else None
+            offset = max(int(request.GET.get('offset', 0)), 0)
+            limit = min(max(int(request.GET.get('limit', self.max_page_size)), 1), self.max_page_size)
+        except (KeyError, ValueError):
+            return JsonResponse({"error": "Parametros invalidos"}, status=400)
+        if not UserStoryType.objects.filter(id=us_type_id, project_id=project_id).exists():
+            return JsonResponse({"error": "Tipo de historia de usuario invalido"}, status=400)
+
+        if column is None:
+            user_stories = SprintUseCase.get_board_user_stories(sprint.id, us_type_id=us_type_id)
+        else:
+            user_stories = SprintUseCase.get_board_user_stories(
+                sprint.id, us_type_id=us_type_id, column=column, offset=offset, limit=limit)
+        return JsonResponse({"version": sprint.board_version, "user_stories": user_stories})
+
+class BurndownChartView(CustomLoginMixin, SprintAccessMixin, ConditionalGetMixin, View):
     """
     Clase encargada de Mostrar el Burndown Chart de un Sprint
     """
+    def get_etag_data(self, request, project_id, sprint_id):
+        return (
+            date.today(),
+            list(Sprint.objects.filter(id=sprint_id).values_list('status', 'updated_at', 'used_capacity')),
+            list(SprintDaySnapshot.objects.filter(sprint_id=sprint_id).values_list(
+                'date', 'remaining_estimate', 'stories_done')),
+            self.get_change_marker(ProjectHoliday.objects.filter(project_id=project_id)),
+        )
+
     def get(self, request, project_id, sprint_id):
         sprint = SprintUseCase.get_sprint_by_id(sprint_id)
         if sprint.status == SprintStatus.CREATED:
             messages.warning(request, "El Sprint todavia no fue iniciado")
             return redirect(reverse("projects:sprints:detail", kwargs={"project_id": project_id, "sprint_id": sprint_id}))
 
-        sprint = Sprint.objects.get(id=sprint_id)
-        user_stories = UserStory.objects.filter(sprint_id=sprint.id)
-        tasks = UserStoryTask.objects.filter(sprint_id=sprint.id)
+        # Fotos diarias del burndown, ver RollupUseCase.record_sprint_day
+        snapshots = {snapshot.date: snapshot for snapshot in SprintDaySnapshot.objects.filter(sprint_id=sprint.id)}
 
         real_duration_days = 0
         if(sprint.estimated_end_date < datetime.now().date()):
             real_duration_days = (datetime.now().date() - sprint.start_date).days+1
         else:
             real_duration_days = (sprint.estimated_end_date-sprint.start_date).days+1
-        estimated_duration_date = (sprint.estimated_end_date - sprint.start_date).days+1
         sprint_days = [sprint.start_date+timedelta(days=x) for x in range(real_duration_days)]
         sprint_days_str = [x.strftime("%m/%d/%Y") for x in sprint_days] # para pasarle a JS
 
         #horas estimadas que falta trabajar por dia
-        #agarra el total de horas estimadas y le va restando una cantidad constante por dia
-        estimation_total_sprint = sum([us.estimation_time for us in user_stories])
-        estimated_hours = []
-        holidays= ProjectUseCase.get_holidays_by_project(project_id=sprint.project_id).values_list('date', flat=True)
-        for x in range(real_duration_days):
-            if(sprint_days[x].weekday() > 4 or sprint_days[x] in holidays):
-                if(x==0):
-                    estimated_hours.append(estimation_total_sprint)
-                else:
-                    estimated_hours.append(estimated_hours[x-1])
-            else:
-                estimated_hours.append(int(estimation_total_sprint-(estimation_total_sprint/estimated_duration_date)*(x+1)))
-        print("estimation_total_sprint",estimation_total_sprint)
+        #agarra el total de horas estimadas y le va restando una cantidad constante por dia habil
+        estimation_total_sprint = sprint.used_capacity
+        calendar = ProjectUseCase.get_working_calendar(sprint.project_id)
+        working_days_total = max(calendar.working_days_between(sprint.start_date, sprint.estimated_end_date), 1)
+        estimated_hours = [
+            int(estimation_total_sprint - (estimation_total_sprint / working_days_total)
+                * min(calendar.working_days_between(sprint.start_date, day), working_days_total))
+            for day in sprint_days
+        ]
         days_worked = 0
         #si está en progreso grafica hasta el dia actual
         if(sprint.status == SprintStatus.IN_PROGRESS):
             days_worked = (datetime.now().date()-sprint.start_date).days+1
         else:
             days_worked = (sprint.end_date-sprint.start_date).days+1
-        #horas trabajadas por dia en base a tareas
+        #horas que faltan trabajar por dia, los dias sin cambios mantienen la foto anterior
         worked_hours = []
+        remaining = estimation_total_sprint
+        stories_done = 0
         for x in range(days_worked):
-            aux = estimation_total_sprint - sum([task.hours_worked for task in tasks if task.created_at.date()<=sprint_days[x]])
-            worked_hours.append(aux if aux>0 else 0)
+            snapshot = snapshots.get(sprint_days[x])
+            if snapshot:
+                remaining = snapshot.remaining_estimate
+                stories_done = snapshot.stories_done
+            worked_hours.append(remaining)
 
         context= {
             "sprint_days" : sprint_days_str,
             "estimated_hours" : estimated_hours,
             "worked_hours" : worked_hours,
+            "stories_done" : stories_done,
             "project_id" : project_id,
             "sprint_id" : sprint_id,
             "backpage": reverse("projects:sprints:detail", kwargs={"project_id": project_id, "sprint_id": sprint_id})
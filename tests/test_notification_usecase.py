@@ -0,0 +1,184 @@
+import asyncio
+import threading
+from datetime import timedelta
+from io import StringIO
+from unittest import mock
+from django.core.management import call_command
+from django.test import TestCase, override_settings
+from django import setup
+import os
+os.environ.setdefault("DJANGO_SETTINGS_MODULE", "sga.settings")
+setup()
+from django.utils import timezone
+from notifications.broker import NotificationBroker
+from notifications.models import Notification, NotificationArchive, NotificationOutbox, OutboxStatus
+from notifications.usecase import NotificationUseCase
+from users.models import CustomUser
+
+class NotificationUseCaseTest(TestCase):
+    def setUp(self):
+        """
+        Funcion que crea los datos iniciales en la base datos para los tests
+        """
+        self.user = CustomUser.objects.create(
+            first_name='User',
+            last_name='Test',
+            email='user@gmail.com',
+            password='dsad',
+            is_active=True,
+            role_system='user')
+
+    def test_unread_notifications_counter(self):
+        notification = NotificationUseCase.create_notification(self.user, 'Titulo', 'Contenido')
+        NotificationUseCase.create_notification(self.user, 'Titulo 2', 'Contenido 2')
+        self.user.refresh_from_db()
+        self.assertEqual(self.user.unread_notifications, 2, 'El contador de notificaciones no leidas no aumento')
+
+        NotificationUseCase.mark_notification_as_read(notification.id)
+        NotificationUseCase.mark_notification_as_read(notification.id)
+        self.user.refresh_from_db()
+        self.assertEqual(self.user.unread_notifications, 1, 'El contador de notificaciones no leidas no disminuyo una sola vez')
+
+    def test_reconcile_unread_notifications(self):
+        Notification.objects.create(user=self.user, title='Titulo', content='Contenido')
+        fixed = NotificationUseCase.reconcile_unread_notifications()
+        self.user.refresh_from_db()
+        self.assertEqual(fixed, 1, 'Se debio corregir el contador de un usuario')
+        self.assertEqual(self.user.unread_notifications, 1, 'El contador de notificaciones no leidas no se corrigio')
+        self.assertEqual(NotificationUseCase.reconcile_unread_notifications(), 0, 'No se debio corregir ningun contador')
+
+    def test_create_notifications(self):
+        user2 = CustomUser.objects.create(
+            first_name='User2',
+            last_name='Test',
+            email='user2@gmail.com',
+            password='dsad',
+            is_active=True,
+            role_system='user')
+        notifications = NotificationUseCase.create_notifications([self.user.id, user2.id, user2.id], 'Titulo', 'Contenido')
+        self.assertEqual(len(notifications), 2, 'Se debe crear una notificacion por usuario')
+        user2.refresh_from_db()
+        self.assertEqual(user2.unread_notifications, 1, 'El contador de notificaciones no leidas no aumento')
+
+
+    @override_settings(NOTIFICATIONS_ASYNC=1)
+    def test_notification_outbox(self):
+        entry = NotificationUseCase.notify([self.user.id], 'Titulo', 'Contenido', idempotency_key='test:1')
+        NotificationUseCase.notify([self.user.id], 'Titulo', 'Contenido', idempotency_key='test:1')
+        self.assertEqual(NotificationOutbox.objects.count(), 1, 'No se debe repetir una entrada con la misma clave de idempotencia')
+        self.assertFalse(Notification.objects.exists(), 'La notificacion no se debe crear hasta que se procese el outbox')
+
+        self.assertEqual(NotificationUseCase.get_pending_outbox_ids(10), [entry.id])
+        status = NotificationUseCase.deliver_outbox_entry(entry.id, max_attempts=3)
+        self.assertEqual(status, OutboxStatus.DELIVERED, 'La entrada no se entrego')
+        self.assertIsNone(NotificationUseCase.deliver_outbox_entry(entry.id, max_attempts=3), 'La entrada se entrego dos veces')
+        self.assertEqual(Notification.objects.filter(user=self.user).count(), 1, 'No se creo la notificacion')
+        self.assertEqual(NotificationUseCase.get_outbox_metrics()['queue_depth'], 0)
+
+    @override_settings(NOTIFICATIONS_ASYNC=1)
+    def test_notification_outbox_retry(self):
+        entry = NotificationUseCase.notify([self.user.id], 'Titulo', 'Contenido')
+        with mock.patch.object(NotificationUseCase, 'create_notifications', side_effect=Exception('error')):
+            status = NotificationUseCase.deliver_outbox_entry(entry.id, max_attempts=2)
+            self.assertEqual(status, OutboxStatus.PENDING, 'La entrada se debe reintentar')
+            self.assertEqual(NotificationUseCase.get_pending_outbox_ids(10), [], 'La entrada se debe reintentar mas tarde')
+            status = NotificationUseCase.deliver_outbox_entry(entry.id, max_attempts=2)
+            self.assertEqual(status, OutboxStatus.FAILED, 'La entrada debe fallar al superar los intentos')
+        entry.refresh_from_db()
+        self.assertEqual(entry.attempts, 2)
+        self.assertEqual(entry.last_error, 'error')
+
+    def test_get_notifications_page(self):
+        NotificationUseCase.create_notifications([self.user.id], 'Titulo', 'Contenido')
+        for i in range(4):
+            NotificationUseCase.create_notification(self.user, f'Titulo {i}', 'Contenido')
+        expected = list(Notification.objects.filter(user=self.user).order_by('-created_at', '-id'))
+
+        page, cursor = NotificationUseCase.get_notifications_page(self.user, page_size=2)
+        seen = list(page)
+        while cursor:
+            page, cursor = NotificationUseCase.get_notifications_page(self.user, cursor, page_size=2)
+            seen += page
+        self.assertEqual(seen, expected, 'Las paginas no contienen todas las notificaciones en orden')
+
+        page, cursor = NotificationUseCase.get_notifications_page(self.user, 'invalido', page_size=2)
+        self.assertEqual(page, expected[:2], 'Un cursor invalido debe retornar la primera pagina')
+
+    def test_mark_all_notifications_as_read(self):
+        NotificationUseCase.create_notification(self.user, 'Titulo', 'Contenido')
+        NotificationUseCase.create_notification(self.user, 'Titulo 2', 'Contenido 2')
+        self.assertEqual(NotificationUseCase.mark_all_notifications_as_read(self.user), 2)
+        self.user.refresh_from_db()
+        self.assertEqual(self.user.unread_notifications, 0, 'El contador de notificaciones no leidas no se reinicio')
+        self.assertFalse(Notification.objects.filter(user=self.user, read=False).exists(), 'Quedaron notificaciones sin leer')
+
+    def test_purge_notifications(self):
+        for i in range(3):
+            NotificationUseCase.create_notification(self.user, f'Leida {i}', 'Contenido')
+        NotificationUseCase.mark_all_notifications_as_read(self.user)
+        for i in range(3):
+            NotificationUseCase.create_notification(self.user, f'No leida {i}', 'Contenido')
+        recent = NotificationUseCase.create_notification(self.user, 'Reciente', 'Contenido')
+        Notification.objects.exclude(id=recent.id).update(created_at=timezone.now() - timedelta(days=400))
+
+        out = StringIO()
+        call_command('purge_notifications', batch_size=2, stdout=out)
+        self.assertIn('6 notificacion/es procesada/s', out.getvalue())
+        self.assertEqual(list(Notification.objects.values_list('id', flat=True)), [recent.id], 'Solo debe quedar la notificacion reciente')
+        self.assertEqual(NotificationArchive.objects.filter(user=self.user).count(), 3, 'No se archivaron las notificaciones no leidas')
+        self.user.refresh_from_db()
+        self.assertEqual(self.user.unread_notifications, 1, 'El contador no descuenta las notificaciones archivadas')
+
+    @override_settings(NOTIFICATIONS_ASYNC=1)
+    def test_purge_outbox_entries(self):
+        delivered = [NotificationUseCase.notify([self.user.id], f'Titulo {i}', 'Contenido') for i in range(3)]
+        failed = NotificationUseCase.notify([self.user.id], 'Fallida', 'Contenido')
+        pending = NotificationUseCase.notify([self.user.id], 'Pendiente', 'Contenido')
+        recent = NotificationUseCase.notify([self.user.id], 'Reciente', 'Contenido')
+        old = timezone.now() - timedelta(days=30)
+        NotificationOutbox.objects.filter(id__in=[entry.id for entry in delivered]).update(
+            status=OutboxStatus.DELIVERED, delivered_at=old)
+        NotificationOutbox.objects.filter(id=failed.id).update(status=OutboxStatus.FAILED, available_at=old)
+        NotificationOutbox.objects.filter(id=pending.id).update(available_at=old)
+        NotificationOutbox.objects.filter(id=recent.id).update(status=OutboxStatus.DELIVERED, delivered_at=timezone.now())
+
+        out = StringIO()
+        call_command('purge_notifications', batch_size=2, stdout=out)
+        self.assertIn('4 entrada/s del outbox eliminada/s', out.getvalue())
+        self.assertEqual(set(NotificationOutbox.objects.values_list('id', flat=True)), {pending.id, recent.id},
+                         'Solo deben quedar las entradas pendientes y las entregadas recientemente')
+
+    def test_get_new_notifications(self):
+        NotificationUseCase.create_notification(self.user, 'Anterior', 'Contenido')
+        last_id, titles = NotificationUseCase.get_new_notifications(self.user.id)
+        self.assertEqual(titles, [], 'Al abrir el stream no se deben enviar las notificaciones anteriores')
+
+        # Las notificaciones del outbox las crea otro proceso, sus titulos se leen de la base de datos
+        for i in range(3):
+            NotificationUseCase.create_notification(self.user, f'Nueva {i}', 'Contenido')
+        last_id, titles = NotificationUseCase.get_new_notifications(self.user.id, last_id, limit=2)
+        self.assertEqual(titles, ['Nueva 1', 'Nueva 2'], 'No se obtuvieron los titulos de las notificaciones nuevas')
+        self.assertEqual(NotificationUseCase.get_new_notifications(self.user.id, last_id), (last_id, []),
+                         'No debe haber notificaciones nuevas')
+
+    def test_publish_notification_events(self):
+        test_broker = NotificationBroker()
+        loop = asyncio.new_event_loop()
+        thread = threading.Thread(target=loop.run_forever)
+        thread.start()
+
+        async def subscribe():
+            return test_broker.subscribe(self.user.id)
+
+        try:
+            queue = asyncio.run_coroutine_threadsafe(subscribe(), loop).result(1)
+            with mock.patch('notifications.usecase.broker', test_broker):
+                with self.captureOnCommitCallbacks(execute=True):
+                    NotificationUseCase.create_notifications([self.user.id], 'Titulo', 'Contenido')
+            event = asyncio.run_coroutine_threadsafe(queue.get(), loop).result(1)
+        finally:
+            loop.call_soon_threadsafe(loop.stop)
+            thread.join()
+            loop.close()
+        self.assertEqual(event, {'title': 'Titulo'}, 'No se publico el evento de la nueva notificacion')
+        self.assertEqual(NotificationUseCase.get_unread_count(self.user.id), 1)
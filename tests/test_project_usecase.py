@@ -1,15 +1,18 @@
 from django.test import TestCase
 from django import setup
 from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.cache import cache
 import os
 os.environ.setdefault("DJANGO_SETTINGS_MODULE", "sga.settings")
 setup()
 from projects.models import Permission, Project, ProjectMember, Role, UserStoryType, ProjectStatus
 from projects.usecase import ProjectUseCase, RoleUseCase
+from user_stories.usecase import UserStoriesUseCase
 from sprints.usecase import SprintUseCase
 from users.models import CustomUser
-from datetime import datetime
-from sprints.models import SprintStatus
+from datetime import date, datetime, timedelta
+from sprints.models import Sprint, SprintStatus
+from user_stories.models import UserStory, UserStoryHistory, UserStoryStatus, UserStoryTask
 
 class ProjectUseCaseTest(TestCase):
     def setUp(self):
@@ -17,6 +20,7 @@ class ProjectUseCaseTest(TestCase):
         Funcion que crea los datos iniciales en la base datos para los tests
         estos perduran durante toda la ejecucion de los tests
         """
+        cache.clear()
         self.scrum_master = CustomUser.objects.create(
             first_name='Scrum',
             last_name='Master',
@@ -70,6 +74,37 @@ class ProjectUseCaseTest(TestCase):
         project = Project.objects.get(id=project.id)
         self.assertTrue(project.status=='CANCELLED', "El proyecto no fue cancelado")
 
+    def test_cancel_project_user_stories(self):
+        """
+        Funcion que prueba que al cancelar un proyecto se cancelan sus sprints y us con una cantidad
+        fija de consultas y se registra el historial de las us
+        """
+        project = ProjectUseCase.create_project(name='Proyecto 1', description='Descripcion del proyecto 1',
+                                                prefix='P1', scrum_master=self.scrum_master)
+        us_type = ProjectUseCase.create_default_user_story_type(project.id)
+        sprint = SprintUseCase.create_sprint(project.id, duration=14)
+        user_stories = [
+            ProjectUseCase.create_user_story(code=f'P1-{i}', title='US', description='US', business_value=1,
+                                             technical_priority=1, estimation_time=1, us_type=us_type, project_id=project.id)
+            for i in range(20)
+        ]
+        SprintUseCase.assign_us_sprint(sprint.id, user_stories[0].id)
+
+        # savepoint, proyecto, us, UPDATE de us, sprints y proyecto, miembro, historial y release
+        with self.assertNumQueries(9):
+            ProjectUseCase.cancel_project(project.id, self.scrum_master)
+
+        self.assertEqual(Project.objects.get(id=project.id).status, ProjectStatus.CANCELLED, "El proyecto no fue cancelado")
+        self.assertEqual(Sprint.objects.get(id=sprint.id).status, SprintStatus.CANCELLED, "El sprint no fue cancelado")
+        self.assertFalse(UserStory.objects.filter(project=project).exclude(status=UserStoryStatus.CANCELLED).exists(),
+                         "Quedaron us sin cancelar")
+        histories = UserStoryHistory.objects.filter(user_story__project=project)
+        self.assertEqual(histories.count(), 20, "No se registro el historial de las us canceladas")
+        self.assertEqual(histories.get(user_story=user_stories[0]).dataJson['sprint'], sprint.id,
+                         "El historial no guarda el sprint de la us")
+        self.assertFalse(histories.exclude(project_member__user=self.scrum_master).exists(),
+                         "El historial no quedo a nombre del usuario que cancelo el proyecto")
+
     def test_get_non_members(self):
         data = {
             'name': 'Proyecto 1',
@@ -154,6 +189,70 @@ class ProjectUseCaseTest(TestCase):
         self.assertTrue(result_true, "El miembro debe tener el permiso ABM Roles")
         self.assertFalse(result_false, "El miembro no debe tener el permiso ABM Proyectos")
 
+    def test_get_member_context(self):
+        data = {
+            'name': 'Proyecto 1',
+            'description': 'Descripcion del proyecto 1',
+            'prefix': 'P1',
+            'scrum_master': self.scrum_master,
+        }
+        project = ProjectUseCase.create_project(**data)
+        with self.assertNumQueries(1):
+            context = ProjectUseCase.get_member_context(self.scrum_master.id, project.id)
+        self.assertEqual(context.project, project, "El contexto no tiene el proyecto correcto")
+        self.assertTrue(context.is_member, "El Scrum Master debe ser miembro del proyecto")
+        self.assertTrue(context.is_scrum_master, "El miembro debe tener el rol Scrum Master")
+        self.assertTrue(context.has_permissions(['ABM Roles']), "El miembro debe tener el permiso ABM Roles")
+        self.assertFalse(context.has_permissions(['ABM Proyectos']), "El miembro no debe tener el permiso ABM Proyectos")
+
+        context = ProjectUseCase.get_member_context(self.admin.id, project.id)
+        self.assertEqual(context.project, project, "El contexto no tiene el proyecto correcto")
+        self.assertFalse(context.is_member, "El Admin no debe ser miembro del proyecto")
+        self.assertFalse(context.has_roles(['Scrum Master']), "El Admin no debe tener roles en el proyecto")
+
+    def test_member_permissions_cache(self):
+        data = {
+            'name': 'Proyecto 1',
+            'description': 'Descripcion del proyecto 1',
+            'prefix': 'P1',
+            'scrum_master': self.scrum_master,
+        }
+        project = ProjectUseCase.create_project(**data)
+        ProjectUseCase.get_member_context(self.scrum_master.id, project.id)
+        with self.assertNumQueries(0):
+            result = ProjectUseCase.member_has_permissions(self.scrum_master.id, project.id, ['ABM Roles'])
+        self.assertTrue(result, "El miembro debe tener el permiso ABM Roles")
+
+        # Al cambiar los permisos del rol se invalida el cache cuando se confirma la transaccion
+        permission = Permission.objects.create(name='ABM Proyectos', description='Descripcion')
+        with self.captureOnCommitCallbacks(execute=True):
+            self.scrum_rol.permissions.add(permission)
+            result = ProjectUseCase.member_has_permissions(self.scrum_master.id, project.id, ['ABM Proyectos'])
+            self.assertFalse(result, "El cache no debe invalidarse antes de confirmar la transaccion")
+        result = ProjectUseCase.member_has_permissions(self.scrum_master.id, project.id, ['ABM Proyectos'])
+        self.assertTrue(result, "El miembro debe tener el permiso ABM Proyectos")
+
+        # Al renombrar el rol se invalida el cache
+        with self.captureOnCommitCallbacks(execute=True):
+            RoleUseCase.edit_role(self.scrum_rol.id, 'Scrum Master 2', None, self.scrum_rol.permissions.all())
+        result = ProjectUseCase.member_has_roles(self.scrum_master.id, project.id, ['Scrum Master 2'])
+        self.assertTrue(result, "El miembro debe tener el rol renombrado")
+        with self.captureOnCommitCallbacks(execute=True):
+            RoleUseCase.edit_role(self.scrum_rol.id, 'Scrum Master', None, self.scrum_rol.permissions.all())
+
+        # Al cambiar los roles del miembro se invalida el cache
+        member = ProjectMember.objects.get(user=self.scrum_master, project=project)
+        with self.captureOnCommitCallbacks(execute=True):
+            member.roles.remove(self.scrum_rol)
+        result = ProjectUseCase.member_has_roles(self.scrum_master.id, project.id, ['Scrum Master'])
+        self.assertFalse(result, "El miembro no debe tener el rol Scrum Master")
+
+        # Al eliminar el miembro se invalida el cache
+        with self.captureOnCommitCallbacks(execute=True):
+            member.delete()
+        context = ProjectUseCase.get_member_context(self.scrum_master.id, project.id)
+        self.assertFalse(context.is_member, "El usuario no debe ser miembro del proyecto")
+
     def test_create_role(self):
         data = {
             'name': 'Rol nuevo prueba',
@@ -589,3 +688,156 @@ class ProjectUseCaseTest(TestCase):
 
         project_list = ProjectUseCase.get_projects_and_sprint_active(self.scrum_master)
         self.assertEqual(len(project_list), 1, "No se obtuvieron los proyectos correctos")
+
+    def test_get_home_cards_active_sprint(self):
+        """
+        Funcion que prueba que los proyectos de la pagina home se obtengan en una sola consulta
+        con el sprint activo de cada proyecto
+        """
+        project = ProjectUseCase.create_project(name='Proyecto 1', description='Descripcion', prefix='P1', scrum_master=self.scrum_master)
+        ProjectUseCase.create_project(name='Proyecto 2', description='Descripcion', prefix='P2', scrum_master=self.admin)
+        SprintUseCase.create_sprint(project.id, duration=14)
+        sprint = SprintUseCase.create_sprint(project.id, duration=14)
+        sprint.status = SprintStatus.IN_PROGRESS.value
+        sprint.save()
+
+        with self.assertNumQueries(1):
+            project_list = ProjectUseCase.get_projects_and_sprint_active(self.scrum_master)
+        self.assertEqual([p.id for p in project_list], [project.id], "No se obtuvieron los proyectos del usuario")
+        self.assertEqual(project_list[0].sprint_id, sprint.id, "No se obtuvo el sprint activo del proyecto")
+
+    def test_get_visible_projects(self):
+        """
+        Funcion que prueba que un usuario solo vea sus proyectos y el administrador vea todos
+        """
+        project1 = ProjectUseCase.create_project(name='Proyecto 1', description='Descripcion', prefix='P1', scrum_master=self.scrum_master)
+        project2 = ProjectUseCase.create_project(name='Proyecto 2', description='Descripcion', prefix='P2', scrum_master=self.admin)
+
+        user_projects = ProjectUseCase.get_visible_projects(self.scrum_master)
+        admin_projects = ProjectUseCase.get_visible_projects(self.admin)
+        self.assertEqual(list(user_projects), [project1], "El usuario solo debe ver los proyectos de los que es miembro")
+        self.assertEqual(list(admin_projects), [project1, project2], "El administrador debe ver todos los proyectos")
+
+    def test_product_backlog_conditional_get(self):
+        project = ProjectUseCase.create_project(scrum_master=self.scrum_master, name='Proyecto 1', description='Descripcion', prefix='P1')
+        us_type = UserStoryType.objects.filter(project=project).first()
+        user_story = ProjectUseCase.create_user_story(code='P1-1', project_id=project.id, title='US', description='US', business_value=1,
+                                                      technical_priority=1, estimation_time=1, us_type=us_type)
+        url = f'/projects/{project.id}/backlog/'
+        self.client.force_login(self.scrum_master)
+
+        response = self.client.get(url)
+        etag = response['ETag']
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, 304, 'Sin cambios se debe responder 304')
+
+        ProjectUseCase.edit_user_story(user_story.id, description='Nueva descripcion')
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, 200, 'Con cambios se debe volver a dibujar el backlog')
+
+        # Al volver a iniciar sesion cambia el secreto CSRF y la pagina tiene que tener el token nuevo
+        etag = self.client.get(url)['ETag']
+        self.client.logout()
+        self.client.force_login(self.scrum_master)
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, 200,
+                         'Con otro secreto CSRF se debe volver a dibujar el backlog')
+
+    def test_restore_user_story_uses_seen_version(self):
+        project = ProjectUseCase.create_project(scrum_master=self.scrum_master, name='Proyecto 1', description='Descripcion', prefix='P1')
+        us_type = UserStoryType.objects.filter(project=project).first()
+        user_story = ProjectUseCase.create_user_story(code='P1-1', project_id=project.id, title='US', description='Original', business_value=1,
+                                                      technical_priority=1, estimation_time=1, us_type=us_type)
+        edited = ProjectUseCase.edit_user_story(user_story.id, description='Editada')
+        history = UserStoriesUseCase.create_user_story_history(user_story, edited, self.scrum_master, project.id)
+        url = f'/projects/{project.id}/backlog/{user_story.id}/history/{history.id}/'
+        self.client.force_login(self.scrum_master)
+
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        seen_version = response.context['form'].initial['version']
+        ProjectUseCase.edit_user_story(user_story.id, description='Otro usuario')
+
+        self.client.post(url, {'version': seen_version})
+        user_story.refresh_from_db()
+        self.assertEqual(user_story.description, 'Otro usuario', 'No se debe restaurar sobre cambios posteriores a la vista')
+
+        self.client.post(url, {'version': self.client.get(url).context['form'].initial['version']})
+        user_story.refresh_from_db()
+        self.assertEqual(user_story.description, 'Original', 'No se restauro la version vista')
+
+    def test_sprint_backlog_conditional_get(self):
+        project = ProjectUseCase.create_project(scrum_master=self.scrum_master, name='Proyecto 1', description='Descripcion', prefix='P1')
+        us_type = UserStoryType.objects.filter(project=project).first()
+        sprint = SprintUseCase.create_sprint(project.id, duration=14)
+        user_story = ProjectUseCase.create_user_story(code='P1-1', project_id=project.id, title='US', description='US', business_value=1,
+                                                      technical_priority=1, estimation_time=1, us_type=us_type)
+        SprintUseCase.assign_us_sprint(sprint.id, user_story.id)
+        url = f'/projects/{project.id}/sprints/{sprint.id}/backlog/'
+        self.client.force_login(self.scrum_master)
+
+        etag = self.client.get(url)['ETag']
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, 304, 'Sin cambios se debe responder 304')
+
+        ProjectUseCase.edit_user_story_type(us_type.id, 'Tipo renombrado', None)
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200, 'Al renombrar el tipo se debe volver a dibujar el backlog')
+
+        etag = response['ETag']
+        CustomUser.objects.filter(id=self.scrum_master.id).update(last_name='Apellido nuevo')
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, 200,
+                         'Al cambiar el apellido del usuario se debe volver a dibujar la barra lateral')
+
+    def test_get_project_velocity(self):
+        """
+        Funcion que prueba que la velocidad de los sprints cerrados se guarde en el cache
+        """
+        project = ProjectUseCase.create_project(scrum_master=self.scrum_master, name='Proyecto 1', description='Descripcion', prefix='P1')
+        us_type = UserStoryType.objects.filter(project=project).first()
+        sprints = [SprintUseCase.create_sprint(project.id, duration=5) for _ in range(4)]
+        for sprint, status in zip(sprints, [SprintStatus.FINISHED, SprintStatus.CANCELLED, SprintStatus.IN_PROGRESS, SprintStatus.CREATED]):
+            sprint.status = status
+            sprint.save()
+            UserStory.objects.create(code=f'P1-{sprint.id}', title='US', description='US', business_value=1, technical_priority=1,
+                                     sprint_priority=1, estimation_time=sprint.number * 2, us_type=us_type,
+                                     project=project, sprint=sprint)
+            UserStoryTask.objects.create(user_story=UserStory.objects.get(sprint=sprint), sprint=sprint,
+                                         description='Tarea', hours_worked=sprint.number)
+
+        expected = [(sprints[0].id, 2, 1), (sprints[1].id, 4, 2), (sprints[2].id, 6, 3)]
+        self.assertEqual(ProjectUseCase.get_project_velocity(project.id), expected)
+        UserStoryTask.objects.filter(sprint__in=sprints).update(hours_worked=10)
+        with self.assertNumQueries(2):
+            velocity = ProjectUseCase.get_project_velocity(project.id)
+        self.assertEqual(velocity, expected[:2] + [(sprints[2].id, 6, 10)],
+                         'Solo se debe recalcular el sprint en progreso')
+
+    def test_working_calendar(self):
+        """
+        Funcion que prueba las consultas del calendario de dias habiles contra un recorrido dia por dia
+        y la invalidacion del cache al crear y borrar feriados
+        """
+        project = ProjectUseCase.create_project(name='Proyecto 2', description='Descripcion del proyecto 2',
+                                                prefix='P2', scrum_master=self.scrum_master)
+        holiday = ProjectUseCase.create_holiday(project_id=project.id, date='2022-11-07') #lunes
+        ProjectUseCase.create_holiday(project_id=project.id, date='2022-11-12') #sabado
+        ProjectUseCase.create_holiday(project_id=project.id, date='2022-11-24') #jueves
+
+        calendar = ProjectUseCase.get_working_calendar(project.id)
+        holidays = {date(2022, 11, 7), date(2022, 11, 24)}
+        start = date(2022, 11, 4)
+        days = [start + timedelta(days=x) for x in range(40)]
+        working_days = [day for day in days if day.weekday() < 5 and day not in holidays]
+        for day in days:
+            self.assertEqual(calendar.is_working_day(day), day in working_days, f"El dia {day} no tiene el estado correcto")
+            self.assertEqual(calendar.working_days_between(start, day), len([x for x in working_days if x <= day]),
+                             f"La cantidad de dias habiles hasta {day} no es correcta")
+        for n in range(1, len(working_days) + 1):
+            self.assertEqual(calendar.nth_working_day(start, n), working_days[n - 1], f"El dia habil {n} no es correcto")
+        self.assertEqual(SprintUseCase.calculate_sprint_end_date(start, 5, project.id), date(2022, 11, 11),
+                         "La fecha de fin del sprint no salta el feriado")
+
+        ProjectUseCase.delete_holiday(holiday.id)
+        self.assertTrue(ProjectUseCase.get_working_calendar(project.id).is_working_day(date(2022, 11, 7)),
+                        "El calendario sigue teniendo el feriado borrado")
+        ProjectUseCase.create_holiday(project_id=project.id, date='2022-11-08')
+        self.assertEqual(SprintUseCase.calculate_sprint_end_date(start, 5, project.id), date(2022, 11, 11),
+                         "El calendario no incluye el feriado creado")
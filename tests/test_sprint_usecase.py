@@ -1,15 +1,20 @@
 from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
+from django.db import connection
 from django import setup
 import os
+from datetime import date
 from projects.usecase import ProjectUseCase
-from sprints.models import SprintStatus
+from sprints.models import Sprint, SprintDaySnapshot, SprintMember, SprintStatus
 
+from sprints.rollups import RollupUseCase
 from sprints.usecase import SprintUseCase
 os.environ.setdefault("DJANGO_SETTINGS_MODULE", "sga.settings")
 setup()
 from projects.models import Permission, Project, ProjectMember, Role, UserStoryType
 from users.models import CustomUser
-from user_stories.models import UserStory
+from user_stories.models import UserStory, UserStoryHistory, UserStoryStatus, UserStoryTask
+from user_stories.usecase import UserStoriesUseCase
 
 class SprintUseCaseTest(TestCase):
     def setUp(self):
@@ -180,6 +185,42 @@ class SprintUseCaseTest(TestCase):
         SprintUseCase.finish_sprint(sprint, user, self.project.id)
         self.assertEqual(sprint.status, SprintStatus.FINISHED, 'El sprint no se finalizo')
 
+    def test_finish_sprint_large(self):
+        """
+        Benchmark de finalizacion de un sprint con 1000 us: no se hacen consultas por cada us
+        """
+        sprint = SprintUseCase.create_sprint(self.project.id, duration=14)
+        user = CustomUser.objects.create(first_name='Scrum', last_name='Master', email='scrum@gmail.com',
+                                         password='dsad', is_active=True, role_system='user')
+        ProjectMember.objects.create(user=user, project=self.project)
+        member = SprintUseCase.add_sprint_member(user=user, sprint_id=sprint.id, workload=10)
+        UserStory.objects.bulk_create([
+            UserStory(code=f'P1-{i}', title='US', description='US', business_value=1, technical_priority=1,
+                      sprint_priority=i, estimation_time=2, us_type=self.user_story_type, project=self.project,
+                      sprint=sprint, sprint_member=member, column=2 if i % 2 else 1)
+            for i in range(1000)
+        ])
+        sprint.status = SprintStatus.IN_PROGRESS
+        sprint.save()
+        RollupUseCase.fix_mismatches(RollupUseCase.get_mismatches())
+
+        with CaptureQueriesContext(connection) as queries:
+            SprintUseCase.finish_sprint(sprint, user, self.project.id)
+        # En SQLite los bulk_create se dividen en lotes por el limite de parametros de una consulta
+        self.assertLess(len(queries), 50, 'La finalizacion hace consultas por cada us')
+
+        self.assertEqual(UserStory.objects.filter(sprint=sprint, project=self.project, status=UserStoryStatus.FINISHED).count(), 500,
+                         'Las us terminadas no se finalizaron')
+        pending = UserStory.objects.filter(project=self.project, sprint__isnull=True)
+        self.assertEqual(pending.count(), 500, 'Las us no terminadas no volvieron al backlog')
+        self.assertFalse(pending.exclude(column=0).exists(), 'Las us no terminadas no volvieron a la primera columna')
+        self.assertEqual(pending.get(code='P1-0').sprint_priority, 30, 'No se aumento la prioridad de las us no terminadas')
+        self.assertEqual(UserStory.objects.filter(sprint=sprint, project__isnull=True, sprint_member=member).count(), 500,
+                         'No se crearon las copias de las us no terminadas')
+        self.assertEqual(UserStoryHistory.objects.filter(user_story__in=pending).count(), 500,
+                         'No se creo el historial de las us no terminadas')
+        self.assertEqual(RollupUseCase.get_mismatches(), [], 'Los valores acumulados no coinciden con los calculados')
+
     def test_start_sprint(self):
         sprint = SprintUseCase.create_sprint(self.project.id, duration=14)
         developer = CustomUser.objects.create(
@@ -222,3 +263,168 @@ class SprintUseCaseTest(TestCase):
         SprintUseCase.switch_sprint_member(user=developer2,sprint_member=sprint_member, workload=69, request_user=developer, project_id=self.project.id)
         self.assertEqual(sprint_member.user, developer2, 'No se edito el miembro del sprint')
         
+
+    def test_get_board_user_stories(self):
+        sprint = SprintUseCase.create_sprint(self.project.id, duration=14)
+        members = []
+        for i in range(3):
+            user = CustomUser.objects.create(first_name=f'Developer{i}', last_name='Python', email=f'developer{i}@gmail.com',
+                                             password='dsad', is_active=True, role_system='user')
+            members.append(SprintUseCase.add_sprint_member(user=user, sprint_id=sprint.id, workload=10))
+        user_stories = UserStory.objects.bulk_create([
+            UserStory(code=f'P1-{i}', title='US', description='US', business_value=1, technical_priority=1,
+                      sprint_priority=1, estimation_time=1, us_type=self.user_story_type, project=self.project,
+                      sprint=sprint, sprint_member=members[i % 3] if i % 4 else None)
+            for i in range(300)
+        ])
+        UserStoryTask.objects.bulk_create([
+            UserStoryTask(user_story=us, sprint=sprint, sprint_member=us.sprint_member, description='Tarea')
+            for us in user_stories
+        ])
+
+        with self.assertNumQueries(2):
+            items = SprintUseCase.get_board_user_stories(sprint.id)
+        self.assertEqual(len(items), 300, 'El tablero no tiene todos los user stories')
+        self.assertEqual(len(items[1]['tasks']), 1, 'El user story no tiene sus tareas')
+        self.assertEqual(items[1]['user']['id'], members[1].user_id, 'El user story no tiene su usuario asignado')
+        self.assertNotIn('user', items[0], 'El user story no asignado no debe tener usuario')
+
+    def test_get_board_by_type(self):
+        sprint = SprintUseCase.create_sprint(self.project.id, duration=14)
+        other_type = UserStoryType.objects.create(name='Bug', project=self.project, columns=['TO DO', 'DONE'])
+        UserStory.objects.bulk_create([
+            UserStory(code=f'P1-{i}', title='US', description='US', business_value=1, technical_priority=1,
+                      sprint_priority=1, estimation_time=1, us_type=other_type if i % 2 else self.user_story_type,
+                      project=self.project, sprint=sprint, column=1 if i % 3 == 0 else 0)
+            for i in range(12)
+        ])
+
+        self.assertEqual(SprintUseCase.get_board_counts(sprint.id),
+                         {self.user_story_type.id: {0: 4, 1: 2}, other_type.id: {0: 4, 1: 2}})
+        items = SprintUseCase.get_board_user_stories(sprint.id, us_type_id=other_type.id)
+        self.assertEqual(len(items), 6, 'Solo se deben retornar las US del tipo')
+        page = SprintUseCase.get_board_user_stories(sprint.id, us_type_id=other_type.id, column=0, offset=1, limit=2)
+        self.assertEqual([us['id'] for us in page], [us['id'] for us in items if us['column'] == 0][1:3],
+                         'La pagina de la columna no es correcta')
+
+    def test_sprint_rollups(self):
+        sprint = SprintUseCase.create_sprint(self.project.id, duration=14)
+        members = []
+        for i in range(2):
+            user = CustomUser.objects.create(first_name=f'Developer{i}', last_name='Python', email=f'developer{i}@gmail.com',
+                                             password='dsad', is_active=True, role_system='user')
+            members.append(SprintUseCase.add_sprint_member(user=user, sprint_id=sprint.id, workload=10))
+        SprintUseCase.edit_sprint_member(members[1].id, workload=5)
+        user_stories = [
+            ProjectUseCase.create_user_story(code=f'P1-{i}', title='US', description='US', business_value=1,
+                                             technical_priority=1, estimation_time=i + 1,
+                                             us_type=self.user_story_type, project_id=self.project.id)
+            for i in range(3)
+        ]
+        for i, us in enumerate(user_stories):
+            SprintUseCase.assign_us_sprint(sprint.id, us.id)
+            SprintUseCase.assign_us_sprint_member(members[i % 2], us.id)
+        ProjectUseCase.edit_user_story(user_stories[0].id, estimation_time=4)
+        SprintUseCase.assign_us_sprint_member(None, user_stories[1].id)
+        for us in UserStory.objects.filter(sprint=sprint, sprint_member__isnull=False):
+            UserStoriesUseCase.create_user_story_task(us, us.sprint_member.user, 'Tarea', 2)
+
+        sprint.refresh_from_db()
+        self.assertEqual((sprint.capacity, sprint.used_capacity, sprint.hours_worked), (210, 9, 4))
+        self.assertEqual(list(SprintMember.objects.order_by('id').values_list('used_capacity', 'hours_worked')),
+                         [(7, 4), (0, 0)], 'La capacidad usada de los miembros no es correcta')
+        self.assertEqual(UserStory.objects.get(id=user_stories[0].id).hours_worked, 2)
+        self.assertEqual(RollupUseCase.get_mismatches(), [], 'Los valores acumulados no coinciden con los calculados')
+
+        Sprint.objects.filter(id=sprint.id).update(used_capacity=0)
+        mismatches = RollupUseCase.get_mismatches()
+        self.assertEqual([(m[0], m[2], m[4]) for m in mismatches], [(Sprint, 'used_capacity', 9)])
+        self.assertEqual(RollupUseCase.fix_mismatches(mismatches), 1)
+        self.assertEqual(RollupUseCase.get_mismatches(), [], 'No se corrigieron los valores acumulados')
+
+    def test_remove_us_sprint(self):
+        sprint = SprintUseCase.create_sprint(self.project.id, duration=14)
+        user = CustomUser.objects.create(first_name='Developer', last_name='Python', email='developer@gmail.com',
+                                         password='dsad', is_active=True, role_system='user')
+        member = SprintUseCase.add_sprint_member(user=user, sprint_id=sprint.id, workload=10)
+        us = ProjectUseCase.create_user_story(code='P1-1', title='US', description='US', business_value=1,
+                                              technical_priority=1, estimation_time=7,
+                                              us_type=self.user_story_type, project_id=self.project.id)
+        SprintUseCase.assign_us_sprint(sprint.id, us.id)
+        SprintUseCase.assign_us_sprint_member(member, us.id)
+
+        self.assertEqual(UserStory.objects.get(id=us.id).version, 2, 'Asignar la us al sprint y al miembro debe aumentar su version')
+
+        old_us, us = SprintUseCase.remove_us_sprint(us.id)
+        self.assertEqual((us.sprint_id, us.sprint_member_id, us.column), (None, None, 0), 'La us no volvio al product backlog')
+        self.assertEqual(us.version, old_us.version + 1, 'No se aumento la version de la us')
+        sprint.refresh_from_db()
+        member.refresh_from_db()
+        self.assertEqual((sprint.used_capacity, member.used_capacity), (0, 0), 'No se desconto la capacidad usada')
+        self.assertEqual(RollupUseCase.get_mismatches(), [], 'Los valores acumulados no coinciden con los calculados')
+
+    def test_record_sprint_day(self):
+        sprint = SprintUseCase.create_sprint(self.project.id, duration=14)
+        user = CustomUser.objects.create(first_name='Developer', last_name='Python', email='developer@gmail.com',
+                                         password='dsad', is_active=True, role_system='user')
+        ProjectMember.objects.create(project=self.project, user=user)
+        member = SprintUseCase.add_sprint_member(user=user, sprint_id=sprint.id, workload=10)
+        user_stories = [
+            ProjectUseCase.create_user_story(code=f'P1-{i}', title='US', description='US', business_value=1,
+                                             technical_priority=1, estimation_time=5,
+                                             us_type=self.user_story_type, project_id=self.project.id)
+            for i in range(2)
+        ]
+        for us in user_stories:
+            SprintUseCase.assign_us_sprint(sprint.id, us.id)
+            SprintUseCase.assign_us_sprint_member(member, us.id)
+        Sprint.objects.filter(id=sprint.id).update(status=SprintStatus.IN_PROGRESS, start_date=date.today())
+
+        for us in UserStory.objects.filter(sprint=sprint):
+            UserStoriesUseCase.create_user_story_task(us, user, 'Tarea', 3)
+        UserStoriesUseCase.move_user_story_column(user_stories[0].id, 2, user, self.project.id)
+        UserStoriesUseCase.move_user_stories_columns([(user_stories[1].id, 2, None)], user, self.project.id)
+        UserStoriesUseCase.move_user_story_column(user_stories[1].id, 1, user, self.project.id)
+
+        snapshot = SprintDaySnapshot.objects.get(sprint=sprint)
+        self.assertEqual((snapshot.date, snapshot.hours_logged, snapshot.remaining_estimate, snapshot.stories_done),
+                         (date.today(), 6, 4, 1), 'La foto del dia no coincide con los cambios del sprint')
+
+        sprint.refresh_from_db()
+        self.assertEqual(RollupUseCase.backfill_sprint_days(sprint), 1)
+        snapshot = SprintDaySnapshot.objects.get(sprint=sprint)
+        self.assertEqual((snapshot.hours_logged, snapshot.remaining_estimate, snapshot.stories_done), (6, 4, 1),
+                         'La reconstruccion no coincide con las fotos incrementales')
+
+    def test_get_board_changes(self):
+        sprint = SprintUseCase.create_sprint(self.project.id, duration=14)
+        user_stories = [
+            UserStory.objects.create(code=f'P1-{i}', title='US', description='US', business_value=1, technical_priority=1,
+                                     sprint_priority=1, estimation_time=1, us_type=self.user_story_type,
+                                     project=self.project, sprint=sprint)
+            for i in range(3)
+        ]
+        version = UserStoriesUseCase.mark_board_changed(sprint.id, [user_stories[1].id])
+        sprint.refresh_from_db()
+        self.assertEqual(sprint.board_version, version, 'No se actualizo la version del tablero')
+
+        changes = SprintUseCase.get_board_user_stories(sprint.id, since=version - 1)
+        self.assertEqual([us['id'] for us in changes], [user_stories[1].id], 'Solo se debe retornar la US modificada')
+        self.assertEqual(SprintUseCase.get_board_user_stories(sprint.id, since=version), [], 'No debe haber cambios')
+
+        # Cambiar el usuario del miembro cambia las tarjetas de sus US
+        users = [CustomUser.objects.create(first_name=f'Developer{i}', last_name='Python', email=f'developer{i}@gmail.com',
+                                           password='dsad', is_active=True, role_system='user') for i in range(2)]
+        ProjectMember.objects.create(user=users[0], project=self.project)
+        member = SprintUseCase.add_sprint_member(user=users[0], sprint_id=sprint.id, workload=10)
+        SprintUseCase.assign_us_sprint_member(member, user_stories[0].id)
+        version = Sprint.objects.get(id=sprint.id).board_version
+        SprintUseCase.switch_sprint_member(users[1], member, 10, users[0], self.project.id)
+        changes, removed = SprintUseCase.get_board_changes(sprint.id, version)
+        self.assertEqual([us['id'] for us in changes], [user_stories[0].id], 'No se registro el cambio de miembro')
+
+        # Una US que sale del sprint se informa como removida
+        version = Sprint.objects.get(id=sprint.id).board_version
+        SprintUseCase.remove_us_sprint(user_stories[2].id)
+        changes, removed = SprintUseCase.get_board_changes(sprint.id, version)
+        self.assertEqual((changes, removed), ([], [user_stories[2].id]), 'No se informo la US que salio del sprint')
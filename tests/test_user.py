@@ -6,6 +6,8 @@ setup()
 
 from users.models import CustomUser
 from users.usecase import UserUseCase
+from allauth.socialaccount.models import SocialAccount
+from allauth.socialaccount.signals import social_account_removed
 
 class TestUser(TestCase):
     """
@@ -80,3 +82,20 @@ class TestUser(TestCase):
         #deberia traer 2
         found_users = UserUseCase.users_by_filter("name")
         self.assertEqual(len(found_users), 2, "No se encontraron los usuarios")
+
+    def test_update_avatar_url(self):
+        '''
+        Prueba para guardar la foto del usuario desde su cuenta social
+        '''
+        user = CustomUser.objects.create(first_name="name", last_name="lastname", email="avatar@gmail.com")
+        self.assertEqual(user.picture, "https://ui-avatars.com/api/?name=name lastname", "Sin cuenta social se usa la foto generada")
+        account = SocialAccount.objects.create(user=user, provider="google", uid="1",
+                                               extra_data={"picture": "https://example.com/a.png"})
+        UserUseCase.update_avatar_url(user, account)
+        user = CustomUser.objects.get(id=user.id)
+        with self.assertNumQueries(0):
+            self.assertEqual(user.picture, "https://example.com/a.png", "No se guardo la foto de la cuenta social")
+
+        account.delete()
+        social_account_removed.send(sender=SocialAccount, request=None, socialaccount=account)
+        self.assertEqual(CustomUser.objects.get(id=user.id).avatar_url, "", "No se borro la foto de la cuenta desconectada")
@@ -1,14 +1,16 @@
 from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
+from django.db import connection
 from django import setup
 import os
 os.environ.setdefault("DJANGO_SETTINGS_MODULE", "sga.settings")
 setup()
 from projects.models import Permission, Project, ProjectMember, Role, UserStoryType
-from projects.usecase import ProjectUseCase, RoleUseCase
+from projects.usecase import ProjectUseCase, RoleUseCase, StaleUserStoryError
 from user_stories.usecase import UserStoriesUseCase
 from users.models import CustomUser
 from sprints.usecase import SprintUseCase
-from user_stories.models import UserStory, UserStoryStatus, UserStoryTask
+from user_stories.models import UserStory, UserStoryHistory, UserStoryStatus, UserStoryTask
 
 
 class UserStoriesUseCaseTest(TestCase):
@@ -183,4 +185,102 @@ class UserStoriesUseCaseTest(TestCase):
         user_story_task.user_story=user_story
         user_story_task.save()
 
-        self.assertEqual(user_story_task.user_story, user_story, "La tarea nofue asignada a la user_story")
\ No newline at end of file
+        self.assertEqual(user_story_task.user_story, user_story, "La tarea nofue asignada a la user_story")
+    def test_move_user_story_column(self):
+        sprint = SprintUseCase.create_sprint(self.project.id, duration=14)
+        user = CustomUser.objects.create(first_name='Developer', last_name='Python', email='developer@gmail.com',
+                                         password='dsad', is_active=True, role_system='user')
+        ProjectMember.objects.create(project=self.project, user=user)
+        user_story = UserStory.objects.create(code='P1-1', title='US', description='US', business_value=1,
+                                              technical_priority=1, sprint_priority=1, estimation_time=1,
+                                              us_type=self.user_story_type, project=self.project, sprint=sprint)
+        UserStoryTask.objects.bulk_create([
+            UserStoryTask(user_story=user_story, sprint=sprint, description=f'Tarea {i}') for i in range(5)
+        ])
+
+        with CaptureQueriesContext(connection) as queries:
+            old_user_story, new_user_story = UserStoriesUseCase.move_user_story_column(user_story.id, 1, user, self.project.id)
+        writes = [query['sql'] for query in queries.captured_queries if query['sql'].startswith(('UPDATE', 'INSERT'))]
+        self.assertTrue(writes[-2].startswith('UPDATE "sprints_sprint"'),
+                        'La version del tablero se debe aumentar al final para no bloquear el sprint durante el movimiento')
+        user_story.refresh_from_db()
+        self.assertEqual(new_user_story.board_version, user_story.board_version, 'La US retornada no tiene la version del tablero')
+        sprint.refresh_from_db()
+        self.assertEqual((old_user_story.column, user_story.column), (0, 1), 'La US no cambio de columna')
+        self.assertEqual(user_story.board_version, sprint.board_version, 'No se actualizo la version del tablero')
+        self.assertFalse(UserStoryTask.objects.filter(user_story=user_story, disabled=False).exists(), 'Quedaron tareas habilitadas')
+        self.assertEqual(UserStoriesUseCase.user_story_history_by_us_id(user_story.id).count(), 1, 'No se guardo el historial')
+
+    def test_move_user_story_column_invalid(self):
+        sprint = SprintUseCase.create_sprint(self.project.id, duration=14)
+        user = CustomUser.objects.create(first_name='Developer', last_name='Python', email='developer@gmail.com',
+                                         password='dsad', is_active=True, role_system='user')
+        ProjectMember.objects.create(project=self.project, user=user)
+        user_story = UserStory.objects.create(code='P1-1', title='US', description='US', business_value=1,
+                                              technical_priority=1, sprint_priority=1, estimation_time=1,
+                                              us_type=self.user_story_type, project=self.project, sprint=sprint)
+        other_project = Project.objects.create(name='Proyecto 2', description='Descripcion', prefix='P2', status='IN_PROGRESS')
+
+        with self.assertRaises(ValueError):
+            UserStoriesUseCase.move_user_story_column(user_story.id, len(self.user_story_type.columns), user, self.project.id)
+        with self.assertRaises(ValueError):
+            UserStoriesUseCase.move_user_story_column(user_story.id, -1, user, self.project.id)
+        with self.assertRaises(ValueError):
+            UserStoriesUseCase.move_user_story_column(user_story.id, 1, user, other_project.id)
+        user_story.refresh_from_db()
+        self.assertEqual((user_story.column, user_story.version), (0, 0), 'Un movimiento invalido no debe modificar la US')
+        self.assertFalse(UserStoryHistory.objects.exists(), 'Un movimiento invalido no debe guardar historial')
+
+    def test_stale_user_story_edit(self):
+        sprint = SprintUseCase.create_sprint(self.project.id, duration=14)
+        user = CustomUser.objects.create(first_name='Developer', last_name='Python', email='developer@gmail.com',
+                                         password='dsad', is_active=True, role_system='user')
+        ProjectMember.objects.create(project=self.project, user=user)
+        user_story = UserStory.objects.create(code='P1-1', title='US', description='US', business_value=1,
+                                              technical_priority=1, sprint_priority=1, estimation_time=1,
+                                              us_type=self.user_story_type, project=self.project, sprint=sprint)
+
+        edited = ProjectUseCase.edit_user_story(user_story.id, description='Editada', version=0)
+        self.assertEqual(edited.version, 1, 'La edicion debe aumentar la version')
+        with self.assertRaises(StaleUserStoryError):
+            ProjectUseCase.edit_user_story(user_story.id, description='Vieja', version=0)
+
+        with self.assertRaises(StaleUserStoryError):
+            UserStoriesUseCase.move_user_story_column(user_story.id, 1, user, self.project.id, version=0)
+        user_story.refresh_from_db()
+        sprint.refresh_from_db()
+        self.assertEqual((user_story.column, user_story.description), (0, 'Editada'), 'No se debe aplicar una edicion vieja')
+        self.assertEqual(sprint.board_version, 0, 'Un movimiento rechazado no debe cambiar la version del tablero')
+
+        UserStoriesUseCase.move_user_story_column(user_story.id, 1, user, self.project.id, version=1)
+        user_story.refresh_from_db()
+        self.assertEqual((user_story.column, user_story.version), (1, 2))
+
+    def test_move_user_stories_columns(self):
+        sprint = SprintUseCase.create_sprint(self.project.id, duration=14)
+        user = CustomUser.objects.create(first_name='Developer', last_name='Python', email='developer@gmail.com',
+                                         password='dsad', is_active=True, role_system='user')
+        ProjectMember.objects.create(project=self.project, user=user)
+        user_stories = [UserStory.objects.create(code=f'P1-{i}', title='US', description='US', business_value=1,
+                                                 technical_priority=1, sprint_priority=1, estimation_time=1,
+                                                 us_type=self.user_story_type, project=self.project, sprint=sprint)
+                        for i in range(3)]
+        UserStoryTask.objects.bulk_create([
+            UserStoryTask(user_story=user_story, sprint=sprint, description='Tarea') for user_story in user_stories
+        ])
+
+        with self.assertRaises(StaleUserStoryError):
+            UserStoriesUseCase.move_user_stories_columns(
+                [(user_stories[0].id, 1, 0), (user_stories[1].id, 2, 5)], user, self.project.id)
+        self.assertFalse(UserStory.objects.exclude(column=0).exists(), 'Un lote con una US vieja no debe mover ninguna')
+
+        moved = UserStoriesUseCase.move_user_stories_columns(
+            [(user_stories[0].id, 1, 0), (user_stories[1].id, 2, 0)], user, self.project.id)
+        sprint.refresh_from_db()
+        self.assertEqual([us.column for us in moved], [1, 2])
+        self.assertEqual(
+            list(UserStory.objects.order_by('id').values_list('column', 'version', 'board_version')),
+            [(1, 1, sprint.board_version), (2, 1, sprint.board_version), (0, 0, 0)],
+            'Los movimientos no se aplicaron en un solo cambio del tablero')
+        self.assertEqual(UserStoryTask.objects.filter(disabled=False).count(), 1, 'Solo se deben deshabilitar las tareas movidas')
+        self.assertEqual(UserStoryHistory.objects.count(), 2, 'No se guardo el historial de cada US')
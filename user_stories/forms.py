@@ -39,4 +39,5 @@ class FormRestoreUserStoryHistory(forms.Form):
             queryset=SprintMember.objects.all(), label='Miembro asignado',
             empty_label='Miembro no asignado',
             widget=widgets.SelectInput()
-        )
\ No newline at end of file
+        )
+        self.fields['version'] = forms.IntegerField(required=False, widget=forms.HiddenInput())  # Version del US que se vio al restaurar
\ No newline at end of file
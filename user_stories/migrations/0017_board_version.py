@@ -0,0 +1,22 @@
+# Generated by Django 4.1 on 2026-10-18 19:19
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('user_stories', '0016_alter_userstory_project'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='userstory',
+            name='board_version',
+            field=models.PositiveBigIntegerField(default=0),
+        ),
+        migrations.AddIndex(
+            model_name='userstory',
+            index=models.Index(fields=['sprint', 'board_version'], name='user_storie_sprint__afdf6e_idx'),
+        ),
+    ]
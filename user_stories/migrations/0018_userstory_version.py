@@ -0,0 +1,18 @@
+# Generated by Django 4.1 on 2026-10-18 19:23
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('user_stories', '0017_board_version'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='userstory',
+            name='version',
+            field=models.PositiveIntegerField(default=0),
+        ),
+    ]
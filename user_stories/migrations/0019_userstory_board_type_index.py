@@ -0,0 +1,17 @@
+# Generated by Django 4.1 on 2026-10-18 19:28
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('user_stories', '0018_userstory_version'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='userstory',
+            index=models.Index(fields=['sprint', 'us_type', 'column'], name='user_storie_sprint__aa9176_idx'),
+        ),
+    ]
@@ -0,0 +1,33 @@
+# Generated by Django 4.1 on 2026-10-18 19:31
+
+from django.db import migrations, models
+from django.db.models import F, Func, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+
+
+def sum_subquery(queryset, field):
+    total = queryset.order_by().annotate(total=Func(F(field), function='SUM')).values('total')
+    return Coalesce(Subquery(total[:1], output_field=models.IntegerField()), 0)
+
+
+def fill_hours_worked(apps, schema_editor):
+    UserStory = apps.get_model('user_stories', 'UserStory')
+    UserStoryTask = apps.get_model('user_stories', 'UserStoryTask')
+    UserStory.objects.update(
+        hours_worked=sum_subquery(UserStoryTask.objects.filter(user_story_id=OuterRef('pk')), 'hours_worked'))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('user_stories', '0019_userstory_board_type_index'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='userstory',
+            name='hours_worked',
+            field=models.IntegerField(default=0),
+        ),
+        migrations.RunPython(fill_hours_worked, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,35 @@
+# Generated by Django 4.1 on 2026-10-18 19:50
+
+from django.db import migrations, models
+import django.db.models.deletion
+from django.db.models import F
+
+
+def fill_board_sprint(apps, schema_editor):
+    UserStory = apps.get_model('user_stories', 'UserStory')
+    UserStory.objects.filter(sprint__isnull=False).update(board_sprint=F('sprint'))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('sprints', '0006_sprint_day_snapshot'),
+        ('user_stories', '0020_userstory_hours_worked'),
+    ]
+
+    operations = [
+        migrations.RemoveIndex(
+            model_name='userstory',
+            name='user_storie_sprint__afdf6e_idx',
+        ),
+        migrations.AddField(
+            model_name='userstory',
+            name='board_sprint',
+            field=models.ForeignKey(null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to='sprints.sprint'),
+        ),
+        migrations.RunPython(fill_board_sprint, migrations.RunPython.noop),
+        migrations.AddIndex(
+            model_name='userstory',
+            index=models.Index(fields=['board_sprint', 'board_version'], name='user_storie_board_s_1e76fb_idx'),
+        ),
+    ]
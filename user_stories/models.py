@@ -1,6 +1,6 @@
 from django.db import models
+from django.db.models.functions import Coalesce
 from django.forms.models import model_to_dict
-from functools import cached_property
 
 from projects.models import Project,UserStoryType, ProjectMember
 from users.models import CustomUser
@@ -11,6 +11,31 @@ class UserStoryStatus(models.TextChoices):
     CANCELLED = 'CANCELLED', 'Cancelado'
     FINISHED = 'FINISHED', 'Finalizado'
 
+def sum_subquery(queryset, field):
+    """
+    Retorna una subconsulta con la suma de field en queryset, 0 si no hay filas.
+    queryset debe estar filtrado con OuterRef hacia el modelo anotado
+    """
+    # SUM como Func y no como Sum para que no se agregue un GROUP BY a la subconsulta
+    total = queryset.order_by().annotate(total=models.Func(models.F(field), function='SUM')).values('total')
+    return Coalesce(models.Subquery(total[:1], output_field=models.IntegerField()), 0)
+
+class UserStoryQuerySet(models.QuerySet):
+    @staticmethod
+    def computed_stats():
+        """
+        Retorna las expresiones que calculan los campos acumulados de la us desde sus tareas
+        """
+        return {
+            'hours_worked': sum_subquery(UserStoryTask.objects.filter(user_story_id=models.OuterRef('pk')), 'hours_worked'),
+        }
+
+    def with_computed_stats(self):
+        """
+        Anota con el prefijo computed_ los campos acumulados calculados desde las tareas
+        """
+        return self.annotate(**{f'computed_{name}': value for name, value in self.computed_stats().items()})
+
 class UserStory(models.Model):
     code = models.CharField(max_length=100)
     title = models.CharField(max_length=100)
@@ -26,20 +51,19 @@ class UserStory(models.Model):
     sprint_member = models.ForeignKey('sprints.SprintMember', on_delete=models.CASCADE, null=True)
     status = models.CharField(choices=UserStoryStatus.choices, max_length=15,
                               verbose_name='Estado', default=UserStoryStatus.IN_PROGRESS)
+    # Version del tablero del sprint en la que cambio por ultima vez
+    board_version = models.PositiveBigIntegerField(default=0)
+    # Sprint de board_version, sigue apuntando al sprint que la us dejo para que su tablero sepa que salio
+    board_sprint = models.ForeignKey('sprints.Sprint', on_delete=models.SET_NULL, null=True, related_name='+')
+    # Aumenta con cada edicion, para rechazar ediciones hechas sobre una version vieja
+    version = models.PositiveIntegerField(default=0)
+    # Horas cargadas en las tareas de la us, ver RollupUseCase
+    hours_worked = models.IntegerField(default=0)
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
     deleted_at = models.DateTimeField(null=True)
 
-    @cached_property
-    def hours_worked(self):
-        """
-        Retorna las horas ya trabajadas en una us (cargadas en tareas).
-        @cached_property: permite que el valor se calcule una vez y se guarde en memoria
-        mientras el objeto exista.
-        """
-        return UserStoryTask.objects.filter(user_story_id=self.id).aggregate(
-            models.Sum('hours_worked')
-            )['hours_worked__sum'] or 0
+    objects = UserStoryQuerySet.as_manager()
 
     @property
     def column_name(self):
@@ -64,12 +88,19 @@ class UserStory(models.Model):
                 'name': user.name,
                 'picture': user.picture
             }
-        tasks = UserStoryTask.objects.filter(user_story=self, sprint=self.sprint)
+        # Las tareas pueden venir precargadas por SprintUseCase.get_board_user_stories
+        tasks = getattr(self, 'sprint_tasks', None)
+        if tasks is None:
+            tasks = UserStoryTask.objects.filter(user_story=self, sprint=self.sprint)
         data['tasks'] = [model_to_dict(task) for task in tasks]
         return data
 
     class Meta:
         ordering = ['id']
+        indexes = [
+            models.Index(fields=['board_sprint', 'board_version']),
+            models.Index(fields=['sprint', 'us_type', 'column']),
+        ]
 
 class UserStoryHistory(models.Model):
     user_story = models.ForeignKey(UserStory, on_delete=models.CASCADE)
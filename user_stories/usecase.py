@@ -1,8 +1,13 @@
-from django.db.models import Q
+import copy
+from collections import Counter
+from django.db import transaction
+from django.utils import timezone
+from django.db.models import Case, F, IntegerField, Q, Value, When
 from users.models import CustomUser
 from user_stories.models import UserStory, UserStoryHistory, UserStoryComment, UserStoryTask
-from projects.usecase import ProjectUseCase, RoleUseCase
-from sprints.models import Sprint, SprintMember
+from projects.usecase import ProjectUseCase, RoleUseCase, StaleUserStoryError
+from sprints.models import Sprint, SprintMember, SprintStatus
+from sprints.rollups import RollupUseCase
 
 class UserStoriesUseCase:
     @staticmethod
@@ -10,6 +15,19 @@ class UserStoriesUseCase:
         """
         Crea una entrada en el historial de cambios de una historia de usuario
         """
+        history = UserStoriesUseCase.build_user_story_history(old_user_story, new_user_story)
+        if history is None:
+            return None
+        history.project_member = RoleUseCase.get_project_member_by_user(user, project_id)
+        history.save()
+        return history
+
+    @staticmethod
+    def build_user_story_history(old_user_story, new_user_story):
+        """
+        Arma, sin guardarla y sin miembro de proyecto, la entrada del historial de cambios de
+        una historia de usuario. Retorna None si no hubo cambios
+        """
         description=""
         data={
             "code": old_user_story.code,
@@ -59,7 +77,7 @@ class UserStoriesUseCase:
 
         if description!="":
             description=description[:-1]
-            return UserStoryHistory.objects.create(user_story=new_user_story, project_member=RoleUseCase.get_project_member_by_user(user,project_id), description=description, dataJson=data)
+            return UserStoryHistory(user_story=new_user_story, description=description, dataJson=data)
 
         return None
 
@@ -78,9 +96,10 @@ class UserStoriesUseCase:
         return UserStoryHistory.objects.get(id=user_story_history_id)
 
     @staticmethod
-    def restore_user_story(id, code=None, title=None, description=None, business_value=None,technical_priority=None,estimation_time=None,sprint_priority=None,us_type=None, column=None,project=None, sprint=None, sprint_member=None):
+    def restore_user_story(id, code=None, title=None, description=None, business_value=None,technical_priority=None,estimation_time=None,sprint_priority=None,us_type=None, column=None,project=None, sprint=None, sprint_member=None, version=None):
         """
-        restaura una version de una us
+        restaura una version de una us. Si se indica la version, la us solo se restaura si no
+        cambio desde esa version, si no se lanza StaleUserStoryError
         """
         data = {}
         if description:
@@ -109,7 +128,8 @@ class UserStoriesUseCase:
                 data['sprint'] = None
                 data['sprint_member'] = None
 
-        UserStory.objects.filter(pk=id).update(**data)
+        data['updated_at'] = timezone.now()
+        ProjectUseCase.update_user_story_version(id, version, **data)
         return UserStory.objects.get(pk=id)
 
     @staticmethod
@@ -137,14 +157,166 @@ class UserStoriesUseCase:
         Crea una tarea de una historia de usuario
         """
         sprint=user_story.sprint
-        return UserStoryTask.objects.create(
-            user_story=user_story,
-            sprint=sprint,
-            sprint_member=SprintMember.objects.get(user=user,sprint=sprint),
-            description=description,
-            hours_worked=hours,
-            column=user_story.column
-        )
+        with transaction.atomic():
+            task = UserStoryTask.objects.create(
+                user_story=user_story,
+                sprint=sprint,
+                sprint_member=SprintMember.objects.get(user=user,sprint=sprint),
+                description=description,
+                hours_worked=hours,
+                column=user_story.column
+            )
+            RollupUseCase.add_hours_worked(user_story.id, task.sprint_id, task.sprint_member_id, hours)
+            RollupUseCase.record_sprint_day(task.sprint_id, hours=hours)
+        UserStoriesUseCase.mark_board_changed(user_story.sprint_id, [user_story.id])
+        return task
+
+    @staticmethod
+    def mark_board_changed(sprint_id, user_story_ids):
+        """
+        Aumenta la version del tablero del sprint y se la asigna a los user stories modificados,
+        para que el tablero pida solo los user stories que cambiaron desde la version que conoce.
+        Dentro de una transaccion se debe llamar como ultima escritura, ver next_board_version.
+        Retorna la nueva version
+        """
+        if not sprint_id:
+            return None
+        with transaction.atomic():
+            version = UserStoriesUseCase.next_board_version(sprint_id)
+            UserStory.objects.filter(id__in=user_story_ids).update(
+                board_version=version, board_sprint_id=sprint_id, updated_at=timezone.now())
+        return version
+
+    @staticmethod
+    def mark_board_moved(old_sprint_id, new_sprint_id, user_story_ids):
+        """
+        Registra en el tablero un cambio que puede haber cambiado el sprint de los user stories.
+        Si salieron del sprint se registra en el tablero del sprint que dejaron, para que lo saque;
+        si ademas entraron a otro sprint, en el que este en progreso, que es el unico tablero visible.
+        Retorna la nueva version
+        """
+        if not old_sprint_id or old_sprint_id == new_sprint_id:
+            return UserStoriesUseCase.mark_board_changed(new_sprint_id, user_story_ids)
+        if new_sprint_id and Sprint.objects.filter(id=new_sprint_id, status=SprintStatus.IN_PROGRESS).exists():
+            return UserStoriesUseCase.mark_board_changed(new_sprint_id, user_story_ids)
+        return UserStoriesUseCase.mark_board_changed(old_sprint_id, user_story_ids)
+
+    @staticmethod
+    def next_board_version(sprint_id):
+        """
+        Aumenta y retorna la version del tablero del sprint. El UPDATE bloquea el sprint hasta el
+        commit, asi las versiones se confirman en orden; por eso se debe llamar al final de la
+        transaccion, para no serializar el resto de las escrituras de los movimientos del sprint
+        """
+        Sprint.objects.filter(id=sprint_id).update(board_version=F('board_version') + 1, updated_at=timezone.now())
+        return Sprint.objects.filter(id=sprint_id).values_list('board_version', flat=True).get()
+
+    @staticmethod
+    def move_user_story_column(user_story_id, column, user, project_id, version=None):
+        """
+        Mueve un user story de columna en una sola transaccion: un UPDATE del user story,
+        un UPDATE que deshabilita sus tareas y la entrada del historial.
+        No se bloquea el user story: el UPDATE es condicional a la version leida (o a la indicada)
+        y si otro usuario lo modifico antes se lanza StaleUserStoryError. La version del tablero
+        se aumenta al final, asi la fila del sprint solo queda bloqueada hasta el commit.
+        Si el user story no pertenece al proyecto o la columna no existe se lanza ValueError.
+        Retorna el user story antes y despues del cambio
+        """
+        with transaction.atomic():
+            old_user_story = UserStory.objects.select_related(
+                'us_type', 'project', 'sprint__project', 'sprint_member__user').filter(
+                id=user_story_id, project_id=project_id).first()
+            if old_user_story is None:
+                raise ValueError('La historia de usuario no pertenece al proyecto')
+            if not 0 <= column < len(old_user_story.us_type.columns):
+                raise ValueError(f'Columna invalida para la historia de usuario {old_user_story.code}')
+            if version is not None and version != old_user_story.version:
+                raise StaleUserStoryError('La historia de usuario fue modificada por otro usuario')
+            new_user_story = copy.copy(old_user_story)
+            new_user_story.column = column
+            new_user_story.updated_at = timezone.now()
+            new_user_story.version = old_user_story.version + 1
+
+            ProjectUseCase.update_user_story_version(
+                user_story_id, old_user_story.version, column=column, updated_at=new_user_story.updated_at)
+            UserStoryTask.objects.filter(user_story_id=user_story_id, disabled=False).update(
+                disabled=True, updated_at=new_user_story.updated_at)
+            done = new_user_story.is_done - old_user_story.is_done
+            if done:
+                RollupUseCase.record_sprint_day(new_user_story.sprint_id, done=done)
+            UserStoriesUseCase.create_user_story_history(old_user_story, new_user_story, user, project_id)
+            board_version = UserStoriesUseCase.mark_board_changed(new_user_story.sprint_id, [user_story_id])
+            if board_version is not None:
+                new_user_story.board_version = board_version
+        return old_user_story, new_user_story
+
+    @staticmethod
+    def move_user_stories_columns(moves, user, project_id):
+        """
+        Mueve varios user stories de columna en una sola transaccion: un UPDATE para todos los
+        user stories, otro que deshabilita sus tareas, un bulk_create del historial y al final
+        el aumento de la version del tablero de cada sprint.
+        moves es una lista de (id, columna, version). Si algun user story cambio desde la version
+        indicada no se mueve ninguno y se lanza StaleUserStoryError.
+        Retorna los user stories movidos
+        """
+        moves = {user_story_id: (column, version) for user_story_id, column, version in moves}
+        with transaction.atomic():
+            old_user_stories = list(UserStory.objects.filter(id__in=moves, project_id=project_id).select_related(
+                'us_type', 'project', 'sprint__project', 'sprint_member__user').order_by('id'))
+            if len(old_user_stories) != len(moves):
+                raise ValueError('Alguna de las historias de usuario no pertenece al proyecto')
+            for old_user_story in old_user_stories:
+                column, version = moves[old_user_story.id]
+                if version is not None and version != old_user_story.version:
+                    raise StaleUserStoryError('Alguna de las historias de usuario fue modificada por otro usuario')
+                if not 0 <= column < len(old_user_story.us_type.columns):
+                    raise ValueError(f'Columna invalida para la historia de usuario {old_user_story.code}')
+
+            now = timezone.now()
+            new_user_stories = []
+            condition = Q(pk__in=[])
+            columns = []
+            for old_user_story in old_user_stories:
+                new_user_story = copy.copy(old_user_story)
+                new_user_story.column = moves[old_user_story.id][0]
+                new_user_story.updated_at = now
+                new_user_story.version = old_user_story.version + 1
+                new_user_stories.append(new_user_story)
+                condition |= Q(id=old_user_story.id, version=old_user_story.version)
+                columns.append(When(id=old_user_story.id, then=Value(new_user_story.column)))
+
+            updated = UserStory.objects.filter(condition).update(
+                column=Case(*columns, output_field=IntegerField()), version=F('version') + 1, updated_at=now)
+            if updated != len(new_user_stories):
+                raise StaleUserStoryError('Alguna de las historias de usuario fue modificada por otro usuario')
+            UserStoryTask.objects.filter(user_story_id__in=moves, disabled=False).update(disabled=True, updated_at=now)
+            done_by_sprint = Counter()
+            for old_user_story, new_user_story in zip(old_user_stories, new_user_stories):
+                done_by_sprint[old_user_story.sprint_id] += new_user_story.is_done - old_user_story.is_done
+            for sprint_id, done in sorted(done_by_sprint.items(), key=lambda item: item[0] or 0):
+                if done:
+                    RollupUseCase.record_sprint_day(sprint_id, done=done)
+
+            histories = [UserStoriesUseCase.build_user_story_history(old_user_story, new_user_story)
+                         for old_user_story, new_user_story in zip(old_user_stories, new_user_stories)]
+            histories = [history for history in histories if history]
+            if histories:
+                project_member = RoleUseCase.get_project_member_by_user(user, project_id)
+                for history in histories:
+                    history.project_member = project_member
+                UserStoryHistory.objects.bulk_create(histories)
+
+            # Se aumenta en orden de id para que dos transacciones bloqueen los sprints en el mismo orden
+            user_stories_by_sprint = {}
+            for new_user_story in new_user_stories:
+                if new_user_story.sprint_id:
+                    user_stories_by_sprint.setdefault(new_user_story.sprint_id, []).append(new_user_story)
+            for sprint_id, user_stories in sorted(user_stories_by_sprint.items()):
+                board_version = UserStoriesUseCase.mark_board_changed(sprint_id, [us.id for us in user_stories])
+                for new_user_story in user_stories:
+                    new_user_story.board_version = board_version
+        return new_user_stories
 
     @staticmethod
     def delete_user_story_comment(id):
@@ -2,7 +2,7 @@ from django.shortcuts import render, redirect
 from django.views import View
 from user_stories.models import UserStoryHistory, UserStory
 from user_stories.usecase import UserStoriesUseCase
-from projects.usecase import ProjectUseCase
+from projects.usecase import ProjectUseCase, StaleUserStoryError
 from sprints.usecase import SprintUseCase
 from django.urls import reverse
 from projects.mixin import ProjectPermissionMixin, ProjectAccessMixin
@@ -47,6 +47,8 @@ class UserStoryHistoryRestoreView(CustomLoginMixin, ProjectPermissionMixin, User
             data["sprint"]=SprintUseCase.get_sprint_by_id(data["sprint"])
         if (data["sprint_member"]!=0):
             data["sprint_member"]=SprintUseCase.get_sprint_member_by_id(data["sprint_member"])
+        # Se guarda la version que vio el usuario para no restaurar sobre cambios posteriores
+        data["version"]=ProjectUseCase.get_user_story_by_id(id=user_story_id).version
         form = FormRestoreUserStoryHistory(project_id,initial=data)
         context= {
             "form" : form,
@@ -79,9 +81,20 @@ class UserStoryHistoryRestoreView(CustomLoginMixin, ProjectPermissionMixin, User
         }
         old_user_story = ProjectUseCase.get_user_story_by_id(id=user_story_id)
 
-        UserStoriesUseCase.restore_user_story(user_story_id,**data)
+        try:
+            version = int(request.POST['version'])
+        except (KeyError, ValueError):
+            messages.warning(request, "No se pudo identificar la version de la historia de usuario, intente de nuevo")
+            return redirect(reverse("projects:history:index", kwargs={"project_id": project_id, "user_story_id": user_story_id}))
+
+        try:
+            UserStoriesUseCase.restore_user_story(user_story_id, version=version, **data)
+        except StaleUserStoryError as e:
+            messages.warning(request, f"{e}, intente de nuevo")
+            return redirect(reverse("projects:history:index", kwargs={"project_id": project_id, "user_story_id": user_story_id}))
 
         new_user_story = ProjectUseCase.get_user_story_by_id(id=user_story_id)
+        UserStoriesUseCase.mark_board_moved(old_user_story.sprint_id, new_user_story.sprint_id, [user_story_id])
         result=UserStoriesUseCase.create_user_story_history(old_user_story, new_user_story, request.user, project_id)
 
         if  (result):
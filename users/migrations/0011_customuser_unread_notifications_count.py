@@ -0,0 +1,30 @@
+# Generated by Django 4.1 on 2026-10-18 19:10
+
+from django.db import migrations, models
+from django.db.models import Count, IntegerField, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+
+
+def count_unread_notifications(apps, schema_editor):
+    CustomUser = apps.get_model('users', 'CustomUser')
+    Notification = apps.get_model('notifications', 'Notification')
+    unread = Notification.objects.filter(user_id=OuterRef('pk'), read=False).order_by().values('user_id').annotate(
+        total=Count('id')).values('total')
+    CustomUser.objects.update(unread_notifications_count=Coalesce(Subquery(unread, output_field=IntegerField()), 0))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('notifications', '0001_initial'),
+        ('users', '0010_customuser_sprints'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='customuser',
+            name='unread_notifications_count',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.RunPython(count_unread_notifications, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,32 @@
+# Generated by Django 4.1 on 2026-10-18 19:32
+
+from django.db import migrations, models
+
+
+def fill_avatar_url(apps, schema_editor):
+    CustomUser = apps.get_model('users', 'CustomUser')
+    SocialAccount = apps.get_model('socialaccount', 'SocialAccount')
+    # Google es el unico proveedor configurado y guarda la foto en extra_data['picture']
+    avatars = {}
+    for user_id, extra_data in SocialAccount.objects.order_by('id').values_list('user_id', 'extra_data'):
+        avatars.setdefault(user_id, (extra_data or {}).get('picture') or '')
+    for user_id, avatar_url in avatars.items():
+        if avatar_url:
+            CustomUser.objects.filter(id=user_id).update(avatar_url=avatar_url)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('users', '0011_customuser_unread_notifications_count'),
+        ('socialaccount', '0003_extra_data_default_dict'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='customuser',
+            name='avatar_url',
+            field=models.URLField(blank=True, default='', editable=False, max_length=500),
+        ),
+        migrations.RunPython(fill_avatar_url, migrations.RunPython.noop),
+    ]
@@ -2,7 +2,6 @@ from django.db import models
 from django.contrib.auth.models import AbstractBaseUser
 
 from .manager import CustomUserManager
-from notifications.models import Notification
 class CustomUser(AbstractBaseUser):
     first_name = models.CharField(max_length=100, verbose_name='Nombres')
     last_name = models.CharField(max_length=100, verbose_name='Apellidos')
@@ -11,6 +10,10 @@ class CustomUser(AbstractBaseUser):
     is_active = models.BooleanField(default=True)
     role_system = models.CharField(max_length=50, null=True, verbose_name='Rol del sistema')
     sprints = models.ManyToManyField('sprints.Sprint', through='sprints.SprintMember')
+    # Contador de notificaciones no leidas, se mantiene desde NotificationUseCase
+    unread_notifications_count = models.PositiveIntegerField(default=0, editable=False)
+    # Foto de la cuenta social, se actualiza al iniciar sesion desde UserUseCase.update_avatar_url
+    avatar_url = models.URLField(max_length=500, blank=True, default='', editable=False)
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
     deleted_at = models.DateTimeField(null=True)
@@ -36,14 +39,13 @@ class CustomUser(AbstractBaseUser):
 
     @property
     def picture(self):
-        social_account_data = self.socialaccount_set.first()
-        if social_account_data:
-            return social_account_data.get_avatar_url()
+        if self.avatar_url:
+            return self.avatar_url
         return f"https://ui-avatars.com/api/?name={self.name}"
 
     @property
     def unread_notifications(self):
-        return Notification.objects.filter(user=self, read=False).count()
+        return self.unread_notifications_count
 
     class Meta:
         db_table = 'sga_user'
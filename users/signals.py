@@ -0,0 +1,19 @@
+from allauth.socialaccount.signals import social_account_added, social_account_removed, social_account_updated
+from django.dispatch import receiver
+
+from users.usecase import UserUseCase
+
+@receiver(social_account_added)
+@receiver(social_account_updated)
+def social_account_changed(request, sociallogin, **kwargs):
+    """
+    Actualiza la foto del usuario cuando conecta o reconecta una cuenta social
+    """
+    UserUseCase.update_avatar_url(sociallogin.user, sociallogin.account)
+
+@receiver(social_account_removed)
+def social_account_deleted(request, socialaccount, **kwargs):
+    """
+    Usa la foto de otra cuenta social del usuario, o ninguna, cuando desconecta una cuenta
+    """
+    UserUseCase.update_avatar_url(socialaccount.user)
@@ -14,6 +14,20 @@ class UserUseCase:
         user.save()
         return user
 
+    @staticmethod
+    def update_avatar_url(user, social_account=None):
+        """
+            Metodo para guardar la foto del usuario desde su cuenta social. Si no se indica la
+            cuenta se usa la primera que tenga, y si no tiene ninguna se borra la foto guardada
+        """
+        if social_account is None:
+            social_account = user.socialaccount_set.order_by('id').first()
+        avatar_url = (social_account and social_account.get_avatar_url()) or ''
+        if user.avatar_url != avatar_url:
+            CustomUser.objects.filter(id=user.id).update(avatar_url=avatar_url)
+            user.avatar_url = avatar_url
+        return avatar_url
+
     @staticmethod
     def users_by_filter(search):
         """